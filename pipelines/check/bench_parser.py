@@ -0,0 +1,109 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+root_dir = Path(__file__).parent.parent.parent
+root_dir_str = str(root_dir)
+if root_dir_str not in sys.path:
+    sys.path.append(root_dir_str)
+
+from pipelines.check.parser import legacy_parsers, read_jsonl_file, save_json
+from pipelines.check.parser_engine import get_grammar
+
+
+def load_corpus(input_paths, max_sentence=None):
+    """
+    (language, transcript) of every run record that has one.
+    """
+    corpus = []
+    for input_path in input_paths:
+        for obj in read_jsonl_file(input_path, max_sentence=max_sentence):
+            res = obj.get("check_info", {}).get("res")
+            if obj.get("language") in legacy_parsers and isinstance(res, str):
+                corpus.append((obj["language"], res))
+    return corpus
+
+
+def legacy_known_wrong(language, result):
+    """
+    Results of the legacy parsers that are wrong rather than merely different:
+    parse_cpp reports the number of assertions as passed tests on "All tests passed", and
+    raises on "Some tests failed (N failed)" without a passed count.
+    """
+    if language != "cpp":
+        return False
+    if isinstance(result, Exception):
+        return True
+    total, passed, failed, errors = result
+    return passed + failed + errors != total
+
+
+def time_parser(parse, outputs, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for output in outputs:
+            try:
+                parse(output)
+            except Exception:
+                pass
+    return time.perf_counter() - start
+
+
+def compare(language, outputs):
+    grammar = get_grammar(language)
+    mismatches, fixed = [], 0
+    for i, output in enumerate(outputs):
+        try:
+            legacy = legacy_parsers[language](output)
+        except Exception as e:
+            legacy = e
+        engine = grammar.parse(output)
+        if legacy == engine:
+            continue
+        if legacy_known_wrong(language, legacy):
+            fixed += 1
+        else:
+            mismatches.append({"index": i, "legacy": repr(legacy), "engine": engine})
+    return mismatches, fixed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare speed and counts of the legacy per-language parsers and the single-pass parser engine on recorded test transcripts.")
+    parser.add_argument("--input_path", "-input_path", nargs="+", type=str, default=["./check/dataset/answer_unit_test/xxxxx.jsonl"], help="Outputs of run_unit_test_index.py.")
+    parser.add_argument("--output_path", "-output_path", type=str, default="./check/dataset/bench_parser.json")
+    parser.add_argument("--max_samples", "-max_samples", type=int, default=None, help="Read at most N records per input file.")
+    parser.add_argument("--repeat", "-repeat", type=int, default=20, help="Times every transcript is parsed per parser.")
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    main_args = parse_args()
+    corpus = load_corpus(main_args.input_path, max_sentence=main_args.max_samples)
+    by_language = {}
+    for language, output in corpus:
+        by_language.setdefault(language, []).append(output)
+    report = {"input_path": main_args.input_path, "transcripts": len(corpus), "repeat": main_args.repeat, "languages": {}}
+    for language, outputs in sorted(by_language.items()):
+        legacy_seconds = time_parser(legacy_parsers[language], outputs, main_args.repeat)
+        engine_seconds = time_parser(get_grammar(language).parse, outputs, main_args.repeat)
+        mismatches, fixed = compare(language, outputs)
+        report["languages"][language] = {
+            "transcripts": len(outputs),
+            "megabytes": sum(len(output) for output in outputs) / 2 ** 20,
+            "legacy_seconds": legacy_seconds,
+            "engine_seconds": engine_seconds,
+            "speedup": legacy_seconds / max(engine_seconds, 1e-9),
+            "legacy_bugs_fixed": fixed,
+            "mismatches": mismatches,
+        }
+        print(f"{language:<12} transcripts {len(outputs):>6}  legacy {legacy_seconds:.3f}s  engine {engine_seconds:.3f}s  "
+              f"speedup {legacy_seconds / max(engine_seconds, 1e-9):.2f}x  mismatches {len(mismatches)}  legacy bugs fixed {fixed}")
+    save_json(report, main_args.output_path)
+    if any(stats["mismatches"] for stats in report["languages"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
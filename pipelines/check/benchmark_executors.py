@@ -0,0 +1,118 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import sys
+import time
+import traceback
+from pathlib import Path
+import tqdm
+
+root_dir = Path(__file__).parent.parent.parent
+root_dir_str = str(root_dir)
+if root_dir_str not in sys.path:
+    sys.path.append(root_dir_str)
+
+from pipelines.check.executors import EXECUTOR_MODES
+from pipelines.check.parser_engine import parse_output
+from pipelines.check import run_unit_test_index
+from pipelines.check.run_unit_test_index import (
+    ensure_directory_exists,
+    init_worker,
+    messages_update_data_map,
+    read_jsonl_file,
+    save_json,
+    unit_test_command_preparation,
+)
+
+
+def bench_worker(task_args):
+    index = task_args["index"]
+    obj = task_args["obj"]
+    tmp_path = task_args["tmp_path"]
+    result = {"index": index, "language": obj.get("language", "")}
+    start = time.time()
+    try:
+        check_data_map = messages_update_data_map(obj)
+        unit_test_cwd_path = unit_test_command_preparation(tmp_path, check_data_map)
+        success, returncode, res, command_str = run_unit_test_index.run_unit_test(unit_test_cwd_path, check_data_map["language"])
+        result["success"] = success
+        result["returncode"] = returncode
+        # report paths point into the sample's own directory
+        result["command"] = command_str.replace(str(Path(unit_test_cwd_path).absolute()), "<sample>")
+        result["counts"] = list(parse_output(check_data_map["language"], res))
+    except Exception as e:
+        result["success"] = False
+        result["returncode"] = None
+        result["error"] = str(e) + "\n" + traceback.format_exc()
+    result["seconds"] = time.time() - start
+    return result
+
+
+def run_mode(mode, objs, main_args):
+    tmp_path = Path(main_args.tmp_path).absolute() / mode
+    ensure_directory_exists(tmp_path, type="dir")
+    results = []
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=main_args.workers, initializer=init_worker, initargs=(mode, tmp_path)) as executor:
+        futures = [executor.submit(bench_worker, {"index": i, "obj": obj, "tmp_path": tmp_path}) for i, obj in enumerate(objs)]
+        for future in tqdm.tqdm(as_completed(futures), total=len(futures), desc=f"{mode} executor"):
+            results.append(future.result())
+    wall = time.time() - start
+    return sorted(results, key=lambda x: x["index"]), wall
+
+
+def summarize(mode, results, wall):
+    summary = {"wall_seconds": wall, "languages": {}}
+    for result in results:
+        stats = summary["languages"].setdefault(result["language"], {"samples": 0, "passed": 0, "seconds": 0.0})
+        stats["samples"] += 1
+        stats["passed"] += int(result["success"])
+        stats["seconds"] += result["seconds"]
+    for language, stats in summary["languages"].items():
+        stats["mean_seconds"] = stats["seconds"] / stats["samples"]
+    print(f"[{mode}] wall {wall:.1f}s")
+    for language, stats in sorted(summary["languages"].items()):
+        print(f"[{mode}] {language:<12} samples {stats['samples']:>4}  passed {stats['passed']:>4}  mean {stats['mean_seconds']:.2f}s/sample")
+    return summary
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare per-sample latency and verdicts of the verification executors on a fixed sample set.")
+    parser.add_argument("--input_path", "-input_path", type=str, default="./check/dataset/answer_unit_test/xxxxx.jsonl")
+    parser.add_argument("--tmp_path", "-tmp_path", type=str, default="./check/tmp_benchmark")
+    parser.add_argument("--output_path", "-output_path", type=str, default="./check/dataset/benchmark_executors.json")
+    parser.add_argument("--num_samples", "-num_samples", type=int, default=50, help="The first N samples of the input file are used.")
+    parser.add_argument("--workers", "-workers", type=int, default=1)
+    parser.add_argument("--modes", "-modes", nargs="+", type=str, default=EXECUTOR_MODES, choices=EXECUTOR_MODES)
+    args = parser.parse_args()
+    ensure_directory_exists(args.tmp_path, type="dir")
+    return args
+
+
+def main():
+    main_args = parse_args()
+    objs = read_jsonl_file(main_args.input_path, max_sentence=main_args.num_samples)
+    report = {"input_path": main_args.input_path, "num_samples": len(objs), "workers": main_args.workers, "modes": {}}
+    verdicts = {}
+    for mode in main_args.modes:
+        results, wall = run_mode(mode, objs, main_args)
+        report["modes"][mode] = summarize(mode, results, wall)
+        verdicts[mode] = [(result["success"], result["returncode"], result.get("command"), result.get("counts")) for result in results]
+
+    if len(verdicts) > 1:
+        base_mode, *other_modes = list(verdicts)
+        for mode in other_modes:
+            mismatches = [i for i, (a, b) in enumerate(zip(verdicts[base_mode], verdicts[mode])) if a[0] != b[0]]
+            report["modes"][mode]["verdict_mismatches"] = mismatches
+            print(f"[{mode}] pass/fail mismatches against {base_mode}: {len(mismatches)} {mismatches[:20]}")
+            # warm mode reports the cold command and its transcript parses to the same counts
+            for field, name in [(2, "command"), (3, "count")]:
+                mismatches = [i for i, (a, b) in enumerate(zip(verdicts[base_mode], verdicts[mode])) if a[field] != b[field]]
+                report["modes"][mode][f"{name}_mismatches"] = mismatches
+                print(f"[{mode}] {name} mismatches against {base_mode}: {len(mismatches)} {mismatches[:20]}")
+            base_wall = report["modes"][base_mode]["wall_seconds"]
+            print(f"[{mode}] speedup against {base_mode}: {base_wall / max(report['modes'][mode]['wall_seconds'], 1e-9):.2f}x")
+    save_json(report, main_args.output_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+
+root_dir = Path(__file__).parent.parent.parent
+root_dir_str = str(root_dir)
+if root_dir_str not in sys.path:
+    sys.path.append(root_dir_str)
+
+from pipelines.utils.setting import APPEND_FILES
+from pipelines.check.executors import CPP_COMPILE_FLAGS, UNIT_TEST_RESOURCES_PATH, cxx, template_untouched
+from pipelines.check.reports import GRADLE_RESULTS_DIR, REPORT_DIR
+
+BUILD_LANGUAGES = ["rust", "cpp", "java"]
+# build output and local state that never belongs to the solution
+IGNORED_DIRS = {".docs", "build", "target", ".gradle", "node_modules", REPORT_DIR}
+
+
+def solution_hash(unit_test_cwd_path, language, test_files):
+    """
+    Hash of every file of the workspace except the tests: the same solution paired with
+    another test suite gets the same key.
+    """
+    unit_test_cwd_path = Path(unit_test_cwd_path)
+    test_files = set(test_files)
+    sha = hashlib.sha256(language.encode())
+    for rel in sorted(_solution_files(unit_test_cwd_path, test_files)):
+        sha.update(b"\0" + rel.encode() + b"\0" + (unit_test_cwd_path / rel).read_bytes())
+    return sha.hexdigest()
+
+
+def _solution_files(unit_test_cwd_path, test_files):
+    for root, dirs, files in os.walk(unit_test_cwd_path):
+        dirs[:] = [d for d in dirs if d not in IGNORED_DIRS]
+        for name in files:
+            rel = os.path.relpath(os.path.join(root, name), unit_test_cwd_path)
+            if rel not in test_files:
+                yield rel
+
+
+class BuildCache:
+    """
+    Split compiled languages into a build phase and a test phase, and keep the build phase's
+    artifacts per solution so that pairing one solution with N test suites builds it once.
+    Each solution key owns root/<language>/<key>/ with a copy of the solution and the result
+    of its build in build.json; a build the compiler failed (a normal nonzero exit) is cached
+    too and fails every later pairing with the same output, while one that was killed (a
+    signal, the cgroup's OOM killer, or the timeout) is not cached and is retried next time.
+        rust: `cargo build --lib` in the key's source dir with its own target dir; the test
+              phase swaps the test files into that dir and runs `cargo test` there.
+        java: `gradlew compileJava`, then the test files are swapped in and `gradlew test`
+              finds compileJava up to date.
+        cpp:  the solution's .cpp is compiled to an object once; the test phase compiles the
+              test file in the sample workspace and links it with the cached objects.
+    rust and java test phases run in the shared dir under the key's lock, so test suites of
+    one solution run one at a time. Samples that do not fit these layouts run as before.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root).absolute()
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def supports(self, unit_test_cwd_path, language, test_files):
+        if language not in BUILD_LANGUAGES or not test_files:
+            return False
+        unit_test_cwd_path = Path(unit_test_cwd_path)
+        if language == "rust":
+            return (unit_test_cwd_path / "Cargo.toml").exists() and (unit_test_cwd_path / "src" / "lib.rs").exists()
+        if language == "java":
+            return template_untouched(unit_test_cwd_path, "java", ["gradlew"])
+        file = unit_test_cwd_path.name.replace("-", "_")
+        return template_untouched(unit_test_cwd_path, "cpp", ["CMakeLists.txt", "cpp-test.sh", "tests-main.cpp"]) \
+            and (unit_test_cwd_path / f"{file}_test.cpp").exists() \
+            and (unit_test_cwd_path / f"{file}.h").exists()
+
+    def run(self, executor, unit_test_cwd_path, language, test_files, env):
+        """
+        Returns the executor's (success, returncode, res, command_str), command_str being the
+        cold executor's, and sets executor.build_info to {"key", "cached", "success"}.
+        """
+        unit_test_cwd_path = Path(unit_test_cwd_path)
+        key = solution_hash(unit_test_cwd_path, language, test_files)
+        key_dir = self.root / language / key
+        key_dir.mkdir(parents=True, exist_ok=True)
+        return getattr(self, f"_run_{language}")(executor, unit_test_cwd_path, key, key_dir, test_files, env)
+
+    @contextlib.contextmanager
+    def _lock(self, path):
+        with open(path, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _build(self, executor, key, key_dir, command_lists, cwd, env):
+        """
+        Run the build commands once per key (caller holds the key's lock) and return the
+        cached {"returncode", "res", "command"}.
+        """
+        result_path = key_dir / "build.json"
+        cached = result_path.exists()
+        if cached:
+            with open(result_path, "r") as f:
+                result = json.load(f)
+        else:
+            returncode, res = 0, ""
+            for command_list in command_lists:
+                returncode, command_res = executor._command(command_list, cwd, env, executor.timeout)
+                res += command_res
+                if returncode != 0:
+                    break
+            result = {"returncode": returncode, "res": res, "command": " && ".join(" ".join(c) for c in command_lists)}
+            # a timeout raises before this point; a killed build says nothing about the code
+            killed = returncode < 0 or executor.usage.get("oom_killed")
+            if not killed:
+                # written last, so a build killed half way is simply redone
+                tmp_path = result_path.with_suffix(f".{os.getpid()}.tmp")
+                with open(tmp_path, "w") as f:
+                    json.dump(result, f)
+                os.rename(tmp_path, result_path)
+        executor.build_info = {"key": key, "cached": cached, "success": result["returncode"] == 0}
+        return result
+
+    def _copy_solution(self, unit_test_cwd_path, source_dir, test_files):
+        if not source_dir.exists():
+            building = source_dir.with_name(f"{source_dir.name}.{os.getpid()}")
+            shutil.rmtree(building, ignore_errors=True)
+            for rel in _solution_files(unit_test_cwd_path, set(test_files)):
+                (building / rel).parent.mkdir(parents=True, exist_ok=True)
+                shutil.copy2(unit_test_cwd_path / rel, building / rel)
+            os.rename(building, source_dir)
+
+    def _swap_tests(self, unit_test_cwd_path, source_dir, test_files):
+        """
+        Replace the previous pairing's test files in source_dir with this sample's.
+        """
+        tests_path = source_dir.parent / "tests.json"
+        if tests_path.exists():
+            with open(tests_path, "r") as f:
+                for rel in json.load(f):
+                    (source_dir / rel).unlink(missing_ok=True)
+        for rel in test_files:
+            (source_dir / rel).parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(unit_test_cwd_path / rel, source_dir / rel)
+            # make sure cargo/gradle see the new tests even within the mtime granularity
+            now = time.time()
+            os.utime(source_dir / rel, (now, now))
+        with open(tests_path, "w") as f:
+            json.dump(list(test_files), f)
+
+    # rust
+    def _run_rust(self, executor, unit_test_cwd_path, key, key_dir, test_files, env):
+        env = dict(env, CARGO_TARGET_DIR=str(key_dir / "target"))
+        source_dir = key_dir / "source"
+        with self._lock(key_dir / "build.lock"):
+            self._copy_solution(unit_test_cwd_path, source_dir, test_files)
+            build = self._build(executor, key, key_dir, [["cargo", "build", "--lib"]], source_dir, env)
+            command_list = executor.test_command("rust")
+            if build["returncode"] != 0:
+                return False, build["returncode"], build["res"], " ".join(command_list)
+            self._swap_tests(unit_test_cwd_path, source_dir, test_files)
+            returncode, res = executor._command(command_list, source_dir, env, executor.timeout)
+        return returncode == 0, returncode, res, " ".join(command_list)
+
+    # java
+    def _run_java(self, executor, unit_test_cwd_path, key, key_dir, test_files, env):
+        source_dir = key_dir / "source"
+        command_list = executor.test_command("java")
+        build_command = [part if part != "test" else "compileJava" for part in command_list]
+        with self._lock(key_dir / "build.lock"):
+            self._copy_solution(unit_test_cwd_path, source_dir, test_files)
+            build = self._build(executor, key, key_dir, [build_command], source_dir, env)
+            if build["returncode"] != 0:
+                return False, build["returncode"], build["res"], " ".join(command_list)
+            self._swap_tests(unit_test_cwd_path, source_dir, test_files)
+            shutil.rmtree(source_dir / GRADLE_RESULTS_DIR, ignore_errors=True)
+            returncode, res = executor._command(command_list, source_dir, env, executor.timeout)
+            # the sample's workspace gets the JUnit XML of its own run
+            if (source_dir / GRADLE_RESULTS_DIR).exists():
+                shutil.copytree(source_dir / GRADLE_RESULTS_DIR, unit_test_cwd_path / GRADLE_RESULTS_DIR, dirs_exist_ok=True)
+        return returncode == 0, returncode, res, " ".join(command_list)
+
+    # cpp
+    def _cpp_main_object(self, executor, env):
+        main_dir = self.root / "cpp" / "tests-main"
+        main_object = main_dir / "tests-main.o"
+        with self._lock(self.root / "cpp" / "tests-main.lock"):
+            if not main_object.exists():
+                main_dir.mkdir(parents=True, exist_ok=True)
+                shutil.copy(UNIT_TEST_RESOURCES_PATH / "cpp" / "catch.hpp", main_dir / "catch.hpp")
+                (main_dir / "tests-main.cpp").write_text(APPEND_FILES["cpp"]["tests-main.cpp"])
+                command_list = [cxx(env), *CPP_COMPILE_FLAGS, "-c", "tests-main.cpp", "-o", "tests-main.o.tmp"]
+                returncode, res = executor._command(command_list, main_dir, env, executor.timeout)
+                if returncode != 0:
+                    raise Exception(f"Cannot build Catch2 main: {res}")
+                os.rename(main_dir / "tests-main.o.tmp", main_object)
+        return main_object
+
+    def _run_cpp(self, executor, unit_test_cwd_path, key, key_dir, test_files, env):
+        start = time.time()
+        exercise = unit_test_cwd_path.name
+        file = exercise.replace("-", "_")
+        source_dir = key_dir / "source"
+        objects = [str(self._cpp_main_object(executor, env))]
+        with self._lock(key_dir / "build.lock"):
+            self._copy_solution(unit_test_cwd_path, source_dir, test_files)
+            command_lists = []
+            if (source_dir / f"{file}.cpp").exists():
+                command_lists.append([cxx(env), *CPP_COMPILE_FLAGS, "-c", f"{file}.cpp", "-o", str(key_dir / "solution.o")])
+            build = self._build(executor, key, key_dir, command_lists, source_dir, env)
+        # the command string of the cold executor, so check_info.command does not depend on the cache
+        command_str = " ".join(executor.test_command("cpp"))
+        if build["returncode"] != 0:
+            return False, build["returncode"], build["res"], command_str
+        if (key_dir / "solution.o").exists():
+            objects.append(str(key_dir / "solution.o"))
+        build_dir = unit_test_cwd_path / "build"
+        build_dir.mkdir(exist_ok=True)
+        compile_command = [cxx(env), *CPP_COMPILE_FLAGS, f"{file}_test.cpp", *objects, "-o", str(build_dir / exercise)]
+        returncode, res = executor._command(compile_command, unit_test_cwd_path, env, executor.timeout)
+        if returncode == 0:
+            remaining = max(executor.timeout - (time.time() - start), 1)
+            returncode, test_res = executor._command(executor.binary_command(str(build_dir / exercise)), build_dir, env, remaining)
+            res += test_res
+        return returncode == 0, returncode, res, command_str
+
@@ -0,0 +1,342 @@
+import fcntl
+import os
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+root_dir = Path(__file__).parent.parent.parent
+root_dir_str = str(root_dir)
+if root_dir_str not in sys.path:
+    sys.path.append(root_dir_str)
+
+from pipelines.utils.setting import APPEND_FILES
+from pipelines.check.limits import kill_process_group, record_usage, remove_cgroup, run_limited, wait_with_rusage
+from pipelines.check.reports import catch_report_args, load_report, prepare_report, report_command, report_env
+
+UNIT_TEST_RESOURCES_PATH = root_dir / "pipelines" / "utils" / "unit_test_resources"
+EXECUTOR_MODES = ["cold", "warm"]
+GRADLE_DAEMON_IDLE_TIMEOUT_MS = 10 * 60 * 1000
+
+# Same steps as APPEND_FILES["javascript"]["npm-test.sh"], minus the per-sample
+# `npm install -g jest` which the warm executor does once per worker.
+WARM_NPM_TEST_SCRIPT = """sed -i 's/\\bxtest(/test(/g' *.spec.js
+npm i
+npm run test -- "$@"
+"""
+# With node_modules linked from the sandbox cache there is nothing left to install.
+CACHED_NPM_TEST_SCRIPT = """sed -i 's/\\bxtest(/test(/g' *.spec.js
+npm run test -- "$@"
+"""
+
+# Mirrors the compile flags APPEND_FILES["cpp"]["CMakeLists.txt"] gives the exercise target.
+CPP_COMPILE_FLAGS = ["-g", "-std=c++20", "-Wall", "-Wextra", "-Wpedantic", "-Werror"]
+WARM_PYTEST_MODULES = {"pytest", "_pytest", "pluggy", "iniconfig", "packaging", "py"}
+
+
+def template_untouched(unit_test_cwd_path, language, filenames):
+    for filename in filenames:
+        file_path = Path(unit_test_cwd_path) / filename
+        if not file_path.exists() or file_path.read_text(errors="replace") != APPEND_FILES[language][filename]:
+            return False
+    return True
+
+
+def cxx(env):
+    return env.get("CXX") or shutil.which("c++", path=env.get("PATH")) or "g++"
+
+
+def run_command(command_list, cwd, env, timeout):
+    result = subprocess.run(
+            command_list,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            timeout=timeout,
+            cwd=cwd,
+            env=env,
+            encoding="utf-8",
+            errors="replace",
+    )
+    return result.returncode, result.stdout
+
+
+class ColdExecutor:
+    """
+    Run every sample with a fresh toolchain invocation (the original behaviour).
+    Every executor returns (success, returncode, res, command_str) from `run`, and leaves
+    the wall time, cpu time and peak RSS of the commands it ran in `usage`.
+    Commands run in their own process group under `limits` (a ResourceLimits, optional).
+    With a BuildCache, compiled languages build the solution once and only run the tests
+    (given as paths relative to the workspace) per sample; `build_info` then says whether
+    the build was cached.
+    With `reports`, the toolchains also write machine-readable results (see reports.py),
+    which end up per test in `report`.
+    """
+    mode = "cold"
+
+    def __init__(self, test_commands, env, timeout, sandbox_cache=None, limits=None, build_cache=None, reports=False):
+        self.test_commands = test_commands
+        self.env = env
+        self.timeout = timeout
+        self.sandbox_cache = sandbox_cache
+        self.limits = limits
+        self.build_cache = build_cache
+        self.reports = reports
+        self.usage = {}
+        self.build_info = None
+        self.report = None
+        self.report_path = None
+
+    def run(self, unit_test_cwd_path, language, test_files=None):
+        unit_test_cwd_path = Path(unit_test_cwd_path)
+        self.usage = {}
+        self.build_info = None
+        self.report = None
+        self.report_path = prepare_report(unit_test_cwd_path, language) if self.reports else None
+        env = report_env(language, self.env, self.report_path) if self.reports else self.env
+        if self.sandbox_cache is None:
+            result = self._run_split(unit_test_cwd_path, language, env, test_files)
+        else:
+            with self.sandbox_cache.acquire(unit_test_cwd_path, language, env) as env:
+                result = self._run_split(unit_test_cwd_path, language, env, test_files)
+        if not self.reports:
+            return result
+        success, returncode, res, command_str = result
+        self.report, res = load_report(unit_test_cwd_path, language, self.report_path, res)
+        return success, returncode, res, command_str
+
+    def test_command(self, language, command_list=None):
+        """
+        The test command of `language` (or `command_list`), with the reporter switched on if asked.
+        """
+        command_list = self.test_commands[language] if command_list is None else command_list
+        if not self.reports:
+            return command_list
+        return report_command(language, command_list, self.report_path)
+
+    def binary_command(self, binary):
+        # a Catch2 test binary run without cmake
+        return [binary, *catch_report_args(self.report_path)] if self.reports else [binary]
+
+    def _run_split(self, unit_test_cwd_path, language, env, test_files):
+        if self.build_cache is not None and self.build_cache.supports(unit_test_cwd_path, language, test_files):
+            return self.build_cache.run(self, unit_test_cwd_path, language, test_files, env)
+        return self._run(unit_test_cwd_path, language, env)
+
+    def _run(self, unit_test_cwd_path, language, env):
+        if language == "javascript" and _node_modules_cached(unit_test_cwd_path):
+            return self._run_script(CACHED_NPM_TEST_SCRIPT, unit_test_cwd_path, env)
+        command_list = self.test_command(language)
+        returncode, res = self._command(command_list, unit_test_cwd_path, env, self.timeout)
+        return returncode == 0, returncode, res, " ".join(command_list)
+
+    def _command(self, command_list, cwd, env, timeout):
+        return run_limited(command_list, cwd, env, timeout, self.limits, self.usage)
+
+    def _run_script(self, script, unit_test_cwd_path, env):
+        # the script's "$@" gets the reporter arguments
+        returncode, res = self._command(self.test_command("javascript", ["bash", "-c", script, "bash"]), unit_test_cwd_path, env, self.timeout)
+        return returncode == 0, returncode, res, "bash -c " + "; ".join(script.strip().splitlines())
+
+    def close(self):
+        pass
+
+
+class WarmExecutor(ColdExecutor):
+    """
+    Keep per-language toolchain state alive for the lifetime of one worker process:
+        python:     tests run in a fork of this interpreter with pytest already imported.
+        rust:       one CARGO_TARGET_DIR per worker, reused across samples (unless a SandboxCache provides one).
+        java:       gradle daemons are kept alive instead of `--no-daemon`, unless the limits use
+                    cgroups: the daemon would die with the first sample's cgroup and run the
+                    tests of later ones outside their own, so java then runs the cold command.
+        javascript: jest is installed globally once per worker, not once per sample.
+        cpp:        the Catch2 main object is compiled once per worker and linked into every sample.
+    go already reuses its global build cache, so it runs the cold command.
+    Samples that override the templated build scripts fall back to the cold command,
+    so the pass/fail verdict and check_info are the same as in cold mode.
+    `command` is always the cold-mode command string. `res` holds the same test runner output
+    (and so parses to the same counts), but not the build steps the warm path skips: no npm
+    install for javascript, no cmake/make lines for cpp (the compiler's output instead), and
+    gradle's daemon messages for java. benchmark_executors.py checks verdicts, commands and
+    parsed counts against cold mode.
+    """
+    mode = "warm"
+
+    def __init__(self, test_commands, env, timeout, work_dir, sandbox_cache=None, limits=None, build_cache=None, reports=False):
+        super().__init__(test_commands, env, timeout, sandbox_cache, limits, build_cache, reports)
+        self.work_dir = Path(work_dir).absolute() / f"worker_{os.getpid()}"
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self.shared_dir = Path(work_dir).absolute()
+        self.warmed = {}
+
+    def _run(self, unit_test_cwd_path, language, env):
+        runner = getattr(self, f"_run_{language}", None)
+        if runner is None or not self._warm(language):
+            return super()._run(unit_test_cwd_path, language, env)
+        return runner(unit_test_cwd_path, env)
+
+    def close(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def _warm(self, language):
+        if language not in self.warmed:
+            warmer = getattr(self, f"_warm_{language}", None)
+            try:
+                self.warmed[language] = warmer() if warmer else True
+            except Exception as e:
+                print(f"Warning: cannot warm {language} executor, using cold commands: {e}")
+                self.warmed[language] = False
+        return self.warmed[language]
+
+    # python
+    def _warm_python(self):
+        import pytest  # noqa: F401
+        import _pytest.assertion.rewrite  # noqa: F401
+        import _pytest.python  # noqa: F401
+        import _pytest.terminal  # noqa: F401
+        return True
+
+    def _run_python(self, unit_test_cwd_path, env):
+        log_path = self.work_dir / "pytest.log"
+        cgroup = self.limits.create_cgroup() if self.limits is not None else None
+        start = time.monotonic()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _pytest_in_fork(str(unit_test_cwd_path), str(log_path), env, self.test_command("python")[1:], self.limits, cgroup)
+            finally:
+                # never return into the worker's code from the child
+                os._exit(1)
+        try:
+            returncode, rusage = wait_with_rusage(pid, self.timeout)
+            if returncode is None:
+                kill_process_group(pid)
+                _, _, rusage = os.wait4(pid, 0)
+                record_usage(self.usage, None, rusage, time.monotonic() - start, cgroup)
+                raise subprocess.TimeoutExpired(self.test_commands["python"], self.timeout)
+            record_usage(self.usage, returncode, rusage, time.monotonic() - start, cgroup)
+        finally:
+            remove_cgroup(cgroup)
+        res = log_path.read_text(encoding="utf-8", errors="replace")
+        return returncode == 0, returncode, res, " ".join(self.test_command("python"))
+
+    # rust
+    def _warm_rust(self):
+        (self.work_dir / "cargo-target").mkdir(parents=True, exist_ok=True)
+        return True
+
+    def _run_rust(self, unit_test_cwd_path, env):
+        # with a sandbox cache the target dir is keyed by Cargo.toml instead of by worker
+        if self.sandbox_cache is None:
+            env = dict(env, CARGO_TARGET_DIR=str(self.work_dir / "cargo-target"))
+        command_list = self.test_command("rust")
+        returncode, res = self._command(command_list, unit_test_cwd_path, env, self.timeout)
+        return returncode == 0, returncode, res, " ".join(command_list)
+
+    # java
+    def _run_java(self, unit_test_cwd_path, env):
+        cgroups = self.limits is not None and self.limits.cgroup_path is not None
+        if cgroups or not template_untouched(unit_test_cwd_path, "java", ["gradlew"]):
+            return super()._run(unit_test_cwd_path, "java", env)
+        command_list = ["./gradlew", "test", "--daemon", f"-Dorg.gradle.daemon.idletimeout={GRADLE_DAEMON_IDLE_TIMEOUT_MS}"]
+        returncode, res = self._command(command_list, unit_test_cwd_path, env, self.timeout)
+        return returncode == 0, returncode, res, " ".join(self.test_command("java"))
+
+    # javascript
+    def _warm_javascript(self):
+        # workers share the global npm prefix, so only one of them installs at a time
+        with open(self.shared_dir / "npm-global.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if shutil.which("jest", path=self.env.get("PATH")) is None:
+                returncode, res = run_command(["npm", "install", "-g", "jest"], self.work_dir, self.env, self.timeout)
+                if returncode != 0:
+                    raise Exception(f"npm install -g jest failed: {res}")
+        return True
+
+    def _run_javascript(self, unit_test_cwd_path, env):
+        if not template_untouched(unit_test_cwd_path, "javascript", ["npm-test.sh"]) or _node_modules_cached(unit_test_cwd_path):
+            return super()._run(unit_test_cwd_path, "javascript", env)
+        success, returncode, res, _ = self._run_script(WARM_NPM_TEST_SCRIPT, unit_test_cwd_path, env)
+        return success, returncode, res, " ".join(self.test_command("javascript"))
+
+    # cpp
+    def _warm_cpp(self):
+        cpp_dir = self.work_dir / "cpp"
+        cpp_dir.mkdir(parents=True, exist_ok=True)
+        shutil.copy(UNIT_TEST_RESOURCES_PATH / "cpp" / "catch.hpp", cpp_dir / "catch.hpp")
+        (cpp_dir / "tests-main.cpp").write_text(APPEND_FILES["cpp"]["tests-main.cpp"])
+        command_list = [cxx(self.env), *CPP_COMPILE_FLAGS, "-c", "tests-main.cpp", "-o", "tests-main.o"]
+        returncode, res = run_command(command_list, cpp_dir, self.env, self.timeout)
+        if returncode != 0:
+            raise Exception(f"Cannot build Catch2 main: {res}")
+        return True
+
+    def _run_cpp(self, unit_test_cwd_path, env):
+        exercise = unit_test_cwd_path.name
+        file = exercise.replace("-", "_")
+        if not template_untouched(unit_test_cwd_path, "cpp", ["CMakeLists.txt", "cpp-test.sh", "tests-main.cpp"]) \
+                or not (unit_test_cwd_path / f"{file}_test.cpp").exists() \
+                or not (unit_test_cwd_path / f"{file}.h").exists():
+            return super()._run(unit_test_cwd_path, "cpp", env)
+        start = time.time()
+        build_dir = unit_test_cwd_path / "build"
+        build_dir.mkdir(exist_ok=True)
+        sources = [f"{file}_test.cpp"]
+        if (unit_test_cwd_path / f"{file}.cpp").exists():
+            sources.append(f"{file}.cpp")
+        compile_command = [cxx(self.env), *CPP_COMPILE_FLAGS, *sources, str(self.work_dir / "cpp" / "tests-main.o"), "-o", str(build_dir / exercise)]
+        returncode, res = self._command(compile_command, unit_test_cwd_path, env, self.timeout)
+        if returncode == 0:
+            remaining = max(self.timeout - (time.time() - start), 1)
+            returncode, test_res = self._command(self.binary_command(str(build_dir / exercise)), build_dir, env, remaining)
+            res += test_res
+        return returncode == 0, returncode, res, " ".join(self.test_command("cpp"))
+
+
+def _node_modules_cached(unit_test_cwd_path):
+    # SandboxCache links node_modules in; the template npm-test.sh would reinstall into it
+    return (unit_test_cwd_path / "node_modules").is_symlink() and \
+        (unit_test_cwd_path / "npm-test.sh").exists() and \
+        (unit_test_cwd_path / "npm-test.sh").read_text(errors="replace") == APPEND_FILES["javascript"]["npm-test.sh"]
+
+
+def _pytest_in_fork(cwd, log_path, env, args, limits=None, cgroup=None):
+    # the child gets its own process group so a timeout also kills anything the tests spawned
+    os.setsid()
+    if limits is not None:
+        limits.apply(cgroup)
+    log_fd = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    os.dup2(log_fd, 1)
+    os.dup2(log_fd, 2)
+    os.chdir(cwd)
+    os.environ.clear()
+    os.environ.update(env)
+    # the `pytest` console script does not have the pipeline directories on sys.path
+    pipeline_dirs = {root_dir_str, str(Path(__file__).parent)}
+    sys.path[:] = [p for p in sys.path if p not in pipeline_dirs]
+    # third-party modules the worker imported (openai, anyio, ...) would otherwise shadow the
+    # sample's imports and make pytest warn that it cannot assert-rewrite its plugins
+    for name in list(sys.modules):
+        if name.split(".")[0] not in WARM_PYTEST_MODULES and name.split(".")[0] not in sys.stdlib_module_names:
+            del sys.modules[name]
+    sys.argv = ["pytest"]
+    returncode = 1
+    try:
+        import pytest
+        returncode = int(pytest.main(args))
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(returncode)
+
+
+def make_executor(mode, test_commands, env, timeout, work_dir, sandbox_cache=None, limits=None, build_cache=None, reports=False):
+    if mode == "cold":
+        return ColdExecutor(test_commands, env, timeout, sandbox_cache, limits, build_cache, reports)
+    elif mode == "warm":
+        return WarmExecutor(test_commands, env, timeout, work_dir, sandbox_cache, limits, build_cache, reports)
+    else:
+        raise ValueError(f"Invalid executor mode: {mode}")
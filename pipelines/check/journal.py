@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+
+
+def _sha256_json(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def sample_key(check_data_map):
+    """
+    Stable hash of what actually gets executed: two records with the same files, config
+    and language get the same verdict, whichever generation run they came from.
+    """
+    return _sha256_json({
+        "language": check_data_map.get("language", ""),
+        "contents": check_data_map.get("contents", {}),
+        "config": check_data_map.get("config", {}),
+    })
+
+
+def record_key(obj):
+    """
+    Hash of one input record, used to tell whether it was already written to the output.
+    """
+    return _sha256_json(obj)
+
+
+def verdict_of(check_info):
+    """
+    What the journal keeps of a check_info: the outcome and a hash of the transcript, the
+    full check_info stays in the output file.
+    """
+    res = check_info.get("res")
+    return {
+        "success": check_info.get("success"),
+        "returncode": check_info.get("returncode"),
+        "res_sha256": hashlib.sha256(res.encode("utf-8")).hexdigest() if isinstance(res, str) else None,
+    }
+
+
+def read_output_line(path, offset):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return json.loads(f.readline())
+
+
+class CompletionJournal:
+    """
+    Append-only JSONL journal of verification results:
+        {"record": record_key, "sample": sample_key, "status": "done" | "failed",
+         "verdict": verdict_of(check_info), "output": [output path, byte offset of the line]}
+    A record with a "done" entry is already in the output file and is skipped on restart;
+    "failed" entries are retried. "done" entries also serve their check_info to any later
+    record with the same sample key, so identical payloads are only executed once; only the
+    compact verdict is held in memory, and check_info(sample) reads the full one back from
+    the output line the entry points at (and gives None if that line no longer matches).
+    Entries of older journals that carry the whole check_info still mark their records done,
+    but their verdicts are not reused.
+    Lines are fsync'ed after each append, so a killed run loses at most the batch in flight.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done_records = set()
+        self.verdicts = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # a line cut short by a kill, its record is simply rerun
+                        continue
+                    self._add(entry)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = open(path, "a", encoding="utf-8")
+
+    def _add(self, entry):
+        if entry.get("status") != "done":
+            return
+        self.done_records.add(entry["record"])
+        if entry.get("sample") and entry.get("output") and entry.get("verdict"):
+            self.verdicts[entry["sample"]] = (entry["verdict"], tuple(entry["output"]))
+
+    def record_done(self, record):
+        return record in self.done_records
+
+    def verdict(self, sample):
+        """
+        The compact verdict of a sample key, or None.
+        """
+        known = self.verdicts.get(sample)
+        return known[0] if known is not None else None
+
+    def check_info(self, sample):
+        """
+        The full check_info of a sample key from the output file, or None.
+        """
+        known = self.verdicts.get(sample)
+        if known is None:
+            return None
+        verdict, (path, offset) = known
+        try:
+            check_info = read_output_line(path, offset)["check_info"]
+        except (OSError, ValueError, KeyError, TypeError):
+            check_info = None
+        if check_info is None or verdict_of(check_info) != verdict:
+            # the output file was moved or rewritten: run the sample again
+            del self.verdicts[sample]
+            return None
+        return check_info
+
+    def append(self, entries):
+        if not entries:
+            return
+        for entry in entries:
+            self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._add(entry)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
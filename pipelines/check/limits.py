@@ -0,0 +1,193 @@
+import os
+import resource
+import signal
+import subprocess
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+CGROUP_V2_ROOT = Path("/sys/fs/cgroup")
+
+
+class ResourceLimits:
+    """
+    Limits applied to every test command, 0/None means unlimited.
+        cpu_seconds: RLIMIT_CPU of each process (SIGXCPU, then SIGKILL).
+        memory_mb:   memory.max of the run's cgroup, or RLIMIT_DATA of each process without one.
+                     RLIMIT_DATA is used instead of RLIMIT_AS because the JVM and the go runtime
+                     reserve far more address space than they ever touch.
+        max_pids:    pids.max of the run's cgroup, or RLIMIT_NPROC without one. RLIMIT_NPROC
+                     counts every process of the user, so size it for the whole host, and the
+                     kernel does not enforce it for root: running as root needs a cgroup.
+    The wall-clock limit is the executor timeout; on expiry the whole process group is killed.
+    With cgroup_path pointing at a delegated cgroup v2 directory, every command runs in its own
+    child cgroup, so limits and accounting cover everything the tests spawn.
+    """
+
+    def __init__(self, cpu_seconds=None, memory_mb=None, max_pids=None, cgroup_path=None):
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.max_pids = max_pids
+        self.cgroup_path = Path(cgroup_path) if cgroup_path else None
+        if self.cgroup_path is not None and not cgroup_v2_writable(self.cgroup_path):
+            print(f"Warning: {self.cgroup_path} is not a writable cgroup v2 directory, using rlimits only")
+            self.cgroup_path = None
+        if self.max_pids and self.cgroup_path is None and os.geteuid() == 0:
+            print("Warning: RLIMIT_NPROC is not enforced for root, the process limit needs a writable cgroup_path")
+
+    def create_cgroup(self):
+        if self.cgroup_path is None:
+            return None
+        path = self.cgroup_path / f"run_{uuid.uuid4().hex}"
+        try:
+            path.mkdir()
+            if self.memory_mb:
+                (path / "memory.max").write_text(str(self.memory_mb * 1024 * 1024))
+                (path / "memory.swap.max").write_text("0")
+            if self.max_pids:
+                (path / "pids.max").write_text(str(self.max_pids))
+        except OSError as e:
+            print(f"Warning: cannot set up cgroup {path}, using rlimits only: {e}")
+            remove_cgroup(path)
+            return None
+        return path
+
+    def apply(self, cgroup=None):
+        """
+        Called in the child between fork and exec (or before pytest.main in the warm fork).
+        """
+        if cgroup is not None:
+            (cgroup / "cgroup.procs").write_text("0")
+        if self.cpu_seconds:
+            resource.setrlimit(resource.RLIMIT_CPU, (self.cpu_seconds, self.cpu_seconds + 1))
+        if self.memory_mb and cgroup is None:
+            memory = self.memory_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_DATA, (memory, memory))
+        if self.max_pids and cgroup is None:
+            resource.setrlimit(resource.RLIMIT_NPROC, (self.max_pids, self.max_pids))
+
+
+def cgroup_v2_writable(path):
+    return (CGROUP_V2_ROOT / "cgroup.controllers").exists() and os.access(path, os.W_OK)
+
+
+def remove_cgroup(cgroup):
+    if cgroup is None:
+        return
+    try:
+        # whatever the tests left running (including a gradle daemon, which is why the warm
+        # executor runs java cold with cgroups) goes with the cgroup; kernels without
+        # cgroup.kill keep the cgroup until the stragglers exit
+        if (cgroup / "cgroup.kill").exists():
+            (cgroup / "cgroup.kill").write_text("1")
+        for _ in range(100):
+            try:
+                cgroup.rmdir()
+                return
+            except OSError:
+                time.sleep(0.01)
+    except OSError:
+        pass
+
+
+def cgroup_usage(cgroup):
+    usage = {}
+    try:
+        for line in (cgroup / "cpu.stat").read_text().splitlines():
+            key, value = line.split()
+            if key == "usage_usec":
+                usage["cpu_seconds"] = int(value) / 1e6
+        if (cgroup / "memory.peak").exists():
+            usage["peak_rss_mb"] = int((cgroup / "memory.peak").read_text()) / (1024 * 1024)
+        for line in (cgroup / "memory.events").read_text().splitlines():
+            key, value = line.split()
+            if key == "oom_kill" and int(value):
+                usage["oom_killed"] = True
+    except OSError:
+        pass
+    return usage
+
+
+def wait_with_rusage(pid, timeout):
+    """
+    Reap `pid` like subprocess does, but through wait4 so its rusage (which includes its
+    reaped descendants) is not lost. Returns (returncode, rusage), or (None, None) on timeout.
+    """
+    deadline = time.monotonic() + timeout
+    delay = 0.001
+    while True:
+        waited_pid, status, rusage = os.wait4(pid, os.WNOHANG)
+        if waited_pid == pid:
+            return os.waitstatus_to_exitcode(status), rusage
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None, None
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 0.02)
+
+
+def kill_process_group(pid):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def record_usage(usage, returncode, rusage, wall_seconds, cgroup=None):
+    """
+    Fold one command's numbers into `usage`: wall and cpu time add up over the commands of a
+    sample (cpp compile + run), peak RSS is the maximum.
+    """
+    usage["wall_seconds"] = usage.get("wall_seconds", 0.0) + wall_seconds
+    command_usage = {}
+    if rusage is not None:
+        command_usage = {
+            "cpu_seconds": rusage.ru_utime + rusage.ru_stime,
+            # ru_maxrss is in kilobytes on Linux
+            "peak_rss_mb": rusage.ru_maxrss / 1024,
+        }
+    if cgroup is not None:
+        command_usage.update(cgroup_usage(cgroup))
+    usage["cpu_seconds"] = usage.get("cpu_seconds", 0.0) + command_usage.get("cpu_seconds", 0.0)
+    usage["peak_rss_mb"] = max(usage.get("peak_rss_mb", 0.0), command_usage.get("peak_rss_mb", 0.0))
+    if command_usage.get("oom_killed"):
+        usage["oom_killed"] = True
+    if returncode is None:
+        usage["timed_out"] = True
+    elif returncode < 0:
+        usage["signal"] = signal.Signals(-returncode).name
+    usage["cgroup"] = cgroup is not None
+
+
+def run_limited(command_list, cwd, env, timeout, limits=None, usage=None):
+    """
+    subprocess.run(..., stdout=PIPE, stderr=STDOUT, timeout=timeout) with the command in its own
+    process group, under `limits`, and its resource usage folded into `usage`.
+    Raises subprocess.TimeoutExpired after killing the whole group, like run_command.
+    """
+    usage = {} if usage is None else usage
+    cgroup = limits.create_cgroup() if limits is not None else None
+    preexec = (lambda: limits.apply(cgroup)) if limits is not None else None
+
+    start = time.monotonic()
+    try:
+        # output goes to a file so the child can never block on a full pipe while we poll
+        with tempfile.TemporaryFile() as output:
+            process = subprocess.Popen(command_list, stdout=output, stderr=subprocess.STDOUT, cwd=cwd, env=env, start_new_session=True, preexec_fn=preexec)
+            returncode, rusage = wait_with_rusage(process.pid, timeout)
+            if returncode is None:
+                kill_process_group(process.pid)
+                _, status, rusage = os.wait4(process.pid, 0)
+                returncode = os.waitstatus_to_exitcode(status)
+                process.returncode = returncode
+                record_usage(usage, None, rusage, time.monotonic() - start, cgroup)
+                raise subprocess.TimeoutExpired(command_list, timeout)
+            process.returncode = returncode
+            record_usage(usage, returncode, rusage, time.monotonic() - start, cgroup)
+            output.seek(0)
+            # same newline translation as text=True
+            res = output.read().decode("utf-8", errors="replace").replace("\r\n", "\n").replace("\r", "\n")
+            return returncode, res
+    finally:
+        remove_cgroup(cgroup)
@@ -5,7 +5,7 @@ import re
 import sys
 from pathlib import Path
 
-root_dir = Path(__file__).parent.parent
+root_dir = Path(__file__).parent.parent.parent
 root_dir_str = str(root_dir)
 if root_dir_str not in sys.path:
     sys.path.append(root_dir_str)
@@ -19,6 +19,8 @@ import datetime
 from concurrent.futures import ProcessPoolExecutor, as_completed
 import traceback
 
+from pipelines.check.parser_engine import get_grammar
+
 def ensure_directory_exists(path, type="file"):
     if not os.path.isabs(path):
         path = os.path.abspath(path)
@@ -182,8 +184,10 @@ def parse_java(output):
         return pass_count, pass_count, 0, 0
     else:
         return 0, 0, 0, 0
-    
-parsers = {
+
+# the per-language functions above are the original scrapers, kept as the reference
+# bench_parser.py checks pipelines/check/parser_engine.py against
+legacy_parsers = {
     "python": parse_python,
     "rust": parse_rust,
     "go": parse_go,
@@ -216,7 +220,9 @@ def is_passed(data_item):
                 "success": bool,
                 "returncode": int,
                 "res": str,
-                "command": str
+                "command": str,
+                "report": {"total": int, "passed": int, "failed": int, "error": int, "skipped": int, "tests": [...]}, optional
+                "res_summary": {"total": int, "passed": int, "failed": int, "errors": int}, optional, parsed before res was truncated
             },
             "error": {
                 "message": str,
@@ -235,30 +241,76 @@ def is_passed(data_item):
     success = check_info.get("success", False)
     if not success:
         raise Exception(f"{language} Test command failed with return code {check_info.get('returncode', 'unknown')}. {check_info.get('res', '')}.")
-    parser = parsers.get(language)
-    if not parser:
-        raise Exception(f"No parser available for language: {language}")
-    test_output = check_info.get("res", "")
-    total, passed, failed, errors = parser(test_output)
-    failed = failed + errors
+    report = check_info.get("report")
+    if report is not None:
+        # per-test outcomes written by the toolchain itself, see check/reports.py
+        total, passed, failed = report["total"], report["passed"], report["failed"] + report["error"]
+    elif "res_summary" in check_info:
+        # res only holds head and tail of the transcript, see check/transcripts.py
+        summary = check_info["res_summary"]
+        total, passed, failed = summary["total"], summary["passed"], summary["failed"] + summary["errors"]
+    else:
+        grammar = get_grammar(language)
+        if not grammar:
+            raise Exception(f"No parser available for language: {language}")
+        test_output = check_info.get("res", "")
+        total, passed, failed, errors = grammar.parse(test_output)
+        failed = failed + errors
     if total == 0:
         raise Exception(f"{language} No tests were run.")
     return total, passed, failed
     
-def task_worker(task_args):
-    obj = task_args.get("obj", {})
+def annotate(obj):
+    """
+    Add total/passed/failed to a run record in place; raises like is_passed if it did not pass.
+    Used by the separate pass below and inline by run_unit_test_index.py --parse.
+    """
     total, passed, failed = is_passed(obj)
     obj["total"] = total
     obj["passed"] = passed
     obj["failed"] = failed
     return obj
 
+def task_worker(task_args):
+    obj = task_args.get("obj", {})
+    return annotate(obj)
+
+def parse_stream(input_paths, output_path):
+    """
+    Parse record by record in this process: constant memory whatever the input size, and
+    nothing is pickled. The output files are truncated first, the output directory is kept.
+    """
+    parsed_file = os.path.join(output_path, "parsed.jsonl")
+    error_file = os.path.join(output_path, "parsed_error.jsonl")
+    stats = {}
+    len_output_objs = len_error_objs = 0
+    with open(parsed_file, "w", encoding="utf-8") as parsed_f, open(error_file, "w", encoding="utf-8") as error_f:
+        for input_path in input_paths:
+            with open(input_path, "r", encoding="utf-8") as f:
+                for line in tqdm.tqdm(f, desc=os.path.basename(input_path)):
+                    if not line.strip():
+                        continue
+                    obj = json.loads(line)
+                    try:
+                        annotate(obj)
+                    except Exception as e:
+                        error_f.write(json.dumps(str(e), ensure_ascii=False) + "\n")
+                        len_error_objs += 1
+                        continue
+                    parsed_f.write(json.dumps(obj, ensure_ascii=False) + "\n")
+                    len_output_objs += 1
+                    stats[obj["language"]] = stats.get(obj["language"], 0) + 1
+    print(f"Success saved to {parsed_file} , {len_output_objs} objs")
+    print(f"Error saved to {error_file} , {len_error_objs} objs")
+    return stats
+
 
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--input_path", nargs='+', type=str, default=["./check/dataset/run_unit_test/xxxxx.jsonl"])
     parser.add_argument("--output_path", type=str, default="./check/dataset/parsed")
     parser.add_argument("--workers", type=int, default=10)
+    parser.add_argument("--stream", action="store_true", help="Parse line by line in one process with constant memory, without clearing the output directory first.")
     args = parser.parse_args()
     ensure_directory_exists(args.output_path, type="dir")
     args.current_time = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
@@ -267,9 +319,14 @@ def parse_args():
     return args
 
 def main():
+    main_args = parse_args()
+    if main_args.stream:
+        stats = parse_stream(main_args.input_path, main_args.output_path)
+        save_json(stats, os.path.join(main_args.output_path, "parsed_stats.json"), format="w")
+        return
     import subprocess
     subprocess.run(["rm", "-rf", "./check/dataset/parsed"])
-    main_args = parse_args()
+    ensure_directory_exists(main_args.output_path, type="dir")
     all_objs = []
     for input_path in main_args.input_path:
         objs = read_jsonl_file(input_path)
@@ -0,0 +1,151 @@
+import re
+
+# every line boundary str.splitlines knows about; the line-based grammars look behind for
+# one of these instead of using `^`, so they see the same lines the per-line parsers saw
+LINE_BREAKS = "\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"
+# any character but a line boundary, the `.` of a per-line pattern
+_IN_LINE = f"[^{LINE_BREAKS}]"
+
+
+def _at_line_start(literal):
+    """
+    `literal` at the start of a line. The literal comes first and the line check is a look
+    behind, so the regex engine can still jump between occurrences of the literal.
+    """
+    return f"{literal}(?<![^{LINE_BREAKS}]{'.' * len(literal)})"
+
+
+class Grammar:
+    """
+    All patterns of one language compiled once into a single regex. `parse` scans the
+    transcript once with findall and `finish(matches)` turns the matches into
+    (total, passed, failed, errors).
+    """
+
+    def __init__(self, pattern, finish, flags=0):
+        self.regex = re.compile(pattern, flags)
+        self.finish = finish
+
+    def parse(self, output):
+        return self.finish(self.regex.findall(output))
+
+
+class LiteralGrammar:
+    """
+    For languages whose result only depends on fixed substrings: `finish` gets the number
+    of occurrences of every literal, or with count=False whether it occurs at all, which
+    stops at the first occurrence.
+    """
+
+    def __init__(self, literals, finish, count=True):
+        self.literals = literals
+        self.finish = finish
+        self.count = count
+
+    def parse(self, output):
+        if self.count:
+            return self.finish([output.count(literal) for literal in self.literals])
+        return self.finish([literal in output for literal in self.literals])
+
+
+GRAMMARS = {}
+
+
+def register_grammar(language, grammar):
+    """
+    Plug a grammar in for `language`, replacing any earlier one. Anything with a
+    `parse(output) -> (total, passed, failed, errors)` method will do.
+    """
+    GRAMMARS[language] = grammar
+    return grammar
+
+
+def get_grammar(language):
+    return GRAMMARS.get(language)
+
+
+def parse_output(language, output):
+    grammar = GRAMMARS.get(language)
+    if grammar is None:
+        raise KeyError(language)
+    return grammar.parse(output)
+
+
+# pytest: "3 passed, 1 failed, 2 errors in 0.12s", first occurrence of each
+def _finish_python(matches):
+    counts = [None, None, None]
+    for number, *words in matches:
+        for i, word in enumerate(words):
+            if word and counts[i] is None:
+                counts[i] = int(number)
+        if None not in counts:
+            break
+    passed, failed, errors = (count or 0 for count in counts)
+    return passed + failed + errors, passed, failed, errors
+
+
+register_grammar("python", Grammar(r"(\d+) (?:(passed)|(failed)|(error))", _finish_python, flags=re.IGNORECASE))
+
+
+# libtest: "test tests::name ... ok" / "... FAILED", one verdict per line, ok wins
+def _finish_rust(matches):
+    passed = matches.count("o")
+    return len(matches), passed, len(matches) - passed, 0
+
+
+register_grammar("rust", Grammar(
+    _at_line_start("test ") + f"(?:(?={_IN_LINE}* {_IN_LINE * 3} (o)k)|(?={_IN_LINE}* {_IN_LINE * 3} FAILED))",
+    _finish_rust,
+))
+
+
+# go test only tells whether the run failed: any FAIL, otherwise any ok
+def _finish_go(found):
+    fail, ok = found
+    if fail:
+        return 1, 0, 1, 0
+    if ok:
+        return 1, 1, 0, 0
+    return 0, 0, 0, 0
+
+
+register_grammar("go", LiteralGrammar(["FAIL", "ok"], _finish_go, count=False))
+
+
+# jest: one "PASS ./x.test.js" / "FAIL ./x.test.js" line per test file
+def _finish_javascript(matches):
+    passed = matches.count("PASS")
+    return len(matches), passed, len(matches) - passed, 0
+
+
+register_grammar("javascript", Grammar(f"(PASS|FAIL)(?<![^{LINE_BREAKS}]....)", _finish_javascript))
+
+
+# Catch2: "All tests passed (5 assertions in 2 test cases)" or
+# "Some tests failed (1 failed, 2 passed)"; counts are test cases, any all-passed line wins
+def _finish_cpp(matches):
+    for test_cases, _, _ in matches:
+        if test_cases:
+            return int(test_cases), int(test_cases), 0, 0
+    for _, failed, passed in matches[:1]:
+        failed, passed = int(failed), int(passed or 0)
+        return passed + failed, passed, failed, 0
+    return 0, 0, 0, 0
+
+
+register_grammar("cpp", Grammar(
+    # anchored on " tests " so the scan can skip ahead to it
+    r" tests (?:(?<=all tests )passed\s*\(\d+ assertions? in (\d+) test cases?\)"
+    r"|(?<=some tests )failed\s*\((\d+) failed(?:, (\d+) passed)?\))",
+    _finish_cpp,
+    flags=re.IGNORECASE,
+))
+
+
+# gradle prints "... PASSED" per test with the test logger; nothing counts as failed
+def _finish_java(counts):
+    passed, = counts
+    return passed, passed, 0, 0
+
+
+register_grammar("java", LiteralGrammar([" PASSED"], _finish_java))
@@ -0,0 +1,201 @@
+import json
+import re
+import shutil
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+# per-sample directory the toolchains write their machine-readable reports to
+REPORT_DIR = ".reports"
+REPORT_FILES = {
+    "python": "pytest.xml",
+    "javascript": "jest.json",
+    "cpp": "catch.xml",
+}
+# where gradle always writes its JUnit XML, relative to the project
+GRADLE_RESULTS_DIR = Path("build") / "test-results" / "test"
+LIBTEST_LINE = re.compile(r"^test (\S+) \.\.\. (ok|FAILED|ignored)", re.MULTILINE)
+OUTCOMES = ["passed", "failed", "error", "skipped"]
+_LIBTEST_OUTCOMES = {"ok": "passed", "FAILED": "failed", "ignored": "skipped"}
+_JEST_OUTCOMES = {"passed": "passed", "failed": "failed", "pending": "skipped", "skipped": "skipped", "todo": "skipped", "disabled": "skipped"}
+_GO_OUTCOMES = {"pass": "passed", "fail": "failed", "skip": "skipped"}
+
+
+def prepare_report(unit_test_cwd_path, language):
+    """
+    Clear what an earlier run in the same directory left and return the report path the
+    toolchain is told to write to (None for languages whose report comes from elsewhere).
+    """
+    unit_test_cwd_path = Path(unit_test_cwd_path)
+    shutil.rmtree(unit_test_cwd_path / REPORT_DIR, ignore_errors=True)
+    if language == "java":
+        shutil.rmtree(unit_test_cwd_path / GRADLE_RESULTS_DIR, ignore_errors=True)
+    if language not in REPORT_FILES:
+        return None
+    (unit_test_cwd_path / REPORT_DIR).mkdir(exist_ok=True)
+    return (unit_test_cwd_path / REPORT_DIR / REPORT_FILES[language]).absolute()
+
+
+def report_command(language, command_list, report_path):
+    """
+    The test command with the reporter switched on. cpp gets its report through the
+    CATCH_JUNIT_REPORT environment variable (see report_env), java and rust need nothing.
+    """
+    if language == "python":
+        return [*command_list, f"--junitxml={report_path}"]
+    if language == "go":
+        return [command_list[0], command_list[1], "-json", *command_list[2:]]
+    if language == "javascript":
+        # npm-test.sh forwards its arguments to `npm run test --`
+        return [*command_list, "--json", f"--outputFile={report_path}"]
+    return command_list
+
+
+def report_env(language, env, report_path):
+    if language == "cpp":
+        return dict(env, CATCH_JUNIT_REPORT=str(report_path))
+    return env
+
+
+def catch_report_args(report_path):
+    return ["--reporter", "junit", "--out", str(report_path)]
+
+
+def load_report(unit_test_cwd_path, language, report_path, res):
+    """
+    Read the report of a finished run. Returns (report, res): res only changes for go, whose
+    -json stream is turned back into the usual console transcript, and for cpp, where Catch2
+    (v2, a single reporter per run) writes the JUnit report instead of its console output, so
+    the console transcript is rendered from the report and appended.
+    report is None if the toolchain did not produce one (e.g. the build failed).
+    """
+    unit_test_cwd_path = Path(unit_test_cwd_path)
+    tests, report_format = None, None
+    try:
+        if language == "go":
+            tests, res = _load_go_json(res)
+            report_format = "go-json"
+        elif language == "rust":
+            tests = [{"name": name, "outcome": _LIBTEST_OUTCOMES[outcome], "seconds": None} for name, outcome in LIBTEST_LINE.findall(res)]
+            report_format = "libtest"
+        elif language == "javascript":
+            if report_path is not None and report_path.exists():
+                tests = _load_jest_json(report_path)
+                report_format = "jest-json"
+        elif language == "java":
+            xml_paths = sorted((unit_test_cwd_path / GRADLE_RESULTS_DIR).glob("TEST-*.xml"))
+            if xml_paths:
+                tests = [test for xml_path in xml_paths for test in _load_junit_xml(xml_path)]
+                report_format = "junit"
+        elif language == "cpp":
+            if report_path is not None and report_path.exists():
+                tests = _load_junit_xml(report_path)
+                report_format = "junit"
+                res += _render_catch_console(report_path)
+        elif report_path is not None and report_path.exists():
+            tests = _load_junit_xml(report_path)
+            report_format = "junit"
+    except (ET.ParseError, json.JSONDecodeError, KeyError, TypeError, ValueError):
+        tests = None
+    if not tests:
+        return None, res
+    report = {"format": report_format, "tests": tests}
+    for outcome in OUTCOMES:
+        report[outcome] = sum(1 for test in tests if test["outcome"] == outcome)
+    report["total"] = report["passed"] + report["failed"] + report["error"]
+    return report, res
+
+
+def _load_junit_xml(xml_path):
+    tests = []
+    for testcase in ET.parse(xml_path).getroot().iter("testcase"):
+        name = testcase.get("name", "")
+        if testcase.get("classname"):
+            name = f"{testcase.get('classname')}::{name}"
+        outcome = "passed"
+        if testcase.find("failure") is not None:
+            outcome = "failed"
+        elif testcase.find("error") is not None:
+            outcome = "error"
+        elif testcase.find("skipped") is not None:
+            outcome = "skipped"
+        seconds = testcase.get("time")
+        tests.append({"name": name, "outcome": outcome, "seconds": float(seconds) if seconds else None})
+    return tests
+
+
+def _render_catch_console(xml_path):
+    """
+    The part of Catch2's console output the parsers read, from its JUnit report: captured
+    stdout, one block per failed section and the closing summary. The junit reporter counts
+    assertions in `tests`, test cases are the testcase names up to the first "/" (sections).
+    """
+    rule = "-" * 79
+    lines, cases = [], {}
+    for suite in ET.parse(xml_path).getroot().iter("testsuite"):
+        stdout = (suite.findtext("system-out") or "").strip()
+        if stdout:
+            lines.append(stdout)
+        assertions = int(suite.get("tests", 0))
+        failed = int(suite.get("failures", 0)) + int(suite.get("errors", 0))
+        for testcase in suite.iter("testcase"):
+            path = testcase.get("name", "").split("/")
+            problem = testcase.find("failure") if testcase.find("failure") is not None else testcase.find("error")
+            cases[path[0]] = cases.get(path[0], True) and problem is None
+            if problem is None:
+                continue
+            body = (problem.text or "").strip().splitlines()
+            location = body.pop()[3:] if body and body[-1].startswith("at ") else ""
+            lines += ["", rule, path[0], *[f"  {section}" for section in path[1:]], rule, location, "." * 79, ""]
+            if problem.tag == "error":
+                # the junit reporter drops the console's explanation of an unexpected exception
+                body[1:] = ["due to unexpected exception with message:", *[f"  {line}" for line in body[1:]]]
+            lines += [f"{location}: {body[0]}" if body and location else "FAILED:", *body[1:]]
+    passed = sum(cases.values())
+    lines += ["", "=" * 79]
+    if failed == 0 and passed == len(cases):
+        lines.append(f"All tests passed ({assertions} assertion{'s' if assertions != 1 else ''} in {len(cases)} test case{'s' if len(cases) != 1 else ''})")
+    else:
+        lines.append(f"test cases: {len(cases)} | {passed} passed | {len(cases) - passed} failed")
+        lines.append(f"assertions: {assertions} | {assertions - failed} passed | {failed} failed")
+    return "\n".join(lines) + "\n"
+
+
+def _load_jest_json(json_path):
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    tests = []
+    for suite in data["testResults"]:
+        if not suite.get("assertionResults") and suite.get("status") == "failed":
+            # the suite did not even load
+            tests.append({"name": suite.get("name", ""), "outcome": "error", "seconds": None})
+        for assertion in suite.get("assertionResults", []):
+            duration = assertion.get("duration")
+            tests.append({
+                "name": assertion.get("fullName") or assertion.get("title", ""),
+                "outcome": _JEST_OUTCOMES.get(assertion.get("status"), "error"),
+                "seconds": duration / 1000 if duration is not None else None,
+            })
+    return tests
+
+
+def _load_go_json(res):
+    tests, output = [], []
+    for line in res.splitlines(keepends=True):
+        if not line.startswith("{"):
+            # build errors and anything else outside the test2json stream
+            output.append(line)
+            continue
+        try:
+            event = json.loads(line)
+        except json.JSONDecodeError:
+            output.append(line)
+            continue
+        if event.get("Action") in ("output", "build-output"):
+            output.append(event.get("Output", ""))
+        elif event.get("Test") and event.get("Action") in _GO_OUTCOMES:
+            tests.append({
+                "name": f"{event.get('Package', '')}::{event['Test']}",
+                "outcome": _GO_OUTCOMES[event["Action"]],
+                "seconds": event.get("Elapsed"),
+            })
+    return tests, "".join(output)
@@ -1,5 +1,6 @@
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 import json
+import multiprocessing.util
 import os
 from pathlib import Path
 import random
@@ -7,6 +8,7 @@ import re
 import shutil
 import subprocess
 import sys
+import time
 import traceback
 import uuid
 import jsonlines
@@ -14,7 +16,6 @@ import datetime
 import argparse
 import tqdm
 from openai import OpenAI
-import copy
 
 
 root_dir = Path(__file__).parent.parent.parent  # Go up two levels to get to the project root
@@ -23,7 +24,19 @@ if root_dir_str not in sys.path:
     sys.path.append(root_dir_str)
 
 from pipelines.utils.tools import parse_stacked_content
+from pipelines.utils.jsonl_index import JsonlIndex
 from pipelines.utils.setting import APPEND_FILES
+from pipelines.check.executors import EXECUTOR_MODES, make_executor
+from pipelines.check.sandbox_cache import SandboxCache
+from pipelines.check.scheduler import DEFAULT_LANGUAGE_SHARE, LanguageScheduler, parse_language_values
+from pipelines.check.journal import CompletionJournal, record_key, sample_key, verdict_of
+from pipelines.check.workspace import KEEP_POLICIES, WORKSPACE_BACKENDS, WorkspaceManager, templates_root_for, write_files
+from pipelines.check.sandbox_template import TEMPLATE_LINK_METHODS, build_templates
+from pipelines.check.limits import ResourceLimits
+from pipelines.check.build_cache import BuildCache
+from pipelines.check.parser import annotate
+from pipelines.check.transcripts import TRANSCRIPT_HEAD_CHARS, TRANSCRIPT_TAIL_CHARS, TranscriptStore
+from pipelines.utils.contamination import DEFAULT_THRESHOLD as CONTAMINATION_THRESHOLD, ContaminationIndex
 
 UNIT_TEST_RESOURCES_PATH = root_dir / "pipelines" / "utils" / "unit_test_resources"
 UNIT_TEST_TIMEOUT = 60 * 3
@@ -37,6 +50,9 @@ TEST_COMMANDS = {
 }
 env  = os.environ.copy()
 UNIT_TEST_ENV = env
+WORKER_EXECUTOR = None
+WORKER_WORKSPACES = None
+WORKER_TRANSCRIPTS = None
 
 
 def ensure_directory_exists(path, type="file"):
@@ -82,6 +98,20 @@ def write_jsonl_file(objs, path, chunk_size = 1, format="w"):
     print(f"Successfully saving to {path} : {len(objs)}")
 
 
+def append_jsonl_lines(objs, path):
+    """
+    Append objs as JSON lines; returns the byte offset of each line.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    offsets = []
+    with open(path, "ab") as f:
+        for obj in objs:
+            offsets.append(f.tell())
+            f.write(json.dumps(obj, ensure_ascii=False).encode("utf-8") + b"\n")
+    print(f"Successfully saving to {path} : {len(objs)}")
+    return offsets
+
+
 def read_json(file_path):
     with open(file_path, 'r') as f:
         data = json.load(f)
@@ -98,7 +128,8 @@ def save_json(data, filename, indent = 4, format="w") -> None:
     print(f"Successfully saving to {filename}")
 
 def messages_update_data_map(data_map):
-    check_data_map = copy.deepcopy(data_map)
+    # only top-level keys are added, the record itself is never modified
+    check_data_map = dict(data_map)
     check_data_map["contents"] = {}
     check_data_map["config"] = {}
     source_messages = check_data_map["source_messages"]
@@ -119,14 +150,17 @@ def messages_update_data_map(data_map):
         raise Exception("Cannot get project name")
     check_data_map["folder"] = project_name
     check_data_map["contents"][f"{check_data_map['folder']}/.docs/instructions.md"] = question_response
-    tmp_data = parse_stacked_content(unit_test_response)
+    # files collected while the replies streamed in (generate_answer_unit_test.py --stream)
+    # are what parsing the replies gives
+    files = check_data_map.get("files") or {}
+    tmp_data = files["unit_test"] if "unit_test" in files else parse_stacked_content(unit_test_response)
     keys = []
     for item in tmp_data:
         for filename, content in item.items():
             check_data_map["contents"][filename] = content
             keys.append(filename)
     check_data_map["config"]["test"] = keys
-    tmp_data = parse_stacked_content(answer_response)
+    tmp_data = files["answer"] if "answer" in files else parse_stacked_content(answer_response)
     keys = []
     for item in tmp_data:
         for filename, content in item.items():
@@ -135,43 +169,45 @@ def messages_update_data_map(data_map):
     check_data_map["config"]["solution"] = keys
     return check_data_map
 
-def unit_test_command_preparation(tmp_path, check_data_map):
+def unit_test_command_preparation(tmp_path, check_data_map, workspace=None):
     language = check_data_map["language"]
     folder = check_data_map["folder"]
-    unit_test_path = tmp_path / language / f"unit_test_{str(uuid.uuid4()).replace('-', '_')}"
+    if workspace is None:
+        unit_test_path = tmp_path / language / f"unit_test_{str(uuid.uuid4()).replace('-', '_')}"
+    else:
+        unit_test_path = workspace.root
     unit_test_cwd_path = unit_test_path / folder
+    has_template = workspace is not None and workspace.has_template
 
-    # append files
-    append_file = APPEND_FILES.get(language, {})
-    for filename, content in append_file.items():
-        file_path = unit_test_cwd_path / filename
-        file_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(file_path, "w") as f:
-            f.write(content)
+    # append files, unless the workspace is layered on a template that already holds them
+    files = {}
+    if not has_template:
+        for filename, content in APPEND_FILES.get(language, {}).items():
+            files[f"{folder}/{filename}"] = content
 
     # model generated file, can override the above
     for filename, content in check_data_map["contents"].items():
         if filename.startswith(folder):
-            file_path = unit_test_path / filename
-            file_path.parent.mkdir(parents=True, exist_ok=True)
-            wcontent = content
-            with open(file_path, "w") as f:
-                f.write(wcontent)
+            files[filename] = content
         else:
-            file_path = unit_test_cwd_path / filename
-            file_path.parent.mkdir(parents=True, exist_ok=True)
-            wcontent = content
-            with open(file_path, "w") as f:
-                f.write(wcontent)
+            files[f"{folder}/{filename}"] = content
+    write_files(unit_test_path, files)
+
+    def from_template(filename):
+        # template files already carry their resources and modes
+        return has_template and f"{folder}/{filename}" not in files
 
     # permission adjustment, link creation, miscellaneous processing
     if language == "cpp":
-        os.chmod(unit_test_cwd_path / "cpp-test.sh", 0o777)
-        shutil.copy(UNIT_TEST_RESOURCES_PATH / "cpp" / "catch.hpp", unit_test_cwd_path / 'catch.hpp')
+        if not from_template("cpp-test.sh"):
+            os.chmod(unit_test_cwd_path / "cpp-test.sh", 0o777)
+        if not from_template("catch.hpp"):
+            shutil.copy(UNIT_TEST_RESOURCES_PATH / "cpp" / "catch.hpp", unit_test_cwd_path / 'catch.hpp')
 
     elif language == "java":
         # Set executable permissions for gradlew
-        os.chmod(unit_test_cwd_path / "gradlew", 0o777)
+        if not from_template("gradlew"):
+            os.chmod(unit_test_cwd_path / "gradlew", 0o777)
         
         # Remove @Disabled annotations from Java test files
         test_files = check_data_map["config"]["test"]
@@ -183,12 +219,14 @@ def unit_test_command_preparation(tmp_path, check_data_map):
                     content = re.sub(r"@Disabled\([^)]*\)\s*\n", "", content)
                     test_file.write_text(content)
 
-        shutil.copy(UNIT_TEST_RESOURCES_PATH / "java" / "gradle-wrapper.jar", unit_test_cwd_path / 'gradle' / 'wrapper' / 'gradle-wrapper.jar')
-        os.chmod(unit_test_cwd_path / "gradle" / "wrapper" / "gradle-wrapper.jar", 0o777)
+        if not from_template("gradle/wrapper/gradle-wrapper.jar"):
+            shutil.copy(UNIT_TEST_RESOURCES_PATH / "java" / "gradle-wrapper.jar", unit_test_cwd_path / 'gradle' / 'wrapper' / 'gradle-wrapper.jar')
+            os.chmod(unit_test_cwd_path / "gradle" / "wrapper" / "gradle-wrapper.jar", 0o777)
 
     elif language == "javascript":
         # Set executable permissions for npm-test.sh
-        os.chmod(unit_test_cwd_path / "npm-test.sh", 0o777)
+        if not from_template("npm-test.sh"):
+            os.chmod(unit_test_cwd_path / "npm-test.sh", 0o777)
         
     elif language == "rust":
         # modify .../Cargo.toml
@@ -209,30 +247,45 @@ def unit_test_command_preparation(tmp_path, check_data_map):
 
     return unit_test_cwd_path
 
-def run_unit_test(unit_test_cwd_path, language):
-    command_list = TEST_COMMANDS[language]
-    command_str = " ".join(command_list)
-
-    result = subprocess.run(
-            command_list,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            timeout=UNIT_TEST_TIMEOUT,
-            cwd=unit_test_cwd_path,
-            env=UNIT_TEST_ENV,
-            encoding="utf-8",
-            errors="replace",
-    )
-    success = result.returncode == 0
-    res = result.stdout
-    return success, result.returncode, res, command_str
+def init_worker(executor_mode, tmp_path, sandbox_cache_path=None, workspace_backend="disk", keep_workspaces="always", tmpfs_path="/dev/shm", templates_root=None, template_link="hardlink", limits=None, timeout=UNIT_TEST_TIMEOUT, build_cache_path=None, reports=True, transcript_store=None, transcript_head_chars=TRANSCRIPT_HEAD_CHARS, transcript_tail_chars=TRANSCRIPT_TAIL_CHARS):
+    """
+    ProcessPoolExecutor initializer: build the executor once per worker process,
+    so warm toolchain state survives from one sample to the next.
+    """
+    global WORKER_EXECUTOR, WORKER_WORKSPACES, WORKER_TRANSCRIPTS
+    sandbox_cache = SandboxCache(sandbox_cache_path) if sandbox_cache_path else None
+    build_cache = BuildCache(build_cache_path) if build_cache_path else None
+    WORKER_EXECUTOR = make_executor(executor_mode, TEST_COMMANDS, UNIT_TEST_ENV, timeout, Path(tmp_path) / "executors", sandbox_cache, limits, build_cache, reports)
+    # pool workers leave through os._exit, which skips atexit but runs multiprocessing finalizers
+    multiprocessing.util.Finalize(None, WORKER_EXECUTOR.close, exitpriority=10)
+    WORKER_WORKSPACES = WorkspaceManager(tmp_path, backend=workspace_backend, keep=keep_workspaces, tmpfs_path=tmpfs_path, templates_root=templates_root, template_link=template_link)
+    multiprocessing.util.Finalize(None, WORKER_WORKSPACES.close, exitpriority=10)
+    if transcript_store:
+        WORKER_TRANSCRIPTS = TranscriptStore(transcript_store, transcript_head_chars, transcript_tail_chars)
+
+def run_unit_test(unit_test_cwd_path, language, test_files=None):
+    global WORKER_EXECUTOR
+    if WORKER_EXECUTOR is None:
+        WORKER_EXECUTOR = make_executor("cold", TEST_COMMANDS, UNIT_TEST_ENV, UNIT_TEST_TIMEOUT, None)
+    return WORKER_EXECUTOR.run(unit_test_cwd_path, language, test_files)
+
+def workspace_test_files(unit_test_cwd_path, folder, test_files):
+    """
+    Paths of the test files relative to unit_test_cwd_path, where unit_test_command_preparation put them.
+    """
+    result = []
+    for file in test_files:
+        rel = file[len(folder) + 1:] if file.startswith(f"{folder}/") else file
+        if not (unit_test_cwd_path / rel).exists():
+            rel = Path(file).name
+        result.append(rel)
+    return result
 
 def run_data_map(tmp_path, data_map):
     if not tmp_path.exists():
         tmp_path.mkdir(parents=True, exist_ok=True)
     check_data_map = messages_update_data_map(data_map)
-    check_data_map_to_run = copy.deepcopy(check_data_map)
+    check_data_map_to_run = check_data_map
     language = check_data_map_to_run["language"]
     check_data_map_to_run["check_info"] = {}
     if len(check_data_map["config"]["solution"]) == 0:
@@ -248,37 +301,69 @@ def run_data_map(tmp_path, data_map):
         }
         raise Exception("Missing test file", check_data_map_to_run)
     
-    try:
-        unit_test_cwd_path = unit_test_command_preparation(tmp_path, check_data_map_to_run)
-        check_data_map_to_run["check_info"]["unit_test_cwd_path"] = str(unit_test_cwd_path)
-    except Exception as e:
-        check_data_map_to_run["error"] = {
-            "str": str(e),
-            "traceback": traceback.format_exception(e)
-        }
-        raise Exception("Cannot create unit test env", check_data_map_to_run)
-    
-    try:
-        success, returncode, res, command_str = run_unit_test(unit_test_cwd_path, language)
-        check_data_map_to_run["check_info"]["success"] = success
-        check_data_map_to_run["check_info"]["returncode"] = returncode
-        check_data_map_to_run["check_info"]["res"] = res
-        check_data_map_to_run["check_info"]["command"] = command_str
-    except Exception as e:
-        check_data_map_to_run["error"] = {
-            "str": str(e),
-            "traceback": traceback.format_exception(e)
-        }
-        raise Exception("Cannot run unit test", check_data_map_to_run)
+    global WORKER_WORKSPACES
+    if WORKER_WORKSPACES is None:
+        WORKER_WORKSPACES = WorkspaceManager(tmp_path)
+    # the workspace is torn down (or kept, per --keep_workspaces) when this block ends
+    with WORKER_WORKSPACES.create(language, check_data_map_to_run["folder"]) as workspace:
+        try:
+            unit_test_cwd_path = unit_test_command_preparation(tmp_path, check_data_map_to_run, workspace)
+            check_data_map_to_run["check_info"]["unit_test_cwd_path"] = str(unit_test_cwd_path)
+        except Exception as e:
+            check_data_map_to_run["error"] = {
+                "str": str(e),
+                "traceback": traceback.format_exception(e)
+            }
+            raise Exception("Cannot create unit test env", check_data_map_to_run)
+
+        try:
+            test_files = workspace_test_files(unit_test_cwd_path, check_data_map_to_run["folder"], check_data_map_to_run["config"]["test"])
+            success, returncode, res, command_str = run_unit_test(unit_test_cwd_path, language, test_files)
+            check_data_map_to_run["check_info"]["success"] = success
+            check_data_map_to_run["check_info"]["returncode"] = returncode
+            check_data_map_to_run["check_info"]["res"] = res
+            check_data_map_to_run["check_info"]["command"] = command_str
+            check_data_map_to_run["check_info"]["resources"] = WORKER_EXECUTOR.usage
+            if WORKER_EXECUTOR.build_info is not None:
+                check_data_map_to_run["check_info"]["build"] = WORKER_EXECUTOR.build_info
+            if WORKER_EXECUTOR.report is not None:
+                check_data_map_to_run["check_info"]["report"] = WORKER_EXECUTOR.report
+            if WORKER_TRANSCRIPTS is not None:
+                # in the worker, so the full log never reaches the parent process
+                WORKER_TRANSCRIPTS.bound(check_data_map_to_run["check_info"], language)
+            workspace.failed = not success
+        except Exception as e:
+            check_data_map_to_run["check_info"]["resources"] = WORKER_EXECUTOR.usage
+            check_data_map_to_run["error"] = {
+                "str": str(e),
+                "traceback": traceback.format_exception(e)
+            }
+            raise Exception("Cannot run unit test", check_data_map_to_run)
     return check_data_map_to_run
 
+def read_record(task_args):
+    with open(task_args["path"], "rb") as f:
+        f.seek(task_args["offset"])
+        return json.loads(f.readline())
+
 def task_worker(task_args):
-    obj = task_args.get("obj", {})
+    """
+    Tasks only carry where their record is (path + byte offset); the worker reads it itself
+    and sends back nothing but check_info, which the parent joins to the record with join_result.
+    """
+    obj = read_record(task_args)
     tmp_path = task_args.get("tmp_path", Path("tmp"))
-    result = copy.deepcopy(obj)
-    result = run_data_map(tmp_path, result)
+    result = run_data_map(tmp_path, obj)
+    return result["check_info"]
+
+def join_result(obj, check_info):
+    result = messages_update_data_map(obj)
+    result["check_info"] = check_info
     return result
 
+def cached_result(obj, check_info):
+    return join_result(obj, dict(check_info, verdict_cached=True))
+
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--input_path", "-input_path", type=str, default="./check/dataset/answer_unit_test/xxxxx.jsonl")
@@ -288,54 +373,239 @@ def parse_args():
     parser.add_argument("--start_index", "-start_index", type=int, default=0, help="Start index of the input file (inclusive).")
     parser.add_argument("--end_index", "-end_index", type=int, default=None, help="End index of the input file (exclusive).")
     parser.add_argument("--batch_size", "-batch_size", type=int, default=1, help="Batch size of the input file.")
+    parser.add_argument("--stream", "-stream", action="store_true", help="Read the input lazily through the byte-offset index (<output_path>/<input_name>.idx) instead of classifying and shuffling the whole [start_index, end_index) range up front; tasks run in file order.")
+    parser.add_argument("--stream_window", "-stream_window", type=int, default=None, help="Max records queued or running at once with --stream. Defaults to 4 * workers.")
+    parser.add_argument("--parse", "-parse", action="store_true", help="Annotate each output record with total/passed/failed as check/parser.py would, and also write the passing ones to <input_name>_parsed.jsonl (failures to <input_name>_parsed_error.jsonl).")
+    parser.add_argument("--executor", "-executor", type=str, default="cold", choices=EXECUTOR_MODES, help="cold: fresh toolchain per sample; warm: long-lived per-worker toolchain state.")
+    parser.add_argument("--sandbox_cache", "-sandbox_cache", type=str, default=None, help="Directory of the build cache shared by all workers (cargo target dirs, gradle home, node_modules). Disabled if not set.")
+    parser.add_argument("--build_cache", "-build_cache", type=str, default=None, help="Directory of compiled rust/cpp/java solutions keyed by the solution files, so a solution paired with several test suites is built once. Disabled if not set.")
+    parser.add_argument("--no_test_reports", "-no_test_reports", action="store_true", help="Do not ask the toolchains for machine-readable reports (JUnit XML, go test -json, jest --json); check_info then has no per-test report.")
+    parser.add_argument("--transcript_store", "-transcript_store", type=str, default=None, help="Directory of gzip'ed full test transcripts keyed by their sha256. Transcripts longer than head + tail keep only those inline, with check_info.res_ref pointing at the full log. Kept inline if not set.")
+    parser.add_argument("--transcript_head_chars", "-transcript_head_chars", type=int, default=TRANSCRIPT_HEAD_CHARS, help="Characters kept from the start of a stored transcript.")
+    parser.add_argument("--transcript_tail_chars", "-transcript_tail_chars", type=int, default=TRANSCRIPT_TAIL_CHARS, help="Characters kept from the end of a stored transcript.")
+    parser.add_argument("--workspace_backend", "-workspace_backend", type=str, default="disk", choices=WORKSPACE_BACKENDS, help="disk: under --tmp_path; tmpfs: RAM-backed; overlay: tmpfs overlay on a per-language template.")
+    parser.add_argument("--keep_workspaces", "-keep_workspaces", type=str, default="always", choices=KEEP_POLICIES, help="Which sample workspaces survive the run; non-disk workspaces are copied to <tmp_path>/kept.")
+    parser.add_argument("--tmpfs_path", "-tmpfs_path", type=str, default="/dev/shm", help="RAM-backed directory for the tmpfs and overlay workspace backends.")
+    parser.add_argument("--template_link", "-template_link", type=str, default="hardlink", choices=TEMPLATE_LINK_METHODS, help="How the prebuilt per-language template enters each workspace; none rewrites APPEND_FILES per sample.")
+    parser.add_argument("--timeout", "-timeout", type=int, default=UNIT_TEST_TIMEOUT, help="Wall-clock limit of one sample's tests in seconds; the whole process group is killed on expiry.")
+    parser.add_argument("--limit_cpu_seconds", "-limit_cpu_seconds", type=int, default=None, help="RLIMIT_CPU of every test process. Unlimited if not set.")
+    parser.add_argument("--limit_memory_mb", "-limit_memory_mb", type=int, default=None, help="Memory limit of one test run (cgroup memory.max, or RLIMIT_DATA per process without --cgroup_path). Unlimited if not set.")
+    parser.add_argument("--limit_pids", "-limit_pids", type=int, default=None, help="Process limit of one test run (cgroup pids.max, or the user-wide RLIMIT_NPROC without --cgroup_path). Unlimited if not set.")
+    parser.add_argument("--cgroup_path", "-cgroup_path", type=str, default=None, help="Writable cgroup v2 directory; each test run gets a child cgroup for limits and accounting.")
+    parser.add_argument("--language_quotas", "-language_quotas", type=str, default="", help="Max concurrent tasks per language (at least 1), e.g. java=4,rust=8,python=32. Unlisted languages hold at most --language_share of the workers while other languages wait.")
+    parser.add_argument("--language_share", "-language_share", type=float, default=DEFAULT_LANGUAGE_SHARE, help="Share of --workers a language without a quota may hold while other languages have queued tasks; 0 disables the cap.")
+    parser.add_argument("--language_memory_mb", "-language_memory_mb", type=str, default="", help="Override the per-task memory estimate per language, e.g. java=1536,python=100.")
+    parser.add_argument("--memory_budget_mb", "-memory_budget_mb", type=int, default=None, help="Memory budget for all concurrently running tasks. Unlimited if not set.")
+    parser.add_argument("--contamination_index", "-contamination_index", type=str, default=None, help="N-gram index of the seed and polyglot-benchmark files (pipelines/utils/contamination.py build). Records overlapping it are written to <input_name>_contaminated.jsonl instead of being run. Disabled if not set.")
+    parser.add_argument("--contamination_threshold", "-contamination_threshold", type=float, default=CONTAMINATION_THRESHOLD, help="Share of a generated reply's n-grams found in the index from which its record is not run.")
+    parser.add_argument("--journal_path", "-journal_path", type=str, default=None, help="Completion journal used to resume killed runs and to reuse verdicts of identical samples. Defaults to <output_path>/<input_name>_journal.jsonl; share one path across runs to share verdicts.")
+    parser.add_argument("--duration_history", "-duration_history", type=str, default=None, help="JSON file of per-language durations used to run expensive tasks first; updated at the end of the run.")
     args = parser.parse_args()
     ensure_directory_exists(args.output_path, type="dir")
     ensure_directory_exists(args.tmp_path, type="dir")
+    try:
+        parse_language_values(args.language_quotas, minimum=1)
+        parse_language_values(args.language_memory_mb, minimum=0)
+    except ValueError as e:
+        parser.error(f"--language_quotas/--language_memory_mb: {e}")
+    if args.executor == "warm" and args.cgroup_path:
+        print("Warning: --cgroup_path kills what each test run leaves behind, so the warm executor runs java with the cold --no-daemon command")
+    if args.journal_path is None:
+        args.journal_path = os.path.join(args.output_path, os.path.basename(args.input_path).replace(".jsonl", "_journal.jsonl"))
     return args
 
 def main():
     main_args = parse_args()
-    objs = read_jsonl_file(
-        main_args.input_path,
-        start_index=main_args.start_index,
-        end_index=main_args.end_index
-    )
 
-    task_queue = []
-    for obj in objs:
-        task_queue.append(
-            {
-                "obj": obj,
-                "tmp_path": Path(main_args.tmp_path)
-            }
-        )
-    random.shuffle(task_queue)
-    task_bar = tqdm.tqdm(total=len(task_queue), desc=f"Job Running {main_args.workers} workers")
-    batch_size = main_args.batch_size
-    output_objs, error_objs = [], []
-    with ProcessPoolExecutor(max_workers=main_args.workers) as executor:
-        futures = [executor.submit(task_worker, task_args) for task_args in task_queue]
-        for i, future in enumerate(as_completed(futures), 1):
+    # skip records a previous run already wrote, reuse verdicts of identical samples,
+    # and only execute the first of several records that share a sample key
+    journal = CompletionJournal(main_args.journal_path)
+    followers = {}
+    counts = {"skipped": 0, "cached": 0, "duplicates": 0, "contaminated": 0}
+    contamination = ContaminationIndex(main_args.contamination_index) if main_args.contamination_index else None
+    # output_entries[i] is the journal entry of output_objs[i], completed with its line's offset
+    output_objs, output_entries, error_objs, journal_entries, contaminated_objs = [], [], [], [], []
+    output_file = os.path.join(main_args.output_path, os.path.basename(main_args.input_path))
+    error_file = os.path.join(main_args.output_path, os.path.basename(main_args.input_path).replace(".jsonl", "_error.jsonl"))
+    parsed_file = os.path.join(main_args.output_path, os.path.basename(main_args.input_path).replace(".jsonl", "_parsed.jsonl"))
+    parsed_error_file = os.path.join(main_args.output_path, os.path.basename(main_args.input_path).replace(".jsonl", "_parsed_error.jsonl"))
+    contaminated_file = os.path.join(main_args.output_path, os.path.basename(main_args.input_path).replace(".jsonl", "_contaminated.jsonl"))
+
+    def flush():
+        # output goes to disk before the journal marks it done
+        if output_objs:
+            if main_args.parse:
+                parse_outputs(output_objs)
+            for entry, offset in zip(output_entries, append_jsonl_lines(output_objs, output_file)):
+                entry["output"] = [os.path.abspath(output_file), offset]
+            journal_entries.extend(output_entries)
+            output_objs.clear()
+            output_entries.clear()
+        if error_objs:
+            write_jsonl_file(error_objs, error_file, format="a")
+            error_objs.clear()
+        if contaminated_objs:
+            write_jsonl_file(contaminated_objs, contaminated_file, format="a")
+            contaminated_objs.clear()
+        journal.append(journal_entries)
+        journal_entries.clear()
+
+    def parse_outputs(objs):
+        # the same annotation parser.py does, while the records are still in memory
+        parsed_objs, parse_errors = [], []
+        for obj in objs:
+            try:
+                parsed_objs.append(annotate(obj))
+            except Exception as e:
+                parse_errors.append(str(e))
+        if parsed_objs:
+            write_jsonl_file(parsed_objs, parsed_file, format="a")
+        if parse_errors:
+            write_jsonl_file(parse_errors, parsed_error_file, format="a")
+
+    def emit_output(task_args, result):
+        output_objs.append(result)
+        output_entries.append({"record": task_args["record_key"], "sample": task_args["sample_key"], "status": "done", "verdict": verdict_of(result["check_info"])})
+
+    def emit_cached(task_args, check_info, obj=None):
+        emit_output(task_args, cached_result(obj if obj is not None else read_record(task_args), check_info))
+        task_bar.update(1)
+
+    def needs_run(offset, obj):
+        """
+        Return the task of the record at `offset` if it has to be executed; skipped, cached
+        and duplicate records are handled here. Tasks do not keep the record itself.
+        """
+        task_args = {
+            "path": main_args.input_path,
+            "offset": offset,
+            "language": obj.get("language", ""),
+            "tmp_path": Path(main_args.tmp_path),
+            "record_key": record_key(obj),
+            "sample_key": None
+        }
+        if journal.record_done(task_args["record_key"]):
+            counts["skipped"] += 1
             task_bar.update(1)
-            e = future.exception()
-            if e:
-                error_objs.append(
-                    {
-                        # "obj": task_queue[i-1]["obj"],
-                        "error": str(e) + "\n" + traceback.format_exc()
-                    }
-                )
-            else:
-                obj = future.result()
-                output_objs.append(obj)
-            if i % batch_size == 0 or i == len(futures):
-                if output_objs:
-                    write_jsonl_file(output_objs, os.path.join(main_args.output_path, os.path.basename(main_args.input_path)), format="a")
-                    output_objs.clear()
-                if error_objs:
-                    write_jsonl_file(error_objs, os.path.join(main_args.output_path, os.path.basename(main_args.input_path).replace(".jsonl", "_error.jsonl")), format="a")
-                    error_objs.clear()
+            return None
+        if contamination is not None:
+            # routed out before any sandbox time is spent; rescored if the run is resumed
+            score = contamination.score_record(obj)
+            if score["overlap"] >= main_args.contamination_threshold:
+                counts["contaminated"] += 1
+                contaminated_objs.append(dict(obj, contamination=score))
+                task_bar.update(1)
+                return None
+        try:
+            task_args["sample_key"] = sample_key(messages_update_data_map(obj))
+        except Exception:
+            # the worker reports the same exception as an error record
+            pass
+        key = task_args["sample_key"]
+        check_info = journal.check_info(key) if key is not None else None
+        if check_info is not None:
+            counts["cached"] += 1
+            emit_cached(task_args, check_info, obj)
+            return None
+        if key is not None and key in followers:
+            counts["duplicates"] += 1
+            followers[key].append(task_args)
+            return None
+        if key is not None:
+            followers[key] = []
+        return task_args
+
+    index = JsonlIndex(main_args.input_path, os.path.join(main_args.output_path, os.path.basename(main_args.input_path) + ".idx"))
+    end_index = len(index) if main_args.end_index is None else min(main_args.end_index, len(index))
+    task_bar = tqdm.tqdm(total=max(end_index - main_args.start_index, 0), desc=f"Job Running {main_args.workers} workers")
+    records = index.iter_range(main_args.start_index, end_index)
+    if main_args.stream:
+        # records are read lazily from the shard start and at most --stream_window of them
+        # are held (queued or running) at a time
+        tasks = (task_args for _, offset, obj in records if (task_args := needs_run(offset, obj)) is not None)
+        window = main_args.stream_window or 4 * main_args.workers
+    else:
+        task_queue = [task_args for _, offset, obj in records if (task_args := needs_run(offset, obj)) is not None]
+        print(f"Journal {main_args.journal_path}: {counts['skipped']} already done, {counts['cached']} cached verdicts, {counts['duplicates']} duplicates, {counts['contaminated']} contaminated")
+        random.shuffle(task_queue)
+        tasks = iter(task_queue)
+        window = None
+    flush()
+    scheduler = LanguageScheduler(
+        quotas=parse_language_values(main_args.language_quotas),
+        memory_budget_mb=main_args.memory_budget_mb,
+        memory_mb=parse_language_values(main_args.language_memory_mb),
+        history_path=main_args.duration_history,
+        workers=main_args.workers,
+        share=main_args.language_share,
+    )
+    batch_size = main_args.batch_size
+
+    # templates are built once here and shared read-only by every worker
+    templates_root = templates_root_for(main_args.workspace_backend, main_args.tmp_path, main_args.tmpfs_path)
+    build_templates(templates_root)
+    limits = None
+    if main_args.limit_cpu_seconds or main_args.limit_memory_mb or main_args.limit_pids or main_args.cgroup_path:
+        limits = ResourceLimits(main_args.limit_cpu_seconds, main_args.limit_memory_mb, main_args.limit_pids, main_args.cgroup_path)
+    initargs = (main_args.executor, main_args.tmp_path, main_args.sandbox_cache, main_args.workspace_backend, main_args.keep_workspaces, main_args.tmpfs_path, templates_root, main_args.template_link, limits, main_args.timeout, main_args.build_cache, not main_args.no_test_reports, main_args.transcript_store, main_args.transcript_head_chars, main_args.transcript_tail_chars)
+    with ProcessPoolExecutor(max_workers=main_args.workers, initializer=init_worker, initargs=initargs) as executor:
+        # only hand the pool as many tasks as it has workers, so the scheduler decides what runs next
+        running = {}
+        exhausted = False
+        while True:
+            # top the scheduler up from the task source, up to the window
+            while not exhausted and (window is None or scheduler.pending() + len(running) < window):
+                task_args = next(tasks, None)
+                if task_args is None:
+                    exhausted = True
+                    break
+                scheduler.add(task_args, task_args["language"])
+            if not scheduler.pending() and not running:
+                break
+            while len(running) < main_args.workers:
+                task_args = scheduler.next_task()
+                if task_args is None:
+                    break
+                running[executor.submit(task_worker, task_args)] = (task_args, time.time())
+            if not running:
+                # cannot happen with quotas of at least 1, but wait() on nothing would spin
+                raise RuntimeError(f"No pending task can start: {scheduler.pending()} queued")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                task_args, start = running.pop(future)
+                task_bar.update(1)
+                e = future.exception()
+                scheduler.task_done(task_args["language"], time.time() - start, e is None)
+                key = task_args["sample_key"]
+                if e:
+                    error_objs.append(
+                        {
+                            "error": str(e) + "\n" + traceback.format_exc()
+                        }
+                    )
+                    journal_entries.append({"record": task_args["record_key"], "sample": key, "status": "failed"})
+                    # duplicates get their own chance instead of inheriting the failure
+                    for follower in followers.pop(key, []):
+                        scheduler.add(follower, follower["language"])
+                else:
+                    check_info = future.result()
+                    emit_output(task_args, join_result(read_record(task_args), check_info))
+                    for follower in followers.pop(key, []):
+                        emit_cached(follower, check_info)
+                if len(output_objs) + len(error_objs) >= batch_size:
+                    flush()
+    flush()
+    journal.close()
+    if contamination is not None:
+        contamination.close()
     task_bar.close()
+    if main_args.stream:
+        print(f"Journal {main_args.journal_path}: {counts['skipped']} already done, {counts['cached']} cached verdicts, {counts['duplicates']} duplicates, {counts['contaminated']} contaminated")
+    scheduler.save_history()
+    throughput = scheduler.throughput_report()
+    for language, stats in throughput["languages"].items():
+        print(f"{language:<12} {stats['samples']:>6} samples  {stats['succeeded']:>6} ok  {stats['mean_seconds']:.2f}s/sample  {stats['samples_per_minute']:.2f} samples/min")
+    save_json(throughput, os.path.join(main_args.output_path, os.path.basename(main_args.input_path).replace(".jsonl", "_throughput.json")))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,135 @@
+import contextlib
+import fcntl
+import hashlib
+import os
+import stat
+import subprocess
+from pathlib import Path
+
+# files whose content decides what a language's build artifacts look like
+MANIFEST_FILES = {
+    "rust": ["Cargo.toml"],
+    "java": ["build.gradle"],
+    "javascript": ["package.json", ".npmrc"],
+}
+NPM_INSTALL_TIMEOUT = 60 * 10
+
+
+def manifest_hash(unit_test_cwd_path, language):
+    sha = hashlib.sha256(language.encode())
+    for filename in MANIFEST_FILES.get(language, []):
+        file_path = Path(unit_test_cwd_path) / filename
+        sha.update(b"\0" + filename.encode() + b"\0")
+        if file_path.exists():
+            sha.update(file_path.read_bytes())
+    return sha.hexdigest()
+
+
+class SandboxCache:
+    """
+    Build artifact store shared by every worker process of a verification run:
+        rust:       CARGO_TARGET_DIR keyed by the Cargo.toml hash; each key has a pool of slots
+                    and a worker holds an exclusive lock on its slot while cargo runs in it.
+        java:       one GRADLE_USER_HOME for all samples; gradle locks its own caches, and
+                    keying it by build.gradle would only re-download the wrapper per key.
+        javascript: node_modules keyed by the package.json hash, installed once, made read-only
+                    and symlinked into the sample workspace.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root).absolute()
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    @contextlib.contextmanager
+    def acquire(self, unit_test_cwd_path, language, env):
+        """
+        Prepare the workspace and yield the environment the test command should run with.
+        Locks taken for the sample are released on exit.
+        """
+        unit_test_cwd_path = Path(unit_test_cwd_path)
+        if language == "rust":
+            with self._rust_slot(manifest_hash(unit_test_cwd_path, language)) as target_dir:
+                yield dict(env, CARGO_TARGET_DIR=str(target_dir))
+        elif language == "java":
+            yield dict(env, GRADLE_USER_HOME=str(self.root / "java" / "gradle-home"))
+        elif language == "javascript":
+            self._link_node_modules(unit_test_cwd_path, env)
+            yield env
+        else:
+            yield env
+
+    @contextlib.contextmanager
+    def _rust_slot(self, key):
+        key_dir = self.root / "rust" / key
+        key_dir.mkdir(parents=True, exist_ok=True)
+        slot = 0
+        while True:
+            lock_file = open(key_dir / f"slot_{slot}.lock", "w")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                lock_file.close()
+                slot += 1
+        try:
+            yield key_dir / f"slot_{slot}"
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+    def _link_node_modules(self, unit_test_cwd_path, env):
+        if not (unit_test_cwd_path / "package.json").exists() or (unit_test_cwd_path / "node_modules").exists():
+            return
+        store_dir = self._node_modules_store(unit_test_cwd_path, manifest_hash(unit_test_cwd_path, "javascript"), env)
+        if store_dir is not None:
+            os.symlink(store_dir / "node_modules", unit_test_cwd_path / "node_modules", target_is_directory=True)
+
+    def _node_modules_store(self, unit_test_cwd_path, key, env):
+        store_dir = self.root / "javascript" / key
+        if (store_dir / ".complete").exists():
+            return store_dir
+        if (store_dir / ".failed").exists():
+            return None
+        store_dir.mkdir(parents=True, exist_ok=True)
+        with open(store_dir / ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # another worker may have populated the store while we waited for the lock
+            if (store_dir / ".complete").exists():
+                return store_dir
+            if (store_dir / ".failed").exists():
+                return None
+            for filename in MANIFEST_FILES["javascript"]:
+                if (unit_test_cwd_path / filename).exists():
+                    (store_dir / filename).write_bytes((unit_test_cwd_path / filename).read_bytes())
+            try:
+                result = subprocess.run(
+                    ["npm", "install"],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    text=True,
+                    timeout=NPM_INSTALL_TIMEOUT,
+                    cwd=store_dir,
+                    env=env,
+                    encoding="utf-8",
+                    errors="replace",
+                )
+                returncode, res = result.returncode, result.stdout
+            except Exception as e:
+                returncode, res = -1, str(e)
+            if returncode != 0 or not (store_dir / "node_modules").exists():
+                (store_dir / ".failed").write_text(res)
+                return None
+            make_read_only(store_dir / "node_modules")
+            (store_dir / ".complete").write_text("")
+        return store_dir
+
+
+def make_read_only(path):
+    for root, dirs, files in os.walk(path):
+        for name in files + dirs:
+            file_path = os.path.join(root, name)
+            if not os.path.islink(file_path):
+                mode = os.stat(file_path).st_mode
+                os.chmod(file_path, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+    mode = os.stat(path).st_mode
+    os.chmod(path, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
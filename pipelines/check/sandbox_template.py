@@ -0,0 +1,128 @@
+import errno
+import hashlib
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import uuid
+from pathlib import Path
+
+root_dir = Path(__file__).parent.parent.parent
+root_dir_str = str(root_dir)
+if root_dir_str not in sys.path:
+    sys.path.append(root_dir_str)
+
+from pipelines.utils.setting import APPEND_FILES
+
+UNIT_TEST_RESOURCES_PATH = root_dir / "pipelines" / "utils" / "unit_test_resources"
+TEMPLATE_LINK_METHODS = ["hardlink", "reflink", "copy", "none"]
+
+# files the template provides besides APPEND_FILES, and the executable bits
+# unit_test_command_preparation would otherwise set on every sample
+TEMPLATE_RESOURCES = {
+    "cpp": {"catch.hpp": UNIT_TEST_RESOURCES_PATH / "cpp" / "catch.hpp"},
+    "java": {"gradle/wrapper/gradle-wrapper.jar": UNIT_TEST_RESOURCES_PATH / "java" / "gradle-wrapper.jar"},
+}
+TEMPLATE_EXECUTABLES = {
+    "cpp": ["cpp-test.sh"],
+    "java": ["gradlew", "gradle/wrapper/gradle-wrapper.jar"],
+    "javascript": ["npm-test.sh"],
+}
+
+
+def template_hash(language):
+    sha = hashlib.sha256(language.encode())
+    for filename, content in sorted(APPEND_FILES.get(language, {}).items()):
+        sha.update(b"\0" + filename.encode() + b"\0" + content.encode())
+    for filename, source in sorted(TEMPLATE_RESOURCES.get(language, {}).items()):
+        sha.update(b"\0" + filename.encode() + b"\0" + Path(source).read_bytes())
+    return sha.hexdigest()[:16]
+
+
+class SandboxTemplate:
+    """
+    Immutable directory holding the files every sample of one language starts from.
+    It is keyed by the hash of its content, so a template built by an earlier run is
+    reused as long as APPEND_FILES and the resources did not change. Files are read-only;
+    workspaces get hardlinks or reflinks to them and replace (never modify) a file when
+    the model provides its own version.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.dirs, self.files = [], []
+        for root, dirs, files in os.walk(self.path):
+            rel = os.path.relpath(root, self.path)
+            for name in dirs:
+                self.dirs.append(os.path.normpath(os.path.join(rel, name)))
+            for name in files:
+                self.files.append(os.path.normpath(os.path.join(rel, name)))
+
+    def materialise(self, dest, method="hardlink"):
+        dest = Path(dest)
+        if method == "reflink":
+            dest.mkdir(parents=True, exist_ok=True)
+            result = subprocess.run(["cp", "-R", "--preserve=mode", "--reflink=auto", f"{self.path}/.", str(dest)], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+            if result.returncode != 0:
+                raise OSError(f"cp --reflink failed: {result.stdout}")
+            return
+        dest.mkdir(parents=True, exist_ok=True)
+        for name in self.dirs:
+            (dest / name).mkdir(exist_ok=True)
+        for name in self.files:
+            if method == "hardlink":
+                try:
+                    os.link(self.path / name, dest / name)
+                    continue
+                except OSError as e:
+                    # different filesystem or no permission: copy this and every later file
+                    if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                        raise
+                    method = "copy"
+            shutil.copy2(self.path / name, dest / name)
+
+
+def build_template(templates_root, language):
+    """
+    Build (or reuse) the template of `language` under templates_root and return it.
+    Safe to call from several processes: the template is built in a private directory
+    and renamed into place.
+    """
+    path = Path(templates_root) / f"{language}-{template_hash(language)}"
+    if not path.exists():
+        building = Path(templates_root) / f".{language}-{uuid.uuid4().hex}"
+        building.mkdir(parents=True)
+        for filename, content in APPEND_FILES.get(language, {}).items():
+            (building / filename).parent.mkdir(parents=True, exist_ok=True)
+            (building / filename).write_text(content)
+        for filename, source in TEMPLATE_RESOURCES.get(language, {}).items():
+            (building / filename).parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy(source, building / filename)
+        executables = set(TEMPLATE_EXECUTABLES.get(language, []))
+        for root, dirs, files in os.walk(building):
+            for name in files:
+                file_path = os.path.join(root, name)
+                executable = os.path.relpath(file_path, building) in executables
+                os.chmod(file_path, 0o555 if executable else 0o444)
+        try:
+            os.rename(building, path)
+        except OSError:
+            # another process won the race, use its copy
+            shutil.rmtree(building, ignore_errors=True)
+    return SandboxTemplate(path)
+
+
+def build_templates(templates_root, languages=None):
+    languages = languages or list(APPEND_FILES)
+    Path(templates_root).mkdir(parents=True, exist_ok=True)
+    return {language: build_template(templates_root, language) for language in languages}
+
+
+def remove_templates(templates_root):
+    for root, dirs, files in os.walk(templates_root):
+        for name in dirs + files:
+            file_path = os.path.join(root, name)
+            if not os.path.islink(file_path):
+                os.chmod(file_path, os.stat(file_path).st_mode | stat.S_IWUSR)
+    shutil.rmtree(templates_root, ignore_errors=True)
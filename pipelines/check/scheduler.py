@@ -0,0 +1,142 @@
+import json
+import math
+import os
+import time
+from collections import deque
+
+# rough resident memory of one test run, used against --memory_budget_mb
+DEFAULT_LANGUAGE_MEMORY_MB = {
+    "java": 1024,
+    "rust": 512,
+    "cpp": 384,
+    "go": 256,
+    "javascript": 384,
+    "python": 128,
+}
+# predicted seconds per sample until the duration history has seen the language
+DEFAULT_LANGUAGE_SECONDS = {
+    "java": 40.0,
+    "rust": 20.0,
+    "cpp": 15.0,
+    "go": 8.0,
+    "javascript": 10.0,
+    "python": 2.0,
+}
+HISTORY_DECAY = 0.1
+# share of the workers a language without a quota may hold while other languages wait
+DEFAULT_LANGUAGE_SHARE = 0.5
+
+
+def parse_language_values(value, cast=int, minimum=None):
+    """
+    Parse "java=4,rust=8,python=32" into {"java": 4, "rust": 8, "python": 32}.
+    Raises ValueError on a malformed item or a number below `minimum`.
+    """
+    result = {}
+    if not value:
+        return result
+    for item in value.split(","):
+        language, _, number = item.partition("=")
+        if not language.strip() or not number:
+            raise ValueError(f"expected language=number, got {item!r}")
+        result[language.strip()] = cast(number)
+        if minimum is not None and result[language.strip()] < minimum:
+            raise ValueError(f"{language.strip()} must be at least {minimum}, got {number}")
+    return result
+
+
+class LanguageScheduler:
+    """
+    Decide which queued task runs next on a worker pool.
+    Each language has a concurrency quota and a memory cost; a task only starts if its
+    language is under quota and the memory of all running tasks stays within budget.
+    Among the languages that may start, the one with the longest predicted duration goes
+    first (longest-processing-time first), which keeps long gradle/cargo runs from piling
+    up at the tail of the run. So that this does not hand every worker to java first, a
+    language without a quota holds at most `share` of the `workers` while another language
+    could start. Predictions are per-language moving averages, persisted in
+    `history_path` so the next run starts from real numbers.
+    """
+
+    def __init__(self, quotas=None, memory_budget_mb=None, memory_mb=None, history_path=None, workers=None, share=DEFAULT_LANGUAGE_SHARE):
+        self.quotas = quotas or {}
+        self.share_limit = max(1, math.ceil(workers * share)) if workers and share else None
+        self.memory_budget_mb = memory_budget_mb
+        self.memory_mb = dict(DEFAULT_LANGUAGE_MEMORY_MB, **(memory_mb or {}))
+        self.history_path = history_path
+        self.history = {}
+        if history_path and os.path.exists(history_path):
+            with open(history_path, "r") as f:
+                self.history = json.load(f)
+        self.queues = {}
+        self.running = {}
+        self.running_memory_mb = 0
+        self.stats = {}
+        self.start_time = time.time()
+
+    def add(self, task, language):
+        self.queues.setdefault(language, deque()).append(task)
+
+    def pending(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def predicted_seconds(self, language):
+        if language in self.history:
+            return self.history[language]["mean_seconds"]
+        return DEFAULT_LANGUAGE_SECONDS.get(language, 10.0)
+
+    def next_task(self):
+        """
+        Pop the next task allowed to start, or None if every queued language is blocked.
+        """
+        candidates = []
+        for language, queue in self.queues.items():
+            if not queue:
+                continue
+            if language in self.quotas and self.running.get(language, 0) >= self.quotas[language]:
+                continue
+            memory_mb = self.memory_mb.get(language, 0)
+            # a single task may always run on an idle pool, or oversized languages would starve
+            if self.memory_budget_mb is not None and self.running and self.running_memory_mb + memory_mb > self.memory_budget_mb:
+                continue
+            over_share = self.share_limit is not None and language not in self.quotas and self.running.get(language, 0) >= self.share_limit
+            candidates.append((not over_share, self.predicted_seconds(language), language))
+        if not candidates:
+            return None
+        _, _, language = max(candidates)
+        self.running[language] = self.running.get(language, 0) + 1
+        self.running_memory_mb += self.memory_mb.get(language, 0)
+        return self.queues[language].popleft()
+
+    def task_done(self, language, seconds, success):
+        self.running[language] -= 1
+        if self.running[language] == 0:
+            self.running.pop(language)
+        self.running_memory_mb -= self.memory_mb.get(language, 0)
+
+        stats = self.stats.setdefault(language, {"samples": 0, "succeeded": 0, "busy_seconds": 0.0})
+        stats["samples"] += 1
+        stats["succeeded"] += int(success)
+        stats["busy_seconds"] += seconds
+
+        history = self.history.setdefault(language, {"mean_seconds": seconds, "samples": 0})
+        history["mean_seconds"] = (1 - HISTORY_DECAY) * history["mean_seconds"] + HISTORY_DECAY * seconds
+        history["samples"] += 1
+
+    def save_history(self):
+        if not self.history_path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.history_path)), exist_ok=True)
+        with open(self.history_path, "w") as f:
+            json.dump(self.history, f, indent=4)
+
+    def throughput_report(self):
+        wall_seconds = time.time() - self.start_time
+        report = {"wall_seconds": wall_seconds, "languages": {}}
+        for language, stats in sorted(self.stats.items()):
+            report["languages"][language] = dict(
+                stats,
+                mean_seconds=stats["busy_seconds"] / stats["samples"],
+                samples_per_minute=60 * stats["samples"] / max(wall_seconds, 1e-9),
+            )
+        return report
@@ -0,0 +1,71 @@
+import gzip
+import hashlib
+import os
+from pathlib import Path
+
+from pipelines.check.parser_engine import get_grammar
+
+TRANSCRIPT_HEAD_CHARS = 4096
+TRANSCRIPT_TAIL_CHARS = 8192
+
+
+class TranscriptStore:
+    """
+    Bounds the test transcript kept in check_info["res"]. A transcript longer than
+    head_chars + tail_chars keeps only its head and tail inline; the full text goes to
+    root/<sha256[:2]>/<sha256>.log.gz, which identical transcripts share, and check_info
+    gets
+        "res_ref":     {"sha256": str, "chars": int, "path": str relative to root}
+        "res_summary": {"total", "passed", "failed", "errors"} parsed from the full text,
+                       so check/parser.py does not depend on what was cut out.
+    Shorter transcripts are left untouched.
+    """
+
+    def __init__(self, root, head_chars=TRANSCRIPT_HEAD_CHARS, tail_chars=TRANSCRIPT_TAIL_CHARS):
+        self.root = Path(root).absolute()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.head_chars = head_chars
+        self.tail_chars = tail_chars
+
+    def bound(self, check_info, language):
+        res = check_info.get("res")
+        if not isinstance(res, str) or len(res) <= self.head_chars + self.tail_chars:
+            return check_info
+        grammar = get_grammar(language)
+        if grammar is not None:
+            total, passed, failed, errors = grammar.parse(res)
+            check_info["res_summary"] = {"total": total, "passed": passed, "failed": failed, "errors": errors}
+        check_info["res_ref"] = self.put(res)
+        check_info["res"] = truncate(res, self.head_chars, self.tail_chars)
+        return check_info
+
+    def put(self, res):
+        data = res.encode("utf-8", errors="surrogateescape")
+        sha = hashlib.sha256(data).hexdigest()
+        rel = os.path.join(sha[:2], f"{sha}.log.gz")
+        path = self.root / rel
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            # mtime=0 keeps the gzip bytes a pure function of the content
+            with open(tmp_path, "wb") as f, gzip.GzipFile(fileobj=f, mode="wb", compresslevel=6, mtime=0) as gz:
+                gz.write(data)
+            os.replace(tmp_path, path)
+        return {"sha256": sha, "chars": len(res), "path": rel}
+
+
+def truncate(res, head_chars, tail_chars):
+    omitted = len(res) - head_chars - tail_chars
+    return f"{res[:head_chars]}\n... [{omitted} chars omitted, see check_info.res_ref] ...\n{res[len(res) - tail_chars:]}"
+
+
+def load_transcript(check_info, root):
+    """
+    The full transcript of a record: the sidecar under `root` if it was truncated,
+    check_info["res"] otherwise.
+    """
+    ref = check_info.get("res_ref")
+    if ref is None:
+        return check_info.get("res", "")
+    with gzip.open(Path(root) / ref["path"], "rb") as f:
+        return f.read().decode("utf-8", errors="surrogateescape")
@@ -0,0 +1,157 @@
+import os
+import shutil
+import subprocess
+import sys
+import uuid
+from pathlib import Path
+
+root_dir = Path(__file__).parent.parent.parent
+root_dir_str = str(root_dir)
+if root_dir_str not in sys.path:
+    sys.path.append(root_dir_str)
+
+from pipelines.check.sandbox_template import build_template
+from pipelines.utils.setting import APPEND_FILES
+
+WORKSPACE_BACKENDS = ["disk", "tmpfs", "overlay"]
+KEEP_POLICIES = ["always", "failed", "never"]
+DEFAULT_TMPFS_PATH = "/dev/shm"
+
+
+def write_files(base_path, files):
+    """
+    Materialise {relative path: content} under base_path in one pass, creating every
+    parent directory once instead of once per file.
+    """
+    created = set()
+    for filename, content in files.items():
+        file_path = base_path / filename
+        parent = file_path.parent
+        if parent not in created:
+            parent.mkdir(parents=True, exist_ok=True)
+            created.add(parent)
+        if file_path.is_symlink() or file_path.exists():
+            # never write through a link into a shared lower layer or template
+            file_path.unlink()
+        with open(file_path, "w") as f:
+            f.write(content)
+
+
+def templates_root_for(backend, tmp_path, tmpfs_path=DEFAULT_TMPFS_PATH):
+    # hardlinks need the templates on the same filesystem as the workspaces
+    if backend == "disk":
+        return Path(tmp_path).absolute() / "templates"
+    return Path(tmpfs_path) / "unit_test_templates"
+
+
+class Workspace:
+    def __init__(self, manager, language, folder, root):
+        self.manager = manager
+        self.language = language
+        self.folder = folder
+        # unit_test_<uuid>, the sample's files live in root / folder
+        self.root = root
+        self.cwd = root / folder
+        self.mounted = False
+        self.linked = False
+        self.failed = False
+
+    @property
+    def has_template(self):
+        return self.mounted or self.linked
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.failed = True
+        self.manager.release(self)
+        return False
+
+
+class WorkspaceManager:
+    """
+    Create and tear down the unit_test_<uuid> directory of every sample.
+        disk:    under --tmp_path, as before.
+        tmpfs:   under a RAM-backed directory (/dev/shm by default), so millions of small
+                 files never reach the disk.
+        overlay: on tmpfs, with the sample folder mounted as an overlayfs whose read-only
+                 lower layer is the per-language template; only model files get written.
+                 Needs permission to mount, otherwise falls back to tmpfs.
+    On disk and tmpfs the template is hardlinked (or reflinked/copied, see template_link)
+    into the sample folder instead, so APPEND_FILES are not rewritten for every sample.
+    Templates are immutable and shared by all workers; pass templates_root to reuse the
+    ones built at startup.
+    Workspaces are released when the `with` block ends. `keep` decides what survives:
+    "always" keeps everything (the original behaviour), "failed" copies workspaces of
+    failed samples to keep_path before removing them, "never" removes all of them.
+    """
+
+    def __init__(self, tmp_path, backend="disk", keep="always", tmpfs_path=DEFAULT_TMPFS_PATH, keep_path=None, templates_root=None, template_link="hardlink"):
+        if backend not in WORKSPACE_BACKENDS:
+            raise ValueError(f"Invalid workspace backend: {backend}")
+        if keep not in KEEP_POLICIES:
+            raise ValueError(f"Invalid keep policy: {keep}")
+        self.backend = backend
+        self.keep = keep
+        self.tmp_path = Path(tmp_path).absolute()
+        self.keep_path = Path(keep_path).absolute() if keep_path else self.tmp_path / "kept"
+        if backend == "disk":
+            self.root = self.tmp_path
+        else:
+            self.root = Path(tmpfs_path) / f"unit_test_workspaces_{os.getpid()}"
+        self.templates_root = Path(templates_root) if templates_root else templates_root_for(backend, tmp_path, tmpfs_path)
+        self.template_link = template_link
+        self.templates = {}
+        self.overlay_available = backend == "overlay"
+
+    def template(self, language):
+        if language not in self.templates:
+            self.templates[language] = build_template(self.templates_root, language) if language in APPEND_FILES else None
+        return self.templates[language]
+
+    def create(self, language, folder):
+        root = self.root / language / f"unit_test_{str(uuid.uuid4()).replace('-', '_')}"
+        root.mkdir(parents=True, exist_ok=True)
+        workspace = Workspace(self, language, folder, root)
+        template = self.template(language)
+        if template is None:
+            return workspace
+        if self.overlay_available:
+            workspace.mounted = self._mount_overlay(workspace)
+        if not workspace.mounted and self.template_link != "none":
+            template.materialise(workspace.cwd, self.template_link)
+            workspace.linked = True
+        return workspace
+
+    def _mount_overlay(self, workspace):
+        upper, work = workspace.root / ".upper", workspace.root / ".work"
+        for path in (upper, work, workspace.cwd):
+            path.mkdir(parents=True, exist_ok=True)
+        result = subprocess.run(
+            ["mount", "-t", "overlay", "overlay", "-o",
+             f"lowerdir={self.template(workspace.language).path},upperdir={upper},workdir={work}", str(workspace.cwd)],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+        if result.returncode != 0:
+            print(f"Warning: cannot mount overlay workspaces, falling back to tmpfs: {result.stdout.strip()}")
+            self.overlay_available = False
+            return False
+        return True
+
+    def release(self, workspace):
+        if self.keep == "always" or (self.keep == "failed" and workspace.failed):
+            if self.backend == "disk":
+                # already on disk where the original pipeline left it
+                return
+            shutil.copytree(workspace.cwd, self.keep_path / workspace.language / workspace.root.name / workspace.folder, symlinks=True)
+        if workspace.mounted:
+            subprocess.run(["umount", "-l", str(workspace.cwd)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        shutil.rmtree(workspace.root, ignore_errors=True)
+
+    def close(self):
+        if self.backend != "disk":
+            shutil.rmtree(self.root, ignore_errors=True)
@@ -1,4 +1,5 @@
 from concurrent.futures import ProcessPoolExecutor, as_completed
+import asyncio
 import json
 import os
 from pathlib import Path
@@ -9,8 +10,8 @@ import jsonlines
 import datetime
 import argparse
 import tqdm
-from openai import OpenAI
 import copy
+import functools
 
 
 def ensure_directory_exists(path, type="file"):
@@ -68,78 +69,51 @@ def save_json(data, filename, indent = 4, format="w") -> None:
 
 
 # 添加项目根目录到 Python 路径
-root_dir = Path(__file__).parent.parent
+root_dir = Path(__file__).parent.parent.parent
 root_dir_str = str(root_dir)
 if root_dir_str not in sys.path:
     sys.path.append(root_dir_str)
 
+from pipelines.utils.llm_client import DEFAULT_CLIENT_ARGS, AsyncChatClient, arun_conversation, chat_completion, run_conversation
+from pipelines.utils.rate_governor import RateGovernor
+from pipelines.utils.llm_cache import DEFAULT_CACHE_MAX_MB, ResponseCache
+from pipelines.utils.retry_queue import DEFAULT_MAX_ATTEMPTS, DEFAULT_RETRY_BASE_DELAY, DEFAULT_RETRY_MAX_DELAY, RetryQueue, run_async, run_pool
+from pipelines.utils.tools import FileBlockStream
 
-def _chat(client_args, chat_args):
-    client = OpenAI(
-        **client_args
-    )
-    response = client.chat.completions.create(
-        **chat_args
-    )
-    content = ""
-    reasoning_content = ""
-    if "stream" in chat_args and chat_args["stream"]:
-        for chunk in response:
-            if hasattr(chunk, "choices") and len(chunk.choices) > 0 and hasattr(chunk.choices[0], "delta"):
-                delta = chunk.choices[0].delta
-                if hasattr(delta, "content"):
-                    content += delta.content
-                if hasattr(delta, "reasoning_content"):
-                    reasoning_content += delta.reasoning_content
-    else:
-        if hasattr(response, "choices") and len(response.choices) > 0 and hasattr(response.choices[0], "message"):
-            message = response.choices[0].message
-            if hasattr(message, "content"):
-                content = message.content
-            if hasattr(message, "reasoning_content"):
-                reasoning_content = message.reasoning_content
-    if reasoning_content and reasoning_content.strip() != "":
-        return_str = "<think>\n" + reasoning_content + "\n</think>\n" + content 
-    else:
-        return_str = content
-    return return_str
+WORKER_GOVERNOR = None
+WORKER_CACHE = None
+
+
+def init_worker(governor_args, cache_args=None):
+    # each pool worker paces its own share of the endpoint's limits; the cache file is shared
+    global WORKER_GOVERNOR, WORKER_CACHE
+    WORKER_GOVERNOR = RateGovernor(**governor_args)
+    if cache_args is not None:
+        WORKER_CACHE = ResponseCache(**cache_args)
+
+def _chat(client_args, chat_args, governor=None, cache=None, watch=None):
+    # 同一进程内的所有请求共用一个 client 及其长连接
+    return chat_completion(client_args, chat_args, governor, cache, watch)
 
 def chat(
-        client_args = {"base_url": os.environ.get("OPENAI_API_BASE", "https://api.openai.com/v1/"), "api_key": os.environ.get("OPENAI_API_KEY"), "timeout": 600, "max_retries": 10}, 
-        chat_args = {"model": "deepseek-r1-inner", "messages": [{"role": "user", "content": "Hello, how are you?"}]}
+        client_args = DEFAULT_CLIENT_ARGS, 
+        chat_args = {"model": "deepseek-r1-inner", "messages": [{"role": "user", "content": "Hello, how are you?"}]},
+        governor = None,
+        cache = None,
+        watch = None,
     ):
     try:
-        return _chat(client_args, chat_args)
+        return _chat(client_args, chat_args, governor, cache, watch)
     except Exception as e:
         return "Retry" + str(e)
 
-def task_worker(task_args):
-    obj = task_args.get("obj", {})
-    model = task_args.get("model", "deepseek-v3-inner")
-    result = copy.deepcopy(obj)
-
-    raw_language = result.get("language", "")
-    source_messages = result.get("source_messages", {})
-    raw_question_chat_messages = source_messages.get("question", [])
-    raw_project_name_chat_messages = source_messages.get("project_name", [])
-    if "source_models" not in result:
-        result["source_models"] = {}
-    else:
-        result["source_models"]["answer"] = model
-        result["source_models"]["unit_test"] = model
-    if len(raw_question_chat_messages) > 0 and "Retry" in raw_question_chat_messages[-1]["content"].strip():
-        raise Exception(raw_question_chat_messages[-1]["content"].strip().replace("Retry", ""))
-    if len(raw_project_name_chat_messages) > 0 and "Retry" in raw_project_name_chat_messages[-1]["content"].strip():
-        raise Exception(raw_project_name_chat_messages[-1]["content"].strip().replace("Retry", ""))
-    
-    end_suffix = ""
-    if raw_language == "rust" or raw_language == "javascript":
-        if raw_language == "rust":
-            end_suffix = "Attention Our Rust Environment is `rustc 1.75.0 (82e1608df 2023-12-21) (built from a source tarball)`, only support rust edition <= 2021."
-        else:
-            end_suffix = "Attention Our JavaScript Environment is `Node.js v16.20.2`."
+async def async_chat(client, chat_args, watch=None):
+    try:
+        return await client.chat(chat_args, watch=watch)
+    except Exception as e:
+        return "Retry" + str(e)
 
-    format_reminder = """When Creating files, maintain a consistent folder structure as shown in the examples by providing the appropriate path/to/filename and adhere to the following format:
+FORMAT_REMINDER = """When Creating files, maintain a consistent folder structure as shown in the examples by providing the appropriate path/to/filename and adhere to the following format:
 
 path/to/filename
 ```
@@ -153,9 +127,8 @@ path/to/filename
 
 Please ensure that you *never* skip, omit, or abbreviate content using ellipsis (...) or by adding comments like "... rest of code...". Use only standard libraries in your code.
 """
-    project_name = raw_project_name_chat_messages[-1]["content"].strip().replace("```\n", "").replace("\n```", "")
 
-    unit_test_prompt_template = """Please supply a comprehensive {language} unit test for this question. DO NOT include any answer or any other things at this stage.
+UNIT_TEST_PROMPT_TEMPLATE = """Please supply a comprehensive {language} unit test for this question. DO NOT include any answer or any other things at this stage.
 
 {format_reminder}
 
@@ -163,16 +136,7 @@ Attention to follow and implement the `{project_name}` project structure, each f
 
 Now, begin! {end_suffix}"""
 
-    unit_test_chat_messages = copy.deepcopy(raw_project_name_chat_messages)
-    unit_test_chat_messages.append({"role": "user", "content": unit_test_prompt_template.format(language=raw_language, format_reminder=format_reminder, project_name=project_name, end_suffix=end_suffix)})
-    unit_test_response = chat(chat_args={"messages": unit_test_chat_messages, "model": model})
-    if unit_test_response.strip() == "Retry":
-        raise Exception("Unit test generation failed")
-    unit_test_chat_messages.append({"role": "assistant", "content": unit_test_response})
-    result["source_messages"]["unit_test"] = unit_test_chat_messages
-    
-
-    answer_prompt_template = """Please supply a comprehensive {language} answer and necessary dependencies for this question.
+ANSWER_PROMPT_TEMPLATE = """Please supply a comprehensive {language} answer and necessary dependencies for this question.
 
 {format_reminder}
 
@@ -180,21 +144,105 @@ Attention to follow and implement the `{project_name}` project structure, each f
 
 Now, begin! {end_suffix}"""
 
-    answer_chat_messages = copy.deepcopy(unit_test_chat_messages)
-    answer_chat_messages.append({"role": "user", "content": answer_prompt_template.format(language=raw_language, format_reminder=format_reminder, project_name=project_name, end_suffix=end_suffix)})
-    answer_response = chat(chat_args={"messages": answer_chat_messages, "model": model})
-    if answer_response.strip() == "Retry":
-        raise Exception("Answer generation failed")
+@functools.lru_cache(maxsize=4096)
+def render_prompt(template, language, project_name):
+    """
+    渲染单元测试/答案的提示词；同一语言和项目名的结果会被缓存。
+    """
+    end_suffix = ""
+    if language == "rust" or language == "javascript":
+        if language == "rust":
+            end_suffix = "Attention Our Rust Environment is `rustc 1.75.0 (82e1608df 2023-12-21) (built from a source tarball)`, only support rust edition <= 2021."
+        else:
+            end_suffix = "Attention Our JavaScript Environment is `Node.js v16.20.2`."
+    return template.format(language=language, format_reminder=FORMAT_REMINDER, project_name=project_name, end_suffix=end_suffix)
+
+def task_worker(task_args):
+    return run_conversation(conversation(task_args), lambda chat_args, watch=None: chat(chat_args=chat_args, governor=WORKER_GOVERNOR, cache=WORKER_CACHE, watch=watch))
+
+def request(chat_args, files):
+    """
+    带 files（FileBlockStream）时流式请求：文件块随回复到达被收集，回复格式出错时立即中止生成。
+    """
+    if files is None:
+        return chat_args
+    return dict(chat_args, stream=True), files
+
+def conversation(task_args):
+    """
+    一个任务的全部请求写成生成器：每次 yield 一个请求的 chat_args，并接收其回复，
+    见 pipelines/utils/llm_client.py。返回结果记录。
+    """
+    obj = task_args.get("obj", {})
+    model = task_args.get("model", "deepseek-v3-inner")
+    stream = task_args.get("stream", False)
+    result = copy.deepcopy(obj)
+
+    raw_language = result.get("language", "")
+    source_messages = result.get("source_messages", {})
+    raw_question_chat_messages = source_messages.get("question", [])
+    raw_project_name_chat_messages = source_messages.get("project_name", [])
+    if "source_models" not in result:
+        result["source_models"] = {}
+    else:
+        result["source_models"]["answer"] = model
+        result["source_models"]["unit_test"] = model
+    if len(raw_question_chat_messages) > 0 and "Retry" in raw_question_chat_messages[-1]["content"].strip():
+        raise Exception(raw_question_chat_messages[-1]["content"].strip().replace("Retry", ""))
+    if len(raw_project_name_chat_messages) > 0 and "Retry" in raw_project_name_chat_messages[-1]["content"].strip():
+        raise Exception(raw_project_name_chat_messages[-1]["content"].strip().replace("Retry", ""))
+
+    project_name = raw_project_name_chat_messages[-1]["content"].strip().replace("```\n", "").replace("\n```", "")
+
+    # 每一轮都在上一轮的消息后追加，前缀逐字节不变，便于服务端的 prefix/KV cache 命中
+    unit_test_chat_messages = raw_project_name_chat_messages + [{"role": "user", "content": render_prompt(UNIT_TEST_PROMPT_TEMPLATE, raw_language, project_name)}]
+    unit_test_files = FileBlockStream() if stream else None
+    unit_test_response = yield request({"messages": unit_test_chat_messages, "model": model}, unit_test_files)
+    if unit_test_response.startswith("Retry"):
+        raise Exception("Unit test generation failed: " + unit_test_response[len("Retry"):])
+    unit_test_chat_messages.append({"role": "assistant", "content": unit_test_response})
+    result["source_messages"]["unit_test"] = unit_test_chat_messages
+
+    answer_chat_messages = unit_test_chat_messages + [{"role": "user", "content": render_prompt(ANSWER_PROMPT_TEMPLATE, raw_language, project_name)}]
+    answer_files = FileBlockStream() if stream else None
+    answer_response = yield request({"messages": answer_chat_messages, "model": model}, answer_files)
+    if answer_response.startswith("Retry"):
+        raise Exception("Answer generation failed: " + answer_response[len("Retry"):])
     answer_chat_messages.append({"role": "assistant", "content": answer_response})
     result["source_messages"]["answer"] = answer_chat_messages
+    if stream:
+        # 与 parse_stacked_content 对完整回复的结果相同，校验阶段不必再解析
+        result["files"] = {"unit_test": unit_test_files.files, "answer": answer_files.files}
 
     return result
 
+async def run_tasks_async(retry_queue, concurrency, handle, governor, cache=None):
+    """
+    在一个事件循环中运行所有任务的对话，共用一个带连接池的 client，同时最多 `concurrency` 个请求；
+    失败的任务回到 retry_queue 重试，每个任务成功或用完重试次数时调用 handle(i, total, obj, e)。
+    """
+    async with AsyncChatClient(default_limit=concurrency, governors={DEFAULT_CLIENT_ARGS["base_url"]: governor}, cache=cache) as client:
+        async def run(task_args):
+            return await arun_conversation(conversation(task_args), lambda chat_args, watch=None: async_chat(client, chat_args, watch))
+        await run_async(run, retry_queue, handle, concurrency)
+
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--input_path", "-input_path", type=str, default="./generate/dataset/question_and_name/all-cpp-example.jsonl")
     parser.add_argument("--output_path", "-output_path", type=str, default="./generate/dataset/debug/")
     parser.add_argument("--workers", "-workers", type=int, default=1)
+    parser.add_argument("--rpm", "-rpm", type=int, default=None, help="Requests per minute allowed by the endpoint. Unlimited if not set.")
+    parser.add_argument("--tpm", "-tpm", type=int, default=None, help="Tokens per minute allowed by the endpoint. Unlimited if not set.")
+    parser.add_argument("--min_concurrency", "-min_concurrency", type=int, default=1, help="Floor of the adaptive concurrency limit with --concurrency.")
+    parser.add_argument("--target_latency", "-target_latency", type=float, default=None, help="Seconds per request above which concurrency is reduced as if the endpoint pushed back (--concurrency only).")
+    parser.add_argument("--cache_path", "-cache_path", type=str, default=None, help="SQLite file of cached replies keyed by model, messages and parameters; identical requests of later runs are answered from it. Disabled if not set.")
+    parser.add_argument("--cache_max_mb", "-cache_max_mb", type=int, default=DEFAULT_CACHE_MAX_MB, help="Size above which the least recently used cached replies are evicted.")
+    parser.add_argument("--cache_sampled", "-cache_sampled", action="store_true", help="Also cache requests with temperature > 0.")
+    parser.add_argument("--max_attempts", "-max_attempts", type=int, default=DEFAULT_MAX_ATTEMPTS, help="Attempts per task before it is written to <input_name>_dead.jsonl.")
+    parser.add_argument("--retry_base_delay", "-retry_base_delay", type=float, default=DEFAULT_RETRY_BASE_DELAY, help="Backoff of the first retry in seconds; doubled per attempt, with full jitter.")
+    parser.add_argument("--retry_max_delay", "-retry_max_delay", type=float, default=DEFAULT_RETRY_MAX_DELAY, help="Cap of the retry backoff in seconds.")
+    parser.add_argument("--concurrency", "-concurrency", type=int, default=0, help="Run all conversations in this process on one asyncio event loop with up to N requests in flight, instead of --workers processes.")
+    parser.add_argument("--stream", "-stream", action="store_true", help="Stream the unit test and answer replies: their files are collected as they arrive, and a reply is stopped as soon as it breaks the file format (see FileBlockStream in pipelines/utils/tools.py).")
     parser.add_argument("--model", "-model", type=str, default="deepseek-v3-inner")
     parser.add_argument("--batch_size", "-batch_size", type=int, default=1)
     args = parser.parse_args()
@@ -213,34 +261,75 @@ def main():
         task_queue.append(
             {
                 "obj": objs[i],
-                "model": main_args.model
+                "model": main_args.model,
+                "stream": main_args.stream,
             }
         )
 
     random.shuffle(task_queue)
-    task_bar = tqdm.tqdm(total=len(task_queue), desc=f"Job Running {main_args.workers} workers")
+    task_bar = tqdm.tqdm(total=len(task_queue), desc=f"Job Running {main_args.concurrency} concurrent requests" if main_args.concurrency > 0 else f"Job Running {main_args.workers} workers")
     output_objs, error_objs = [], []
     output_objs_path, error_objs_path = os.path.join(main_args.output_path, os.path.basename(main_args.input_path)), os.path.join(main_args.output_path, os.path.basename(main_args.input_path).replace(".jsonl", "_error.jsonl"))
 
-    with ProcessPoolExecutor(max_workers=main_args.workers) as executor:
-        futures = [executor.submit(task_worker, task_args) for task_args in task_queue]
-        for i, future in enumerate(as_completed(futures), 1):
-            task_bar.update(1)
-            e = future.exception()
-            if e:
-                error_objs.append(str(e))
-                task_queue.append(task_queue[i])
-            else:
-                obj = future.result()
-                output_objs.append(obj)
-            if i % main_args.batch_size == 0 or i == len(futures):
-                if output_objs:
-                    write_jsonl_file(output_objs, output_objs_path, format="a")
-                    output_objs.clear()
-                if error_objs:
-                    write_jsonl_file(error_objs, error_objs_path, format="a")
-                    error_objs.clear()
+    cache_args = None
+    if main_args.cache_path:
+        cache_args = {"path": main_args.cache_path, "max_mb": main_args.cache_max_mb, "cache_sampled": main_args.cache_sampled}
+        # the connection must not outlive a fork into the pool workers
+        cache = ResponseCache(**cache_args)
+        cache_stats = cache.stats()
+        cache.close()
+    retry_queue = RetryQueue(main_args.max_attempts, main_args.retry_base_delay, main_args.retry_max_delay, dead_letter_path=os.path.join(main_args.output_path, os.path.basename(main_args.input_path).replace(".jsonl", "_dead.jsonl")))
+    retry_queue.extend(task_queue)
+    governor = None
+    if main_args.concurrency > 0:
+        governor = RateGovernor(main_args.rpm, main_args.tpm, main_args.concurrency, main_args.min_concurrency, main_args.target_latency)
+
+    def handle(i, total, obj, e):
+        task_bar.update(1)
+        if governor is not None and i % 20 == 0:
+            throughput = governor.throughput()
+            task_bar.set_postfix(rpm=f"{throughput['requests_per_minute']:.0f}", tpm=f"{throughput['tokens_per_minute']:.0f}", limit=throughput["concurrency_limit"])
+        if e:
+            error_objs.append(str(e))
+        else:
+            output_objs.append(obj)
+        if i % main_args.batch_size == 0 or i == total:
+            if output_objs:
+                write_jsonl_file(output_objs, output_objs_path, format="a")
+                output_objs.clear()
+            if error_objs:
+                write_jsonl_file(error_objs, error_objs_path, format="a")
+                error_objs.clear()
+
+    if main_args.concurrency > 0:
+        cache = ResponseCache(**cache_args) if cache_args is not None else None
+        asyncio.run(run_tasks_async(retry_queue, main_args.concurrency, handle, governor, cache))
+        if cache is not None:
+            cache.close()
+        save_json(governor.throughput(), os.path.join(main_args.output_path, os.path.basename(main_args.input_path).replace(".jsonl", "_throughput.json")))
+    else:
+        governor_args = {
+            "rpm": main_args.rpm / main_args.workers if main_args.rpm else None,
+            "tpm": main_args.tpm / main_args.workers if main_args.tpm else None,
+            "max_concurrency": 1,
+            "target_latency": main_args.target_latency,
+        }
+        with ProcessPoolExecutor(max_workers=main_args.workers, initializer=init_worker, initargs=(governor_args, cache_args)) as executor:
+            # failed tasks are resubmitted to this executor after their backoff
+            run_pool(executor, task_worker, retry_queue, handle, 2 * main_args.workers)
     task_bar.close()
+    retry_stats = retry_queue.stats()
+    print(f"{retry_stats['succeeded']} of {retry_stats['tasks']} tasks succeeded in {retry_stats['attempts']} attempts, {retry_stats['dead']} dead-lettered, {retry_stats['succeeded_per_hour']:.0f} successful samples/hour")
+    save_json(retry_stats, os.path.join(main_args.output_path, os.path.basename(main_args.input_path).replace(".jsonl", "_retry_stats.json")))
+    if cache_args is not None:
+        # counters are kept in the cache file, so this run's share is the difference
+        cache = ResponseCache(**cache_args)
+        end_stats = cache.stats()
+        cache.close()
+        run_stats = {name: end_stats[name] - cache_stats[name] for name in ["hits", "misses", "skipped", "stores", "evictions"]}
+        run_stats.update(entries=end_stats["entries"], megabytes=end_stats["megabytes"])
+        print(f"Cache {main_args.cache_path}: {run_stats['hits']} hits, {run_stats['misses']} misses, {run_stats['skipped']} skipped (sampled), {run_stats['entries']} entries, {run_stats['megabytes']:.1f} MB")
+        save_json(run_stats, os.path.join(main_args.output_path, os.path.basename(main_args.input_path).replace(".jsonl", "_cache_stats.json")))
 
     len_output_objs = 0
     try:
@@ -1,4 +1,5 @@
 from concurrent.futures import ProcessPoolExecutor, as_completed
+import asyncio
 import json
 import os
 from pathlib import Path
@@ -8,7 +9,6 @@ import jsonlines
 import datetime
 import argparse
 import tqdm
-from openai import OpenAI
 
 def ensure_directory_exists(path, type="file"):
     """
@@ -61,48 +61,65 @@ def save_json(data, filename, indent = 4, format="w") -> None:
     # print(f"Successfully saving to {filename}")
 
 
-root_dir = Path(__file__).parent.parent
+root_dir = Path(__file__).parent.parent.parent
 root_dir_str = str(root_dir)
 if root_dir_str not in sys.path:
     sys.path.append(root_dir_str)
 
+from pipelines.utils.llm_client import DEFAULT_CLIENT_ARGS, AsyncChatClient, arun_conversation, chat_completion, run_conversation
+from pipelines.utils.rate_governor import RateGovernor
+from pipelines.utils.llm_cache import DEFAULT_CACHE_MAX_MB, ResponseCache
+from pipelines.utils.near_dup import DEFAULT_THRESHOLD, NearDupIndex
+from pipelines.utils.retry_queue import DEFAULT_MAX_ATTEMPTS, DEFAULT_RETRY_BASE_DELAY, DEFAULT_RETRY_MAX_DELAY, RetryQueue, run_async, run_pool
+
+WORKER_GOVERNOR = None
+WORKER_CACHE = None
+WORKER_SEEDS = None
+WORKER_NEAR_DUP = None
 
-def _chat(client_args, chat_args):
-    client = OpenAI(
-        **client_args
-    )
-    response = client.chat.completions.create(
-        **chat_args
-    )
-    content = ""
-    reasoning_content = ""
-    if "stream" in chat_args and chat_args["stream"]:
-        for chunk in response:
-            if hasattr(chunk, "choices") and len(chunk.choices) > 0 and hasattr(chunk.choices[0], "delta"):
-                delta = chunk.choices[0].delta
-                if hasattr(delta, "content"):
-                    content += delta.content
-                if hasattr(delta, "reasoning_content"):
-                    reasoning_content += delta.reasoning_content
-    else:
-        if hasattr(response, "choices") and len(response.choices) > 0 and hasattr(response.choices[0], "message"):
-            message = response.choices[0].message
-            if hasattr(message, "content"):
-                content = message.content
-            if hasattr(message, "reasoning_content"):
-                reasoning_content = message.reasoning_content
-    if reasoning_content and reasoning_content.strip() != "":
-        return_str = "<think>\n" + reasoning_content + "\n</think>\n" + content 
-    else:
-        return_str = content
-    return return_str
+
+def load_seeds(input_path):
+    """
+    The seed exercises of input_path, with an index of them by language for sampling the
+    format example.
+    """
+    objs = read_jsonl_file(input_path)
+    by_language = {}
+    for obj in objs:
+        by_language.setdefault(obj["repo"], []).append(obj)
+    # "examples" memoises the rendered prompt section of each seed, see sample_data_2_sample_data_str
+    return {"objs": objs, "by_language": by_language, "examples": {}}
+
+def init_worker(governor_args, cache_args=None, input_path=None, near_dup_args=None):
+    # each pool worker paces its own share of the endpoint's limits; the cache file and the
+    # near-duplicate index are shared; the seeds are read once per worker rather than shipped with every task
+    global WORKER_GOVERNOR, WORKER_CACHE, WORKER_SEEDS, WORKER_NEAR_DUP
+    WORKER_GOVERNOR = RateGovernor(**governor_args)
+    if input_path is not None:
+        WORKER_SEEDS = load_seeds(input_path)
+    if cache_args is not None:
+        WORKER_CACHE = ResponseCache(**cache_args)
+    if near_dup_args is not None:
+        WORKER_NEAR_DUP = NearDupIndex(**near_dup_args)
+
+def _chat(client_args, chat_args, governor=None, cache=None):
+    # the client (and its keep-alive connections) is shared by every call in this process
+    return chat_completion(client_args, chat_args, governor, cache)
 
 def chat(
-        client_args = {"base_url": os.environ.get("OPENAI_API_BASE", "https://api.openai.com/v1/"), "api_key": os.environ.get("OPENAI_API_KEY"), "timeout": 600, "max_retries": 10}, 
-        chat_args = {"model": "EMPTY", "messages": [{"role": "user", "content": "Hello, how are you?"}]}
+        client_args = DEFAULT_CLIENT_ARGS, 
+        chat_args = {"model": "EMPTY", "messages": [{"role": "user", "content": "Hello, how are you?"}]},
+        governor = None,
+        cache = None,
     ):
     try:
-        return _chat(client_args, chat_args)
+        return _chat(client_args, chat_args, governor, cache)
+    except Exception as e:
+        return "Retry" + " " + str(e)
+
+async def async_chat(client, chat_args):
+    try:
+        return await client.chat(chat_args)
     except Exception as e:
         return "Retry" + " " + str(e)
 
@@ -151,43 +168,32 @@ def split_sample_data_by_flag(one, flag):
                     answer += f"{fname}\n```{md_prefix}\n{fcontent}\n```\n"
     return answer
 
-def sample_data_2_sample_data_str(sample_data):
+def sample_data_2_sample_data_str(sample_data, examples=None, header="Here are some question examples to give you inspiration:\n"):
+    """
+    The prompt section showing sample_data. `examples` (seed id -> rendered fields) memoises
+    the per-seed rendering across tasks.
+    """
     if len(sample_data) == 0:
         return ""
     sample_data_str_template = "## Question Example {index_placeholder}:\n\n### Project Name\n\n{project_name_placeholder}\n\n### Question Description\n\n{question_description_placeholder}\n\n### Answer File With Dependencies\n\n{answer_placeholder}\n\n### Unit Test File\n\n{unit_test_placeholder}"
-    sample_data_str = "Here are some question examples to give you inspiration:\n"
+    sample_data_str = header
     for i, one in enumerate(sample_data):
-        project_name = split_sample_data_by_flag(one, "project_name")
-        question_description = split_sample_data_by_flag(one, "instruction")
-        answer = split_sample_data_by_flag(one, "solution")
-        unit_test = split_sample_data_by_flag(one, "test")
-        sample_data_str += sample_data_str_template.format(index_placeholder=i+1, project_name_placeholder=project_name, question_description_placeholder=question_description, answer_placeholder=answer, unit_test_placeholder=unit_test)
+        fields = examples.get(one["id"]) if examples is not None else None
+        if fields is None:
+            fields = {
+                "project_name_placeholder": split_sample_data_by_flag(one, "project_name"),
+                "question_description_placeholder": split_sample_data_by_flag(one, "instruction"),
+                "answer_placeholder": split_sample_data_by_flag(one, "solution"),
+                "unit_test_placeholder": split_sample_data_by_flag(one, "test"),
+            }
+            if examples is not None:
+                examples[one["id"]] = fields
+        sample_data_str += sample_data_str_template.format(index_placeholder=i+1, **fields)
     return sample_data_str
 
-def task_worker(task_args):
-    objs = task_args.get("objs", [])
-    language = task_args.get("language", "")
-    sample_seed_data = random.sample(objs, random.randint(1, 3))
-    sample_format_data = random.sample([obj for obj in objs if obj["repo"] == language], 1)
-    model = "gemini-2.0-flash"
-    result = {
-        "source_ids": {
-            "seed": [one["id"] for one in sample_seed_data],
-            "format": [one["id"] for one in sample_format_data]
-        },
-        "source_messages": {
-            "question": [],
-            "project_name": []
-        },
-        "source_models": {
-            "question": model,
-            "project_name": model
-        },
-        "language": language
-    }
+SYSTEM_PROMPT = "Act as a high-level programming competition question setter and take requests for generating a new code problem.\n\n1. Make sure your code problem concise but complete.\n2. Make sure your code problem difficult and challenging."
 
-    system_prompt = "Act as a high-level programming competition question setter and take requests for generating a new code problem.\n\n1. Make sure your code problem concise but complete.\n2. Make sure your code problem difficult and challenging."
-    question_instruction_prompt_template = """Please generate a challenging and sophisticated {language} coding problem. Consider incorporating these elements to increase complexity from question example inspiration:
+QUESTION_INSTRUCTION_PROMPT_TEMPLATE = """Please generate a challenging and sophisticated {language} coding problem. Consider incorporating these elements to increase complexity from question example inspiration:
 
 - Advanced data structures (trees, graphs, heaps)
 - Multiple edge cases and constraints
@@ -201,11 +207,20 @@ Make sure the difficulty is as high as possible, similar to the leetcode Hard le
 
 Please **only** describe the question clearly but challenge the solver with interesting constraints and requirements. Do not include any project name, code signature, answer, unit test or any other things at this stage.
 
-{sample_data_str}
+{examples_block}Now, begin!"""
+
+def question_instruction(language, sample_data_str=""):
+    """
+    The question instruction, with the examples block only if there are examples.
+    """
+    examples_block = f"{sample_data_str}\n\n" if sample_data_str else ""
+    return QUESTION_INSTRUCTION_PROMPT_TEMPLATE.format(examples_block=examples_block, language=language)
+
+FORMAT_EXAMPLE_HEADER = "Here is an example of a {language} project, whose naming and file layout the answer and unit test should follow:\n"
 
-Now, begin!"""
+PROJECT_NAME_INSTRUCTION_PROMPT_TEMPLATE = """{sample_data_str}
 
-    project_name_instruction_prompt_template = """Now, present the name of this {language} problem with snake case and keep it short and concise by using 1-3 words, like "hello_world". Please generate the name in the following format:
+Now, present the name of this {language} problem with snake case and keep it short and concise by using 1-3 words, like "hello_world". Please generate the name in the following format:
 
 ```
 project_name
@@ -213,34 +228,110 @@ project_name
 
 Please **only** generate the name in the above format. Do not include any question description, code signature, answer, unit test or any other things at this stage. Now, begin!"""
 
+def task_worker(task_args):
+    return run_conversation(conversation(task_args, WORKER_SEEDS, WORKER_NEAR_DUP), lambda chat_args: chat(chat_args=chat_args, governor=WORKER_GOVERNOR, cache=WORKER_CACHE))
+
+def conversation(task_args, seeds, near_dup=None):
+    """
+    The requests of one task as a generator: yields the chat_args of each request and is sent
+    its reply, see pipelines/utils/llm_client.py. Returns the result record.
+    Examples are sampled from `seeds` (see load_seeds) with the task's own random seed, salted
+    with task_args["attempt"] (set by the retry queue) from the second attempt on, which then
+    also passes the attempt as the sampling seed of the question request, so a retry asks
+    for (and is cached as) a different question.
+    With a NearDupIndex, a question close to an indexed one of the same language fails the
+    task before the project name turn; the question is only added to the index once the
+    task has succeeded, so a failed attempt leaves nothing behind for its retry to collide with.
+    source_messages["project_name"], which the answer and unit test stages continue, keeps the
+    question and name turns without the seed examples.
+    """
+    language = task_args.get("language", "")
+    attempt = task_args.get("attempt", 1)
+    rng = random.Random(task_args.get("seed") if attempt <= 1 else f"{task_args.get('seed')}/{attempt}")
+    sample_seed_data = rng.sample(seeds["objs"], rng.randint(1, 3))
+    sample_format_data = rng.sample(seeds["by_language"].get(language, []), 1)
+    model = "gemini-2.0-flash"
+    result = {
+        "source_ids": {
+            "seed": [one["id"] for one in sample_seed_data],
+            "format": [one["id"] for one in sample_format_data]
+        },
+        "source_messages": {
+            "question": [],
+            "project_name": []
+        },
+        "source_models": {
+            "question": model,
+            "project_name": model
+        },
+        "language": language
+    }
+
+    # the project name turn extends the question conversation unchanged, so a server with
+    # prefix caching reuses the question's KV cache; the format example comes with the new turn
     question_chat_messages = [
-        {"role": "user", "content": system_prompt},
-        {"role": "user", "content": question_instruction_prompt_template.format(sample_data_str=sample_data_2_sample_data_str(sample_seed_data), language=language)},
+        {"role": "user", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": question_instruction(language, sample_data_2_sample_data_str(sample_seed_data, seeds.get("examples")))},
     ]
-    question_response = chat(chat_args={"messages": question_chat_messages, "model": model, "temperature": 0.8})
+    question_args = {"messages": question_chat_messages, "model": model, "temperature": 0.8}
+    if attempt > 1:
+        question_args["seed"] = attempt
+    question_response = yield question_args
     if question_response.startswith("Retry"):
         raise Exception("Question generation failed")
+    if near_dup is not None:
+        match = near_dup.query(question_response, language)
+        if match is not None:
+            raise Exception(f"Near-duplicate question: similarity {match['similarity']:.2f} to {match['name']}")
     question_chat_messages.append({"role": "assistant", "content": question_response})
     result["source_messages"]["question"] = question_chat_messages
-    
-    project_name_chat_messages = [
-        {"role": "user", "content": system_prompt},
-        {"role": "user", "content": question_instruction_prompt_template.format(sample_data_str=sample_data_2_sample_data_str(sample_format_data), language=language)},
-        {"role": "assistant", "content": question_response},
-        {"role": "user", "content": project_name_instruction_prompt_template.format(language=language)},
+
+    project_name_chat_messages = question_chat_messages + [
+        {"role": "user", "content": PROJECT_NAME_INSTRUCTION_PROMPT_TEMPLATE.format(sample_data_str=sample_data_2_sample_data_str(sample_format_data, seeds.get("examples"), FORMAT_EXAMPLE_HEADER.format(language=language)), language=language)},
     ]
-    project_name_response = chat(chat_args={"messages": project_name_chat_messages, "model": model, "temperature": 0.8})
+    project_name_response = yield {"messages": project_name_chat_messages, "model": model, "temperature": 0.8}
     if project_name_response.startswith("Retry"):
         raise Exception("Project name generation failed")
     project_name_chat_messages.append({"role": "assistant", "content": project_name_response})
-    result["source_messages"]["project_name"] = project_name_chat_messages
+    # 下游（单元测试、答案）只接着问题和项目名两轮往下问：种子示例只服务于出题，不再随后续每一轮重复发送
+    result["source_messages"]["project_name"] = [question_chat_messages[0], {"role": "user", "content": question_instruction(language)}, *project_name_chat_messages[2:]]
+    if near_dup is not None:
+        # checked again in the write transaction: another worker may have added a close one meanwhile
+        match = near_dup.add_if_new(question_response, f"{language}/{task_args.get('seed')}", language)
+        if match is not None:
+            raise Exception(f"Near-duplicate question: similarity {match['similarity']:.2f} to {match['name']}")
     return result
 
+async def run_tasks_async(retry_queue, seeds, concurrency, handle, governor, cache=None, near_dup=None):
+    """
+    Run every task's conversation on one event loop, sharing one pooled client with at most
+    `concurrency` requests in flight; failed tasks go back into retry_queue, and
+    handle(i, total, obj, e) is called as tasks succeed or run out of attempts.
+    """
+    async with AsyncChatClient(default_limit=concurrency, governors={DEFAULT_CLIENT_ARGS["base_url"]: governor}, cache=cache) as client:
+        async def run(task_args):
+            return await arun_conversation(conversation(task_args, seeds, near_dup), lambda chat_args: async_chat(client, chat_args))
+        await run_async(run, retry_queue, handle, concurrency)
+
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--input_path", "-input_path", type=str, default="./pipelines/generate/dataset/all/xxxxx.jsonl")
     parser.add_argument("--output_path", "-output_path", type=str, default="./pipelines/generate/dataset/question_and_name/")
     parser.add_argument("--workers", "-workers", type=int, default=1)
+    parser.add_argument("--rpm", "-rpm", type=int, default=None, help="Requests per minute allowed by the endpoint. Unlimited if not set.")
+    parser.add_argument("--tpm", "-tpm", type=int, default=None, help="Tokens per minute allowed by the endpoint. Unlimited if not set.")
+    parser.add_argument("--min_concurrency", "-min_concurrency", type=int, default=1, help="Floor of the adaptive concurrency limit with --concurrency.")
+    parser.add_argument("--target_latency", "-target_latency", type=float, default=None, help="Seconds per request above which concurrency is reduced as if the endpoint pushed back (--concurrency only).")
+    parser.add_argument("--cache_path", "-cache_path", type=str, default=None, help="SQLite file of cached replies keyed by model, messages and parameters; identical requests of later runs are answered from it. Disabled if not set.")
+    parser.add_argument("--cache_max_mb", "-cache_max_mb", type=int, default=DEFAULT_CACHE_MAX_MB, help="Size above which the least recently used cached replies are evicted.")
+    parser.add_argument("--cache_sampled", "-cache_sampled", action="store_true", help="Also cache requests with temperature > 0.")
+    parser.add_argument("--near_dup_index", "-near_dup_index", type=str, default=None, help="MinHash/LSH index of generated questions (pipelines/utils/near_dup.py); a question too close to an indexed one of its language is rejected and its task retried. Disabled if not set.")
+    parser.add_argument("--near_dup_threshold", "-near_dup_threshold", type=float, default=DEFAULT_THRESHOLD, help="Estimated Jaccard similarity of the question shingles from which a question is a near-duplicate.")
+    parser.add_argument("--max_attempts", "-max_attempts", type=int, default=DEFAULT_MAX_ATTEMPTS, help="Attempts per task before it is written to <input_name>_dead.jsonl.")
+    parser.add_argument("--retry_base_delay", "-retry_base_delay", type=float, default=DEFAULT_RETRY_BASE_DELAY, help="Backoff of the first retry in seconds; doubled per attempt, with full jitter.")
+    parser.add_argument("--retry_max_delay", "-retry_max_delay", type=float, default=DEFAULT_RETRY_MAX_DELAY, help="Cap of the retry backoff in seconds.")
+    parser.add_argument("--concurrency", "-concurrency", type=int, default=0, help="Run all conversations in this process on one asyncio event loop with up to N requests in flight, instead of --workers processes.")
+    parser.add_argument("--seed", "-seed", type=int, default=None, help="Seed of the example sampling, for reproducible prompts.")
     parser.add_argument("--target_python", "-target_python", type=int, default=1)
     parser.add_argument("--target_rust", "-target_rust", type=int, default=1)
     parser.add_argument("--target_java", "-target_java", type=int, default=1)
@@ -256,9 +347,9 @@ def parse_args():
 
 def main():
     main_args = parse_args()
-    objs = read_jsonl_file(main_args.input_path)
 
     task_queue = []
+    rng = random.Random(main_args.seed)
     main_args.target = {
         "python": main_args.target_python,
         "rust": main_args.target_rust,
@@ -272,32 +363,78 @@ def main():
             task_queue.append(
                 {
                     "language": language,
-                    "objs": objs
+                    "seed": rng.getrandbits(64)
                 }
             )
 
-    random.shuffle(task_queue)
-    task_bar = tqdm.tqdm(total=len(task_queue), desc=f"Job Running {main_args.workers} workers")
+    rng.shuffle(task_queue)
+    task_bar = tqdm.tqdm(total=len(task_queue), desc=f"Job Running {main_args.concurrency} concurrent requests" if main_args.concurrency > 0 else f"Job Running {main_args.workers} workers")
     batch_size = 20  # 每100个结果写入一次
     output_objs, error_objs = [], []
-    with ProcessPoolExecutor(max_workers=main_args.workers) as executor:
-        futures = [executor.submit(task_worker, task_args) for task_args in task_queue]
-        for i, future in enumerate(as_completed(futures), 1):
-            task_bar.update(1)
-            e = future.exception()
-            if e:
-                error_objs.append(str(e))
-            else:
-                obj = future.result()
-                output_objs.append(obj)
-            if i % batch_size == 0 or i == len(futures):
-                if output_objs:
-                    write_jsonl_file(output_objs, os.path.join(main_args.output_path, os.path.basename(main_args.input_path)), format="a")
-                    output_objs.clear()
-                if error_objs:
-                    write_jsonl_file(error_objs, os.path.join(main_args.output_path, os.path.basename(main_args.input_path).replace(".jsonl", "_error.jsonl")), format="a")
-                    error_objs.clear()
+
+    cache_args = None
+    if main_args.cache_path:
+        cache_args = {"path": main_args.cache_path, "max_mb": main_args.cache_max_mb, "cache_sampled": main_args.cache_sampled}
+        # the connection must not outlive a fork into the pool workers
+        cache = ResponseCache(**cache_args)
+        cache_stats = cache.stats()
+        cache.close()
+    near_dup_args = {"path": main_args.near_dup_index, "threshold": main_args.near_dup_threshold} if main_args.near_dup_index else None
+    retry_queue = RetryQueue(main_args.max_attempts, main_args.retry_base_delay, main_args.retry_max_delay, dead_letter_path=os.path.join(main_args.output_path, os.path.basename(main_args.input_path).replace(".jsonl", "_dead.jsonl")))
+    retry_queue.extend(task_queue)
+    governor = None
+    if main_args.concurrency > 0:
+        governor = RateGovernor(main_args.rpm, main_args.tpm, main_args.concurrency, main_args.min_concurrency, main_args.target_latency)
+
+    def handle(i, total, obj, e):
+        task_bar.update(1)
+        if governor is not None and i % 20 == 0:
+            throughput = governor.throughput()
+            task_bar.set_postfix(rpm=f"{throughput['requests_per_minute']:.0f}", tpm=f"{throughput['tokens_per_minute']:.0f}", limit=throughput["concurrency_limit"])
+        if e:
+            error_objs.append(str(e))
+        else:
+            output_objs.append(obj)
+        if i % batch_size == 0 or i == total:
+            if output_objs:
+                write_jsonl_file(output_objs, os.path.join(main_args.output_path, os.path.basename(main_args.input_path)), format="a")
+                output_objs.clear()
+            if error_objs:
+                write_jsonl_file(error_objs, os.path.join(main_args.output_path, os.path.basename(main_args.input_path).replace(".jsonl", "_error.jsonl")), format="a")
+                error_objs.clear()
+
+    if main_args.concurrency > 0:
+        cache = ResponseCache(**cache_args) if cache_args is not None else None
+        near_dup = NearDupIndex(**near_dup_args) if near_dup_args is not None else None
+        asyncio.run(run_tasks_async(retry_queue, load_seeds(main_args.input_path), main_args.concurrency, handle, governor, cache, near_dup))
+        if cache is not None:
+            cache.close()
+        if near_dup is not None:
+            near_dup.close()
+        save_json(governor.throughput(), os.path.join(main_args.output_path, os.path.basename(main_args.input_path).replace(".jsonl", "_throughput.json")))
+    else:
+        governor_args = {
+            "rpm": main_args.rpm / main_args.workers if main_args.rpm else None,
+            "tpm": main_args.tpm / main_args.workers if main_args.tpm else None,
+            "max_concurrency": 1,
+            "target_latency": main_args.target_latency,
+        }
+        with ProcessPoolExecutor(max_workers=main_args.workers, initializer=init_worker, initargs=(governor_args, cache_args, main_args.input_path, near_dup_args)) as executor:
+            # failed tasks are resubmitted to this executor after their backoff
+            run_pool(executor, task_worker, retry_queue, handle, 2 * main_args.workers)
     task_bar.close()
+    retry_stats = retry_queue.stats()
+    print(f"{retry_stats['succeeded']} of {retry_stats['tasks']} tasks succeeded in {retry_stats['attempts']} attempts, {retry_stats['dead']} dead-lettered, {retry_stats['succeeded_per_hour']:.0f} successful samples/hour")
+    save_json(retry_stats, os.path.join(main_args.output_path, os.path.basename(main_args.input_path).replace(".jsonl", "_retry_stats.json")))
+    if cache_args is not None:
+        # counters are kept in the cache file, so this run's share is the difference
+        cache = ResponseCache(**cache_args)
+        end_stats = cache.stats()
+        cache.close()
+        run_stats = {name: end_stats[name] - cache_stats[name] for name in ["hits", "misses", "skipped", "stores", "evictions"]}
+        run_stats.update(entries=end_stats["entries"], megabytes=end_stats["megabytes"])
+        print(f"Cache {main_args.cache_path}: {run_stats['hits']} hits, {run_stats['misses']} misses, {run_stats['skipped']} skipped (sampled), {run_stats['entries']} entries, {run_stats['megabytes']:.1f} MB")
+        save_json(run_stats, os.path.join(main_args.output_path, os.path.basename(main_args.input_path).replace(".jsonl", "_cache_stats.json")))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,318 @@
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import asyncio
+import datetime
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import random
+import sys
+import time
+import tqdm
+
+root_dir = Path(__file__).parent.parent
+root_dir_str = str(root_dir)
+if root_dir_str not in sys.path:
+    sys.path.append(root_dir_str)
+
+from pipelines.generate import generate_answer_unit_test, generate_question_and_name
+from pipelines.check.run_unit_test_index import UNIT_TEST_TIMEOUT, init_worker, join_result, run_data_map
+from pipelines.check.executors import EXECUTOR_MODES
+from pipelines.check.limits import ResourceLimits
+from pipelines.check.workspace import KEEP_POLICIES, WORKSPACE_BACKENDS, templates_root_for
+from pipelines.check.sandbox_template import TEMPLATE_LINK_METHODS, build_templates
+from pipelines.check.parser import annotate
+from pipelines.check.transcripts import TRANSCRIPT_HEAD_CHARS, TRANSCRIPT_TAIL_CHARS
+from pipelines.utils.llm_client import DEFAULT_CLIENT_ARGS, AsyncChatClient, arun_conversation
+from pipelines.utils.llm_cache import DEFAULT_CACHE_MAX_MB, ResponseCache
+from pipelines.utils.near_dup import DEFAULT_THRESHOLD, NearDupIndex
+from pipelines.utils.contamination import DEFAULT_THRESHOLD as CONTAMINATION_THRESHOLD, ContaminationIndex
+from pipelines.utils.rate_governor import RateGovernor
+from pipelines.utils.retry_queue import DEFAULT_MAX_ATTEMPTS, DEFAULT_RETRY_BASE_DELAY, DEFAULT_RETRY_MAX_DELAY, RetryQueue, run_async
+
+# Stages 3 to 5 of the data pipeline as one run: every sample flows
+#     question -> project name -> unit test -> answer -> execution -> parse
+# as soon as the previous step is done, through bounded queues, so the API and the test
+# sandboxes are busy at the same time and a full queue pauses the stage feeding it.
+# The generation stages retry failed conversations through a RetryQueue each, as their
+# scripts do, and dead-letter them to <stage file>_dead.jsonl.
+# Each stage appends its records to the file its own script would write, so those files
+# can still be fed to generate_answer_unit_test.py, run_unit_test_index.py or parser.py.
+STAGE_FILES = {
+    "question": "question_and_name.jsonl",
+    "answer": "answer_unit_test.jsonl",
+    "run": "run_unit_test.jsonl",
+    "parsed": "parsed.jsonl",
+}
+LANGUAGES = ["python", "rust", "java", "go", "javascript", "cpp"]
+# end of a queue, one per consumer
+STOP = None
+
+
+def verification_fields(obj):
+    """
+    The part of a record run_data_map reads: its language, the last message of each turn
+    and the files collected while the replies streamed in.
+    """
+    fields = {"language": obj.get("language", ""), "source_messages": {name: messages[-1:] for name, messages in obj["source_messages"].items()}}
+    if "files" in obj:
+        fields["files"] = obj["files"]
+    return fields
+
+
+def verify_worker(fields, tmp_path):
+    """
+    run_unit_test_index.task_worker for a record that is already in memory: gets its
+    verification_fields and sends back only check_info, which the parent joins to the record.
+    """
+    return run_data_map(Path(tmp_path), fields)["check_info"]
+
+
+class StageWriter:
+    """
+    One line-buffered append-mode file per stage output (and one per stage for errors),
+    written as records arrive, plus counts of both.
+    """
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.files = {}
+        self.counts = {}
+
+    def write(self, name, obj):
+        f = self.files.get(name)
+        if f is None:
+            f = self.files[name] = open(os.path.join(self.output_path, name), "a", encoding="utf-8", buffering=1)
+        f.write(json.dumps(obj, ensure_ascii=False) + "\n")
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def output(self, stage, obj):
+        self.write(STAGE_FILES[stage], obj)
+
+    def error(self, stage, e):
+        self.write(STAGE_FILES[stage].replace(".jsonl", "_error.jsonl"), str(e))
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files.clear()
+
+
+async def run_stage(inbox, outbox, work, workers, next_workers, writer, stage, progress):
+    """
+    `workers` consumers of inbox, each awaiting work(item) and passing the result on to
+    outbox (if any); once every consumer saw STOP, outbox gets one STOP per next_workers.
+    """
+    async def consume():
+        while (item := await inbox.get()) is not STOP:
+            try:
+                result = await work(item)
+            except Exception as e:
+                writer.error(stage, e)
+                progress(stage, False)
+                continue
+            writer.output(stage, result)
+            progress(stage, True)
+            if outbox is not None:
+                await outbox.put(result)
+
+    await asyncio.gather(*(consume() for _ in range(workers)))
+    if outbox is not None:
+        for _ in range(next_workers):
+            await outbox.put(STOP)
+
+
+async def run_pipeline(main_args, task_queue, seeds, executor, writer, progress):
+    governor = RateGovernor(main_args.rpm, main_args.tpm, main_args.concurrency, main_args.min_concurrency, main_args.target_latency)
+    cache = ResponseCache(main_args.cache_path, main_args.cache_max_mb, main_args.cache_sampled) if main_args.cache_path else None
+    near_dup = NearDupIndex(main_args.near_dup_index, threshold=main_args.near_dup_threshold) if main_args.near_dup_index else None
+    contamination = ContaminationIndex(main_args.contamination_index) if main_args.contamination_index else None
+    loop = asyncio.get_running_loop()
+    retry_queues = {
+        stage: RetryQueue(main_args.max_attempts, main_args.retry_base_delay, main_args.retry_max_delay, dead_letter_path=os.path.join(main_args.output_path, STAGE_FILES[stage].replace(".jsonl", "_dead.jsonl")))
+        for stage in ["question", "answer"]
+    }
+    retry_queues["question"].extend(task_queue)
+    answers = asyncio.Queue(maxsize=main_args.queue_size)
+    checks = asyncio.Queue(maxsize=main_args.queue_size)
+
+    def handler(stage, outbox, next_task):
+        # a task that ran out of attempts ends its sample; a result waits for room in outbox,
+        # and a None result (a sample routed elsewhere by the worker) goes nowhere
+        async def handle(i, total, obj, e):
+            if e is not None:
+                writer.error(stage, e)
+                progress(stage, False)
+                return
+            if obj is None:
+                return
+            writer.output(stage, obj)
+            progress(stage, True)
+            await outbox.put(next_task(obj))
+        return handle
+
+    async with AsyncChatClient(default_limit=main_args.concurrency, governors={DEFAULT_CLIENT_ARGS["base_url"]: governor}, cache=cache) as client:
+        async def question(task_args):
+            return await arun_conversation(
+                generate_question_and_name.conversation(task_args, seeds, near_dup),
+                lambda chat_args: generate_question_and_name.async_chat(client, chat_args),
+            )
+
+        async def answer(task_args):
+            result = await arun_conversation(
+                generate_answer_unit_test.conversation(task_args),
+                lambda chat_args, watch=None: generate_answer_unit_test.async_chat(client, chat_args, watch),
+            )
+            if contamination is not None:
+                # a final verdict, not a failure: the attempt succeeds, so the sample is
+                # neither regenerated nor dead-lettered, and never reaches the test workers
+                score = contamination.score_record(result)
+                if score["overlap"] >= main_args.contamination_threshold:
+                    writer.write("contaminated.jsonl", dict(result, contamination=score))
+                    progress("contaminated", True)
+                    return None
+            return result
+
+        async def run(obj):
+            check_info = await loop.run_in_executor(executor, verify_worker, verification_fields(obj), main_args.tmp_path)
+            result = join_result(obj, check_info)
+            try:
+                writer.output("parsed", annotate(dict(result)))
+                progress("parsed", True)
+            except Exception as e:
+                writer.error("parsed", e)
+                progress("parsed", False)
+            return result
+
+        async def questions_stage():
+            await run_async(question, retry_queues["question"], handler("question", answers, lambda obj: {"obj": obj, "model": main_args.model, "stream": main_args.stream}), main_args.question_workers)
+            await answers.put(STOP)
+
+        async def answers_stage():
+            await run_async(answer, retry_queues["answer"], handler("answer", checks, lambda obj: obj), main_args.answer_workers, feed=answers)
+            for _ in range(main_args.workers):
+                await checks.put(STOP)
+
+        await asyncio.gather(
+            questions_stage(),
+            answers_stage(),
+            run_stage(checks, None, run, main_args.workers, 0, writer, "run", progress),
+        )
+    if cache is not None:
+        cache.close()
+    if near_dup is not None:
+        near_dup.close()
+    if contamination is not None:
+        contamination.close()
+    return {"throughput": governor.throughput(), "retries": {stage: queue.stats() for stage, queue in retry_queues.items()}}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate, run and parse samples in one pipelined run.")
+    parser.add_argument("--input_path", "-input_path", type=str, default="./pipelines/generate/dataset/all/xxxxx.jsonl", help="Seed exercises, as for generate_question_and_name.py.")
+    parser.add_argument("--output_path", "-output_path", type=str, default="./pipelines/dataset/pipeline/")
+    parser.add_argument("--tmp_path", "-tmp_path", type=str, default="./check/tmp_debug")
+    parser.add_argument("--seed", "-seed", type=int, default=None, help="Seed of the example sampling, for reproducible prompts.")
+    for language in LANGUAGES:
+        parser.add_argument(f"--target_{language}", f"-target_{language}", type=int, default=1)
+    parser.add_argument("--model", "-model", type=str, default="deepseek-v3-inner", help="Model of the unit test and answer turns.")
+    parser.add_argument("--stream", "-stream", action="store_true", help="Stream the unit test and answer replies and stop any that breaks the file format, as in generate_answer_unit_test.py.")
+    parser.add_argument("--concurrency", "-concurrency", type=int, default=64, help="Max chat requests in flight over both generation stages.")
+    parser.add_argument("--question_workers", "-question_workers", type=int, default=None, help="Question conversations run at once. Defaults to --concurrency.")
+    parser.add_argument("--answer_workers", "-answer_workers", type=int, default=None, help="Answer conversations run at once. Defaults to --concurrency.")
+    parser.add_argument("--queue_size", "-queue_size", type=int, default=None, help="Capacity of each queue between two stages. Defaults to 2 * --workers.")
+    parser.add_argument("--rpm", "-rpm", type=int, default=None, help="Requests per minute allowed by the endpoint. Unlimited if not set.")
+    parser.add_argument("--tpm", "-tpm", type=int, default=None, help="Tokens per minute allowed by the endpoint. Unlimited if not set.")
+    parser.add_argument("--min_concurrency", "-min_concurrency", type=int, default=1, help="Floor of the adaptive concurrency limit.")
+    parser.add_argument("--target_latency", "-target_latency", type=float, default=None, help="Seconds per request above which concurrency is reduced as if the endpoint pushed back (--concurrency only).")
+    parser.add_argument("--cache_path", "-cache_path", type=str, default=None, help="SQLite response cache, see generate_question_and_name.py. Disabled if not set.")
+    parser.add_argument("--cache_max_mb", "-cache_max_mb", type=int, default=DEFAULT_CACHE_MAX_MB)
+    parser.add_argument("--cache_sampled", "-cache_sampled", action="store_true")
+    parser.add_argument("--near_dup_index", "-near_dup_index", type=str, default=None, help="Reject questions close to an indexed one before their answers are generated, see generate_question_and_name.py. Disabled if not set.")
+    parser.add_argument("--near_dup_threshold", "-near_dup_threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--contamination_index", "-contamination_index", type=str, default=None, help="N-gram index of the seed and polyglot-benchmark files; overlapping samples go to contaminated.jsonl instead of the test workers, see run_unit_test_index.py. Each sample is scored once, after its answer succeeded, and is not regenerated when flagged. Disabled if not set.")
+    parser.add_argument("--contamination_threshold", "-contamination_threshold", type=float, default=CONTAMINATION_THRESHOLD)
+    parser.add_argument("--max_attempts", "-max_attempts", type=int, default=DEFAULT_MAX_ATTEMPTS, help="Attempts per question or answer conversation before it is dead-lettered.")
+    parser.add_argument("--retry_base_delay", "-retry_base_delay", type=float, default=DEFAULT_RETRY_BASE_DELAY)
+    parser.add_argument("--retry_max_delay", "-retry_max_delay", type=float, default=DEFAULT_RETRY_MAX_DELAY)
+    parser.add_argument("--workers", "-workers", type=int, default=1, help="Test processes, as for run_unit_test_index.py.")
+    parser.add_argument("--executor", "-executor", type=str, default="cold", choices=EXECUTOR_MODES)
+    parser.add_argument("--sandbox_cache", "-sandbox_cache", type=str, default=None)
+    parser.add_argument("--build_cache", "-build_cache", type=str, default=None)
+    parser.add_argument("--workspace_backend", "-workspace_backend", type=str, default="disk", choices=WORKSPACE_BACKENDS)
+    parser.add_argument("--keep_workspaces", "-keep_workspaces", type=str, default="always", choices=KEEP_POLICIES)
+    parser.add_argument("--tmpfs_path", "-tmpfs_path", type=str, default="/dev/shm")
+    parser.add_argument("--template_link", "-template_link", type=str, default="hardlink", choices=TEMPLATE_LINK_METHODS)
+    parser.add_argument("--timeout", "-timeout", type=int, default=UNIT_TEST_TIMEOUT)
+    parser.add_argument("--limit_cpu_seconds", "-limit_cpu_seconds", type=int, default=None, help="Resource limits of one test run, as for run_unit_test_index.py. Unlimited if not set.")
+    parser.add_argument("--limit_memory_mb", "-limit_memory_mb", type=int, default=None)
+    parser.add_argument("--limit_pids", "-limit_pids", type=int, default=None)
+    parser.add_argument("--cgroup_path", "-cgroup_path", type=str, default=None)
+    parser.add_argument("--no_test_reports", "-no_test_reports", action="store_true")
+    parser.add_argument("--transcript_store", "-transcript_store", type=str, default=None)
+    parser.add_argument("--transcript_head_chars", "-transcript_head_chars", type=int, default=TRANSCRIPT_HEAD_CHARS)
+    parser.add_argument("--transcript_tail_chars", "-transcript_tail_chars", type=int, default=TRANSCRIPT_TAIL_CHARS)
+    args = parser.parse_args()
+    args.question_workers = args.question_workers or args.concurrency
+    args.answer_workers = args.answer_workers or args.concurrency
+    args.queue_size = args.queue_size or 2 * args.workers
+    args.current_time = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
+    args.output_path = os.path.join(args.output_path, args.current_time)
+    os.makedirs(args.output_path, exist_ok=True)
+    os.makedirs(args.tmp_path, exist_ok=True)
+    if args.executor == "warm" and args.cgroup_path:
+        print("Warning: --cgroup_path kills what each test run leaves behind, so the warm executor runs java with the cold --no-daemon command")
+    return args
+
+
+def main():
+    main_args = parse_args()
+    seeds = generate_question_and_name.load_seeds(main_args.input_path)
+    rng = random.Random(main_args.seed)
+    task_queue = []
+    for language in LANGUAGES:
+        for _ in range(getattr(main_args, f"target_{language}")):
+            task_queue.append({"language": language, "seed": rng.getrandbits(64)})
+    rng.shuffle(task_queue)
+
+    writer = StageWriter(main_args.output_path)
+    stats = {"samples": len(task_queue), "first_parsed_seconds": None}
+    start = time.time()
+    task_bar = tqdm.tqdm(total=len(task_queue), desc="Pipeline")
+
+    def progress(stage, ok):
+        stats.setdefault(stage, {"ok": 0, "failed": 0})["ok" if ok else "failed"] += 1
+        if stage == "parsed" and ok and stats["first_parsed_seconds"] is None:
+            stats["first_parsed_seconds"] = time.time() - start
+        # a sample is finished once it failed somewhere or got parsed
+        if not ok or stage in ("parsed", "contaminated"):
+            task_bar.update(1)
+        task_bar.set_postfix({name: stats[name]["ok"] for name in ["question", "answer", "run", "parsed", "contaminated"] if name in stats})
+
+    templates_root = templates_root_for(main_args.workspace_backend, main_args.tmp_path, main_args.tmpfs_path)
+    build_templates(templates_root)
+    limits = None
+    if main_args.limit_cpu_seconds or main_args.limit_memory_mb or main_args.limit_pids or main_args.cgroup_path:
+        limits = ResourceLimits(main_args.limit_cpu_seconds, main_args.limit_memory_mb, main_args.limit_pids, main_args.cgroup_path)
+    initargs = (main_args.executor, main_args.tmp_path, main_args.sandbox_cache, main_args.workspace_backend, main_args.keep_workspaces, main_args.tmpfs_path, templates_root, main_args.template_link, limits, main_args.timeout, main_args.build_cache, not main_args.no_test_reports, main_args.transcript_store, main_args.transcript_head_chars, main_args.transcript_tail_chars)
+    # test workers are started from a clean server process, not forked from this one with
+    # its event loop, open connections and cache file
+    with ProcessPoolExecutor(max_workers=main_args.workers, mp_context=multiprocessing.get_context("forkserver"), initializer=init_worker, initargs=initargs) as executor:
+        try:
+            stats["generation"] = asyncio.run(run_pipeline(main_args, task_queue, seeds, executor, writer, progress))
+        finally:
+            writer.close()
+            task_bar.close()
+    stats["seconds"] = time.time() - start
+    stats["files"] = writer.counts
+    for name, count in sorted(writer.counts.items()):
+        print(f"{os.path.join(main_args.output_path, name)}: {count} objs")
+    if stats["first_parsed_seconds"] is not None:
+        print(f"First verified sample after {stats['first_parsed_seconds']:.1f}s, all {len(task_queue)} samples done after {stats['seconds']:.1f}s")
+    with open(os.path.join(main_args.output_path, "pipeline_stats.json"), "w", encoding="utf-8") as f:
+        json.dump(stats, f, ensure_ascii=False, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+root_dir = Path(__file__).parent.parent.parent
+root_dir_str = str(root_dir)
+if root_dir_str not in sys.path:
+    sys.path.append(root_dir_str)
+
+from pipelines.utils.tools import FENCE, legacy_parse_file_content, legacy_parse_stacked_content, parse_file_content, parse_stacked_content
+from pipelines.utils.utils import read_jsonl_file, save_json
+
+WORDS = ["value", "result", "index", "count", "node", "queue", "cache", "total", "left", "right", "item", "key", "state", "buffer", "limit"]
+EXTENSIONS = {"python": "py", "go": "go", "rust": "rs", "cpp": "cpp", "java": "java", "javascript": "js"}
+PROSE = [
+    "Here is the implementation.",
+    "The solution keeps a running total and updates it in O(1) per request.",
+    "Below are the files:",
+    "Notes",
+    "**Explanation:**",
+    "*   Each request is checked against the remaining capacity.",
+    "",
+]
+COMMANDS = ["pytest test_main.py", "go test ./...", "cargo test --release", "node main.test.js", "java -jar build/libs/app.jar"]
+
+
+def random_code_line(rng):
+    indent = "    " * rng.randint(0, 3)
+    words = rng.sample(WORDS, 3)
+    return rng.choice([
+        f"{indent}{words[0]} = {words[1]}.{words[2]}({rng.randint(0, 99)})",
+        f"{indent}if {words[0]} > {words[1]}: {words[2]} += 1",
+        f"{indent}// {words[0]} {words[1]} {words[2]}",
+        f"{indent}return {words[0]}",
+        "",
+    ])
+
+
+def random_content(rng, lines):
+    # never blank, the legacy regex drops empty files
+    return "\n".join([f"// {rng.choice(WORDS)}"] + [random_code_line(rng) for _ in range(lines - 1)])
+
+
+def random_response(rng, files=None, edges=False, lines=(1, 30)):
+    """
+    A well-formed response of prose, example fences and file blocks; returns (text, files)
+    with files the [(filename, content)] it really contains. edges=True also uses what the
+    legacy regex gets wrong: empty files, nested fences in a README and examples whose last
+    line has a dot right before their closing fence.
+    """
+    parts, truth = [], []
+    for i in range(files if files is not None else rng.randint(1, 6)):
+        if rng.random() < 0.5:
+            parts.extend(rng.sample(PROSE, rng.randint(1, 3)))
+        if rng.random() < 0.2:
+            command = rng.choice(COMMANDS) if edges else "run the tests"
+            # with \r\n endings a sentence before a fence would end in ".\r" and name a file
+            parts.extend(["Run:", f"```{rng.choice(['', 'bash'])}", command, "```"])
+        language = rng.choice(list(EXTENSIONS))
+        filename = f"{rng.choice(WORDS)}_{i}/{rng.choice(WORDS)}.{EXTENSIONS[language]}"
+        if edges and rng.random() < 0.1:
+            content = ""
+        elif edges and rng.random() < 0.2:
+            filename = f"{rng.choice(WORDS)}_{i}/README.md"
+            content = "\n".join(["# Usage", f"```{language}", random_content(rng, 3), "```", "More details."])
+        else:
+            content = random_content(rng, rng.randint(*lines))
+        fence = rng.choice(["```", f"```{language}", f"``` {language}"])
+        parts.extend([filename, fence] + ([content] if content else []) + ["```"])
+        truth.append((filename, content))
+    if rng.random() < 0.3:
+        parts.append(rng.choice(PROSE))
+    text = "\n".join(parts)
+    if rng.random() < 0.2:
+        text = text.replace("\n", "\r\n")
+        truth = [(filename, content.replace("\n", "\r\n") + ("\r" if content else "")) for filename, content in truth]
+    return text, truth
+
+
+def blocks_of(result):
+    return [(filename, content) for item in result for filename, content in item.items()]
+
+
+def fuzz(samples, seed):
+    """
+    Check the new parsers against the generated truth, parse_stacked_content against the
+    legacy regex on plain responses, and partial=True on responses cut inside their last file.
+    """
+    rng = random.Random(seed)
+    report = {"plain": 0, "edges": 0, "truncated": 0, "single_file": 0, "legacy_wrong_on_edges": 0, "failures": []}
+    for i in range(samples):
+        kind = rng.choice(["plain", "edges", "truncated", "single_file"])
+        report[kind] += 1
+        text, truth = random_response(rng, files=1 if kind == "single_file" else None, edges=kind == "edges")
+        if kind == "truncated" and truth[-1][1]:
+            filename, content = truth[-1]
+            cut = rng.randint(0, len(content))
+            text = text[:text.rindex(content) + cut]
+            truth, partial = truth[:-1], (filename, content[:cut])
+            if blocks_of(parse_stacked_content(text, partial=True)) != truth + [partial]:
+                report["failures"].append({"index": i, "kind": kind, "text": text})
+        # without other fences, as any line before one names a file here; the legacy regex
+        # only reads a single block behind a bare fence
+        if kind == "single_file" and text.count(FENCE) == 2:
+            files = parse_file_content(text)
+            if files != dict(truth) or (f"{truth[0][0]}\n{FENCE}\n" in text and legacy_parse_file_content(text) != files):
+                report["failures"].append({"index": i, "kind": kind, "text": text})
+        new = blocks_of(parse_stacked_content(text))
+        legacy = blocks_of(legacy_parse_stacked_content(text))
+        if new != truth or (kind != "edges" and legacy != new):
+            report["failures"].append({"index": i, "kind": kind, "text": text})
+        if kind == "edges" and legacy != truth:
+            report["legacy_wrong_on_edges"] += 1
+    return report
+
+
+def time_parser(parse, text, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        parse(text)
+    return (time.perf_counter() - start) / repeat
+
+
+def large_cases(rng, kilobytes):
+    """
+    (parser pair, response) of about `kilobytes` KB each: a well-formed response and the same
+    cut off before its last closing fence.
+    """
+    text, _ = random_response(rng, files=1, lines=(100, 100))
+    well_formed, _ = random_response(rng, files=max(1, kilobytes * 1024 // len(text)), lines=(100, 100))
+    stacked = (legacy_parse_stacked_content, parse_stacked_content)
+    return {
+        "well_formed": (stacked, well_formed),
+        "truncated": (stacked, well_formed[:well_formed.rindex(FENCE)]),
+    }
+
+
+def pathological_cases(kilobytes):
+    """
+    Inputs on which the legacy regexes backtrack quadratically: a runaway ellipsis line, where
+    every dot is retried as the dot of a filename, and prose without any fence, where
+    parse_file_content's lazy prefix rescans the rest of the text from every position.
+    """
+    return {
+        "ellipsis": ((legacy_parse_stacked_content, parse_stacked_content), "Thinking" + "." * (kilobytes * 1024) + "\ndone\n"),
+        "prose": ((legacy_parse_file_content, parse_file_content), "The solution keeps a running total.\n" * (kilobytes * 1024 // 36)),
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Check the single-pass file block parser of tools.py against the legacy regex parsers and time both.")
+    parser.add_argument("--input_path", "-input_path", nargs="*", type=str, default=[], help="Optional answer/unit test outputs whose replies are compared as well.")
+    parser.add_argument("--output_path", "-output_path", type=str, default="./utils/dataset/bench_file_blocks.json")
+    parser.add_argument("--samples", "-samples", type=int, default=5000, help="Generated responses to check.")
+    parser.add_argument("--sizes", "-sizes", nargs="+", type=int, default=[100, 200, 400], help="Sizes of the timed responses in KB.")
+    parser.add_argument("--pathological_sizes", "-pathological_sizes", nargs="+", type=int, default=[4, 8, 16], help="Sizes in KB of the inputs the legacy regexes take quadratic time on.")
+    parser.add_argument("--repeat", "-repeat", type=int, default=3)
+    parser.add_argument("--seed", "-seed", type=int, default=0)
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    main_args = parse_args()
+    report = {"fuzz": fuzz(main_args.samples, main_args.seed), "recorded": {}, "timing": {}}
+    fuzz_report = report["fuzz"]
+    print(f"fuzz: {main_args.samples} responses, {len(fuzz_report['failures'])} failures, legacy wrong on {fuzz_report['legacy_wrong_on_edges']}/{fuzz_report['edges']} edge cases")
+    for input_path in main_args.input_path:
+        replies, differing = 0, []
+        for i, obj in enumerate(read_jsonl_file(input_path)):
+            for name in ["unit_test", "answer"]:
+                messages = obj.get("source_messages", {}).get(name)
+                if not messages:
+                    continue
+                replies += 1
+                reply = messages[-1]["content"]
+                if parse_stacked_content(reply) != legacy_parse_stacked_content(reply):
+                    differing.append({"index": i, "reply": name})
+        report["recorded"][input_path] = {"replies": replies, "differing": differing}
+        print(f"{input_path}: {replies} replies, {len(differing)} parsed differently by the legacy regex")
+    rng = random.Random(main_args.seed)
+    cases = [(f"{case}_{kilobytes}kb", parsers, text) for kilobytes in main_args.sizes for case, (parsers, text) in large_cases(rng, kilobytes).items()]
+    cases += [(f"{case}_{kilobytes}kb", parsers, text) for kilobytes in main_args.pathological_sizes for case, (parsers, text) in pathological_cases(kilobytes).items()]
+    for name, (legacy_parse, new_parse), text in cases:
+        legacy_seconds = time_parser(legacy_parse, text, main_args.repeat)
+        new_seconds = time_parser(new_parse, text, main_args.repeat)
+        report["timing"][name] = {"bytes": len(text), "legacy_seconds": legacy_seconds, "new_seconds": new_seconds, "speedup": legacy_seconds / max(new_seconds, 1e-9)}
+        print(f"{name:<18} {len(text) / 1024:>7.0f} KB  legacy {legacy_seconds * 1000:>9.2f} ms  new {new_seconds * 1000:>7.2f} ms  speedup {legacy_seconds / max(new_seconds, 1e-9):>8.1f}x")
+    save_json(report, main_args.output_path)
+    if fuzz_report["failures"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+from array import array
+import argparse
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import time
+
+# magic, n-gram size, number of hashes, byte offset of the sources JSON
+HEADER = struct.Struct("<8sIQQ")
+MAGIC = b"NGRAMIX1"
+DEFAULT_NGRAM = 10
+DEFAULT_THRESHOLD = 0.5
+# vendored files such as catch.hpp are not exercise content
+DEFAULT_MAX_FILE_CHARS = 200_000
+DEFAULT_BENCHMARK_PATH = "./evaluation/LiveRepoReflection/tmp.benchmarks/polyglot-benchmark"
+TOKEN = re.compile(r"\w+|[^\w\s]")
+
+
+def ngram_hashes(text, n=DEFAULT_NGRAM):
+    """
+    Hashes of the distinct n-token windows of text; tokens are words and single punctuation
+    characters, so formatting and whitespace do not matter. Empty for texts shorter than n.
+    """
+    tokens = TOKEN.findall(text.lower())
+    windows = (" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+    return {int.from_bytes(hashlib.blake2b(window.encode("utf-8"), digest_size=8).digest(), "little") for window in windows}
+
+
+def record_texts(obj):
+    """
+    Generated texts of a pipeline record: the last reply of each conversation (question,
+    project name, unit test, answer) that it has, by conversation name.
+    """
+    texts = {}
+    for name, messages in obj.get("source_messages", {}).items():
+        if messages and messages[-1].get("role") == "assistant":
+            texts[name] = messages[-1]["content"]
+    return texts
+
+
+def read_text(path, max_chars):
+    with open(path, "rb") as f:
+        data = f.read(max_chars + 1)
+    if len(data) > max_chars or b"\0" in data:
+        return None
+    for encoding in ["utf-8", "latin-1"]:
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return None
+
+
+def iter_seed_sources(seed_paths, max_chars=DEFAULT_MAX_FILE_CHARS):
+    """
+    (source, text) for every file of every seed record of extract_and_preprocess.py.
+    """
+    for seed_path in seed_paths:
+        with open(seed_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                obj = json.loads(line)
+                source = {"name": f"{obj.get('repo', '')}/{obj.get('folder', '')}", "benchmark": bool(obj.get("is_ployglot_benchmark", False))}
+                for content in obj.get("contents", {}).values():
+                    if isinstance(content, str) and len(content) <= max_chars:
+                        yield source, content
+
+
+def iter_benchmark_sources(benchmark_path, max_chars=DEFAULT_MAX_FILE_CHARS):
+    """
+    (source, text) for every text file of each polyglot-benchmark exercise
+    (<benchmark_path>/<language>/exercises/practice/<exercise>/...).
+    """
+    for language in sorted(os.listdir(benchmark_path)):
+        practice = os.path.join(benchmark_path, language, "exercises", "practice")
+        if not os.path.isdir(practice):
+            continue
+        for exercise in sorted(os.listdir(practice)):
+            source = {"name": f"polyglot-benchmark/{language}/{exercise}", "benchmark": True}
+            for dirpath, dirnames, filenames in os.walk(os.path.join(practice, exercise)):
+                dirnames[:] = [d for d in dirnames if d not in {".git", "node_modules", "target", "build", ".gradle"}]
+                for filename in sorted(filenames):
+                    text = read_text(os.path.join(dirpath, filename), max_chars)
+                    if text:
+                        yield source, text
+
+
+def build_index(index_path, sources, n=DEFAULT_NGRAM):
+    """
+    Bulk-load an index file: the sorted distinct n-gram hashes of all sources as uint64,
+    the id of a source of each as uint32 in the same order (a benchmark source if any has
+    it), then the sources as JSON.
+    """
+    owner, names, ids = {}, [], {}
+    for source, text in sources:
+        key = (source["name"], source["benchmark"])
+        if key not in ids:
+            ids[key] = len(names)
+            names.append(source)
+        source_id = ids[key]
+        for h in ngram_hashes(text, n):
+            current = owner.get(h)
+            if current is None or (source["benchmark"] and not names[current]["benchmark"]):
+                owner[h] = source_id
+    hashes = array("Q", sorted(owner))
+    source_ids = array("I", (owner[h] for h in hashes))
+    sources_offset = HEADER.size + hashes.itemsize * len(hashes) + source_ids.itemsize * len(source_ids)
+    os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, n, len(hashes), sources_offset))
+        hashes.tofile(f)
+        source_ids.tofile(f)
+        f.write(json.dumps(names, ensure_ascii=False).encode("utf-8"))
+    os.replace(tmp_path, index_path)
+    return len(hashes), len(names)
+
+
+class ContaminationIndex:
+    """
+    A file written by build_index, memory-mapped and searched in place: the hash array is
+    bisected through a memoryview, so opening it is instant and its pages are shared by
+    every process that maps it.
+        index = ContaminationIndex("contamination.ngrams")
+        index.score(text)
+        # {"overlap": share of the text's n-grams found in any source,
+        #  "benchmark_overlap": share found in a polyglot-benchmark source,
+        #  "source": the source with most matches, or None}
+        index.score_record(obj)
+        # the same for the most overlapping reply of a record, plus "parts": overlap per reply
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.n, self.count, sources_offset = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a contamination index")
+        view = memoryview(self.mmap)
+        hashes_end = HEADER.size + 8 * self.count
+        self.hashes = view[HEADER.size:hashes_end].cast("Q")
+        self.source_ids = view[hashes_end:hashes_end + 4 * self.count].cast("I")
+        self.sources = json.loads(bytes(view[sources_offset:]).decode("utf-8"))
+
+    def __len__(self):
+        return self.count
+
+    def lookup(self, h):
+        """
+        Source id of an n-gram hash, or None.
+        """
+        i = bisect.bisect_left(self.hashes, h)
+        if i < self.count and self.hashes[i] == h:
+            return self.source_ids[i]
+        return None
+
+    def score(self, text):
+        hashes = ngram_hashes(text, self.n)
+        if not hashes:
+            return {"overlap": 0.0, "benchmark_overlap": 0.0, "source": None}
+        matches = {}
+        for h in hashes:
+            source_id = self.lookup(h)
+            if source_id is not None:
+                matches[source_id] = matches.get(source_id, 0) + 1
+        benchmark = sum(count for source_id, count in matches.items() if self.sources[source_id]["benchmark"])
+        best = max(matches, key=matches.get) if matches else None
+        return {
+            "overlap": sum(matches.values()) / len(hashes),
+            "benchmark_overlap": benchmark / len(hashes),
+            "source": self.sources[best]["name"] if best is not None else None,
+        }
+
+    def score_record(self, obj):
+        """
+        score() of each generated reply of obj (see record_texts); the record scores as its
+        most overlapping reply, so a copied answer is not diluted by an original question.
+        """
+        result = {"overlap": 0.0, "benchmark_overlap": 0.0, "source": None, "parts": {}}
+        for name, text in record_texts(obj).items():
+            score = self.score(text)
+            result["parts"][name] = score["overlap"]
+            if score["overlap"] > result["overlap"]:
+                result.update(overlap=score["overlap"], source=score["source"])
+            result["benchmark_overlap"] = max(result["benchmark_overlap"], score["benchmark_overlap"])
+        return result
+
+    def close(self):
+        # the views must go before the map they point into
+        self.hashes.release()
+        self.source_ids.release()
+        self.mmap.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build an n-gram index of the seed and polyglot-benchmark files, or score generated records against it.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build")
+    build.add_argument("--index_path", "-index_path", type=str, required=True)
+    build.add_argument("--seed_path", "-seed_path", nargs="*", type=str, default=[], help="Seed JSONL files of extract_and_preprocess.py.")
+    build.add_argument("--benchmark_path", "-benchmark_path", type=str, default=DEFAULT_BENCHMARK_PATH, help="Root of the polyglot-benchmark checkout; skipped if missing.")
+    build.add_argument("--ngram", "-ngram", type=int, default=DEFAULT_NGRAM, help="Tokens per n-gram.")
+    build.add_argument("--max_file_chars", "-max_file_chars", type=int, default=DEFAULT_MAX_FILE_CHARS, help="Larger files (vendored headers and the like) are not indexed.")
+    score = subparsers.add_parser("score")
+    score.add_argument("--index_path", "-index_path", type=str, required=True)
+    score.add_argument("--input_path", "-input_path", nargs="+", type=str, required=True, help="Outputs of any generation or check stage.")
+    score.add_argument("--output_path", "-output_path", type=str, required=True)
+    score.add_argument("--threshold", "-threshold", type=float, default=DEFAULT_THRESHOLD, help="Share of a record's n-grams found in the index from which it is flagged.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "build":
+        def sources():
+            yield from iter_seed_sources(args.seed_path, args.max_file_chars)
+            if os.path.isdir(args.benchmark_path):
+                yield from iter_benchmark_sources(args.benchmark_path, args.max_file_chars)
+            else:
+                print(f"Warning: {args.benchmark_path} not found, only the seeds are indexed")
+        start = time.time()
+        count, source_count = build_index(args.index_path, sources(), args.ngram)
+        print(f"Indexed {count} {args.ngram}-grams of {source_count} sources into {args.index_path} ({os.path.getsize(args.index_path) / 2 ** 20:.1f} MB) in {time.time() - start:.1f}s")
+        return
+    index = ContaminationIndex(args.index_path)
+    os.makedirs(args.output_path, exist_ok=True)
+    counts = {"clean": 0, "contaminated": 0}
+    with open(os.path.join(args.output_path, "clean.jsonl"), "w", encoding="utf-8") as clean_f, open(os.path.join(args.output_path, "contaminated.jsonl"), "w", encoding="utf-8") as flagged_f:
+        for input_path in args.input_path:
+            with open(input_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    obj = json.loads(line)
+                    obj["contamination"] = index.score_record(obj)
+                    if obj["contamination"]["overlap"] >= args.threshold:
+                        flagged_f.write(json.dumps(obj, ensure_ascii=False) + "\n")
+                        counts["contaminated"] += 1
+                    else:
+                        clean_f.write(json.dumps(obj, ensure_ascii=False) + "\n")
+                        counts["clean"] += 1
+    print(f"{counts['clean']} clean, {counts['contaminated']} contaminated (overlap >= {args.threshold})")
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import json
+import os
+import struct
+
+# header: size and mtime of the indexed file, then one uint64 byte offset per line
+HEADER = struct.Struct("<QQ")
+OFFSET = struct.Struct("<Q")
+CHUNK_SIZE = 1 << 20
+
+
+class JsonlIndex:
+    """
+    Byte offset of every line of a JSONL file, kept in a sidecar file and read with seeks, so
+    neither the index nor the skipped records are ever held in memory. The sidecar is rebuilt
+    when the size or mtime of the JSONL file changes.
+    """
+
+    def __init__(self, path, index_path=None):
+        self.path = path
+        self.index_path = index_path or path + ".idx"
+        stat = os.stat(path)
+        if not self._valid(stat):
+            self._build(stat)
+        self.count = (os.path.getsize(self.index_path) - HEADER.size) // OFFSET.size
+
+    def _valid(self, stat):
+        if not os.path.exists(self.index_path):
+            return False
+        with open(self.index_path, "rb") as f:
+            header = f.read(HEADER.size)
+        return len(header) == HEADER.size and HEADER.unpack(header) == (stat.st_size, stat.st_mtime_ns)
+
+    def _build(self, stat):
+        os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(self.path, "rb") as src, open(tmp_path, "wb") as dst:
+            dst.write(HEADER.pack(stat.st_size, stat.st_mtime_ns))
+            position, line_start = 0, True
+            while True:
+                chunk = src.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                offsets = []
+                if line_start:
+                    offsets.append(position)
+                newline = chunk.find(b"\n")
+                while newline != -1:
+                    offsets.append(position + newline + 1)
+                    newline = chunk.find(b"\n", newline + 1)
+                # an offset at the very end of the file is not a line
+                line_start = offsets and offsets[-1] == position + len(chunk)
+                if line_start:
+                    offsets.pop()
+                dst.write(b"".join(OFFSET.pack(offset) for offset in offsets))
+                position += len(chunk)
+        os.replace(tmp_path, self.index_path)
+
+    def __len__(self):
+        return self.count
+
+    def offset(self, i):
+        with open(self.index_path, "rb") as f:
+            f.seek(HEADER.size + i * OFFSET.size)
+            return OFFSET.unpack(f.read(OFFSET.size))[0]
+
+    def iter_range(self, start_index=0, end_index=None):
+        """
+        Yield (line number, byte offset, object) for lines [start_index, end_index), seeking
+        straight to start_index.
+        """
+        end_index = self.count if end_index is None else min(end_index, self.count)
+        if start_index >= end_index:
+            return
+        with open(self.path, "rb") as f:
+            offset = self.offset(start_index)
+            f.seek(offset)
+            for i in range(start_index, end_index):
+                line = f.readline()
+                yield i, offset, json.loads(line)
+                offset += len(line)
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_MAX_MB = 1024
+# chat_args that do not change the reply
+IGNORED_CHAT_ARGS = {"stream", "stream_options", "timeout", "extra_headers"}
+# how many puts a process makes between two checks of the cache size
+EVICT_CHECK_EVERY = 100
+# eviction frees down to this fraction of max_bytes
+EVICT_TO = 0.9
+# lookups a process makes between two writes of its counters and access times
+FLUSH_EVERY = 100
+COUNTERS = ["hits", "misses", "skipped", "stores", "evictions"]
+
+
+def cache_key(base_url, chat_args):
+    """
+    Hash of the endpoint and every chat argument that can change the reply, with dict keys
+    sorted so the same request always gets the same key.
+    """
+    request = {name: value for name, value in chat_args.items() if name not in IGNORED_CHAT_ARGS}
+    data = json.dumps({"base_url": str(base_url), "request": request}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Replies of chat requests in one SQLite file (WAL mode, so the worker processes of a run
+    and later runs can share it), keyed by cache_key. Least recently used replies are
+    evicted once the cache grows past max_mb.
+    Requests with temperature > 0 are sampled and skipped unless cache_sampled is set;
+    requests without a temperature count as deterministic, as the generation scripts treat them.
+    Hits, misses, skips, stores and evictions are counted in the file itself, so stats()
+    covers every process that used it. Lookups only read: their counts and access times are
+    kept in memory and written with the next put, every FLUSH_EVERY lookups, and by stats()
+    and close(), so LRU order may lag behind by that much.
+    The connection is shared between threads (AsyncChatClient calls in from asyncio.to_thread)
+    and serialised by a lock.
+    """
+
+    def __init__(self, path, max_mb=DEFAULT_CACHE_MAX_MB, cache_sampled=False):
+        self.path = path
+        self.max_bytes = max_mb * 2 ** 20
+        self.cache_sampled = cache_sampled
+        self.puts = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.pending = dict.fromkeys(COUNTERS, 0)
+        self.accessed = {}
+        self.lookups = 0
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        with self.connection:
+            self.connection.executemany("INSERT OR IGNORE INTO counters VALUES (?, 0)", [(name,) for name in COUNTERS])
+
+    def cacheable(self, chat_args):
+        return self.cache_sampled or not (chat_args.get("temperature") or 0) > 0
+
+    def _count(self, name, amount=1):
+        self.pending[name] += amount
+
+    def _flush(self):
+        # inside a write transaction, with the lock held
+        self.connection.executemany("UPDATE counters SET value = value + ? WHERE name = ?", [(amount, name) for name, amount in self.pending.items() if amount])
+        self.connection.executemany("UPDATE responses SET accessed = ? WHERE key = ?", [(accessed, key) for key, accessed in self.accessed.items()])
+        self.pending = dict.fromkeys(COUNTERS, 0)
+        self.accessed = {}
+
+    def _looked_up(self, name, key=None):
+        self._count(name)
+        if key is not None:
+            self.accessed[key] = time.time()
+        self.lookups += 1
+        if self.lookups % FLUSH_EVERY == 0:
+            with self.connection:
+                self._flush()
+
+    def get(self, base_url, chat_args):
+        """
+        The cached reply, or None on a miss or for an uncacheable request.
+        """
+        with self.lock:
+            if not self.cacheable(chat_args):
+                self._looked_up("skipped")
+                return None
+            key = cache_key(base_url, chat_args)
+            row = self.connection.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            self._looked_up("misses" if row is None else "hits", None if row is None else key)
+        return None if row is None else row[0]
+
+    def put(self, base_url, chat_args, value):
+        if not self.cacheable(chat_args):
+            return
+        now = time.time()
+        with self.lock:
+            with self.connection:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                    (cache_key(base_url, chat_args), value, len(value.encode("utf-8")), now, now),
+                )
+                self._count("stores")
+                self._flush()
+            self.puts += 1
+        if self.puts % EVICT_CHECK_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        with self.lock, self.connection:
+            total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+            evicted, target = 0, total - self.max_bytes * EVICT_TO
+            for key, size in self.connection.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+                if target <= 0:
+                    break
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                target -= size
+                evicted += 1
+            self._count("evictions", evicted)
+            self._flush()
+        return evicted
+
+    def stats(self):
+        with self.lock:
+            with self.connection:
+                self._flush()
+            stats = dict(self.connection.execute("SELECT name, value FROM counters").fetchall())
+            entries, size = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        lookups = stats["hits"] + stats["misses"]
+        stats.update(entries=entries, megabytes=size / 2 ** 20, hit_rate=stats["hits"] / lookups if lookups else 0.0)
+        return stats
+
+    def close(self):
+        with self.lock:
+            with self.connection:
+                self._flush()
+            self.connection.close()
@@ -0,0 +1,316 @@
+import asyncio
+import json
+import os
+import time
+
+from openai import APIConnectionError, APIStatusError, APITimeoutError, AsyncOpenAI, OpenAI
+
+DEFAULT_CLIENT_ARGS = {
+    "base_url": os.environ.get("OPENAI_API_BASE", "https://api.openai.com/v1/"),
+    "api_key": os.environ.get("OPENAI_API_KEY"),
+    "timeout": 600,
+    "max_retries": 10,
+}
+# in-flight requests per endpoint unless told otherwise
+DEFAULT_ENDPOINT_CONCURRENCY = 256
+
+# one client per (process, client_args): clients own a keep-alive connection pool, which
+# must not be shared across a fork
+_CLIENTS = {}
+
+
+def _client_key(client_args):
+    return os.getpid(), json.dumps(client_args, sort_keys=True, default=str)
+
+
+def get_client(client_args=None):
+    """
+    The process-wide OpenAI client for client_args, created on first use and reused by
+    every later request so connections stay open between calls.
+    """
+    client_args = client_args or DEFAULT_CLIENT_ARGS
+    key = _client_key(client_args)
+    client = _CLIENTS.get(key)
+    if client is None:
+        client = _CLIENTS[key] = OpenAI(**client_args)
+    return client
+
+
+def message_text(response):
+    """
+    (content, reasoning_content) of a non-streamed chat completion.
+    """
+    if hasattr(response, "choices") and len(response.choices) > 0 and hasattr(response.choices[0], "message"):
+        message = response.choices[0].message
+        return getattr(message, "content", None) or "", getattr(message, "reasoning_content", None) or ""
+    return "", ""
+
+
+def response_text(response):
+    """
+    Content of a non-streamed chat completion, with the reasoning (if any) prepended in
+    <think> tags.
+    """
+    return join_reasoning(*message_text(response))
+
+
+def chunk_text(chunk):
+    """
+    (content, reasoning_content) carried by one streamed chunk.
+    """
+    if hasattr(chunk, "choices") and len(chunk.choices) > 0 and hasattr(chunk.choices[0], "delta"):
+        delta = chunk.choices[0].delta
+        return getattr(delta, "content", None) or "", getattr(delta, "reasoning_content", None) or ""
+    return "", ""
+
+
+def join_reasoning(content, reasoning_content):
+    if reasoning_content and reasoning_content.strip() != "":
+        return "<think>\n" + reasoning_content + "\n</think>\n" + content
+    return content
+
+
+def used_tokens(response):
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None)
+
+
+def is_congestion(e):
+    """
+    Whether a failed request says the endpoint is overloaded (429, 5xx, timeouts, dropped
+    connections) rather than that the request itself is bad.
+    """
+    if isinstance(e, (APITimeoutError, APIConnectionError)):
+        return True
+    return isinstance(e, APIStatusError) and (e.status_code == 429 or e.status_code >= 500)
+
+
+def retry_after(e):
+    response = getattr(e, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def watch_text(watch, text):
+    """
+    Run a whole reply (a cached or non-streamed one) through a watch.
+    """
+    watch.reset()
+    watch.feed(text)
+    watch.close()
+
+
+def _complete(client, chat_args, watch=None):
+    if watch is not None:
+        watch.reset()
+    response = client.chat.completions.create(**chat_args)
+    if chat_args.get("stream"):
+        content, reasoning_content, used = [], [], None
+        try:
+            for chunk in response:
+                text, reasoning = chunk_text(chunk)
+                if watch is not None and text:
+                    watch.feed(text)
+                content.append(text)
+                reasoning_content.append(reasoning)
+                used = used_tokens(chunk) or used
+            if watch is not None:
+                watch.close()
+        except BaseException:
+            # dropping the connection is what stops the generation
+            response.close()
+            raise
+        return join_reasoning("".join(content), "".join(reasoning_content)), used
+    content, reasoning_content = message_text(response)
+    if watch is not None:
+        watch_text(watch, content)
+    return join_reasoning(content, reasoning_content), used_tokens(response)
+
+
+def chat_completion(client_args, chat_args, governor=None, cache=None, watch=None):
+    """
+    Blocking chat request on the shared client; returns the text, raises on failure.
+    With a governor (see rate_governor.py) the request is paced by it and congestion is
+    retried up to client_args["max_retries"] times through it instead of inside the SDK.
+    With a cache (see llm_cache.py) a cached reply is returned without any request, and
+    new non-empty replies are stored.
+    With a watch (see tools.FileBlockStream) the reply content is fed to watch.feed as it
+    streams in (with chat_args["stream"]; else all at once) and watch.close() is called at
+    its end; an exception of either aborts the request and is raised, and nothing is cached.
+    """
+    if cache is not None:
+        text = cache.get(client_args.get("base_url"), chat_args)
+        if text is None:
+            text = _governed_completion(client_args, chat_args, governor, watch)
+            if text:
+                cache.put(client_args.get("base_url"), chat_args, text)
+        elif watch is not None:
+            watch_text(watch, text)
+        return text
+    return _governed_completion(client_args, chat_args, governor, watch)
+
+
+def _governed_completion(client_args, chat_args, governor, watch=None):
+    if governor is None:
+        return _complete(get_client(client_args), chat_args, watch)[0]
+    client = get_client(dict(client_args, max_retries=0))
+    max_retries = client_args.get("max_retries", 2)
+    estimate = governor.estimate_tokens(chat_args)
+    for attempt in range(max_retries + 1):
+        start = governor.acquire_blocking(estimate)
+        try:
+            text, used = _complete(client, chat_args, watch)
+        except Exception as e:
+            governor.release(start, estimate, congested=is_congestion(e))
+            if not is_congestion(e) or attempt == max_retries:
+                raise
+            time.sleep(governor.backoff(attempt, retry_after(e)))
+            continue
+        except BaseException:
+            governor.abandon()
+            raise
+        governor.release(start, estimate, used)
+        return text
+
+
+class AsyncChatClient:
+    """
+    One AsyncOpenAI client (and so one connection pool) per endpoint for the lifetime of an
+    event loop, with at most `endpoint_limits.get(base_url, default_limit)` requests in
+    flight per endpoint. Requests beyond that wait on the endpoint's semaphore, so a single
+    process can have thousands of conversations going at once.
+    An endpoint with a RateGovernor in `governors` (keyed by base_url) is paced by it
+    instead, and its congestion is retried through the governor, as in chat_completion.
+    A ResponseCache in `cache` is consulted before any request, as in chat_completion.
+        client = AsyncChatClient(default_limit=512)
+        text = await client.chat({"model": ..., "messages": [...]})
+        await client.close()
+    """
+
+    def __init__(self, client_args=None, default_limit=DEFAULT_ENDPOINT_CONCURRENCY, endpoint_limits=None, governors=None, cache=None):
+        self.client_args = client_args or DEFAULT_CLIENT_ARGS
+        self.default_limit = default_limit
+        self.endpoint_limits = endpoint_limits or {}
+        self.governors = governors or {}
+        self.cache = cache
+        self.clients = {}
+        self.semaphores = {}
+
+    def _endpoint(self, client_args):
+        key = json.dumps(client_args, sort_keys=True, default=str)
+        base_url = str(client_args.get("base_url", ""))
+        governor = self.governors.get(base_url)
+        if key not in self.clients:
+            # keep-alive connections up to the endpoint's limit are reused by AsyncOpenAI itself
+            # a governed endpoint retries through its governor, not inside the SDK
+            self.clients[key] = AsyncOpenAI(**dict(client_args, max_retries=0)) if governor is not None else AsyncOpenAI(**client_args)
+            self.semaphores[key] = asyncio.Semaphore(self.endpoint_limits.get(base_url, self.default_limit))
+        return self.clients[key], self.semaphores[key], governor
+
+    async def _complete(self, client, chat_args, watch=None):
+        if watch is not None:
+            watch.reset()
+        response = await client.chat.completions.create(**chat_args)
+        if chat_args.get("stream"):
+            content, reasoning_content, used = [], [], None
+            try:
+                async for chunk in response:
+                    text, reasoning = chunk_text(chunk)
+                    if watch is not None and text:
+                        watch.feed(text)
+                    content.append(text)
+                    reasoning_content.append(reasoning)
+                    used = used_tokens(chunk) or used
+                if watch is not None:
+                    watch.close()
+            except BaseException:
+                await response.close()
+                raise
+            return join_reasoning("".join(content), "".join(reasoning_content)), used
+        content, reasoning_content = message_text(response)
+        if watch is not None:
+            watch_text(watch, content)
+        return join_reasoning(content, reasoning_content), used_tokens(response)
+
+    async def chat(self, chat_args, client_args=None, watch=None):
+        """
+        Same result as chat_completion, without blocking the event loop.
+        """
+        client_args = client_args or self.client_args
+        if self.cache is not None:
+            # sqlite may wait on another process's write lock, so it stays off the loop
+            text = await asyncio.to_thread(self.cache.get, client_args.get("base_url"), chat_args)
+            if text is None:
+                text = await self._governed_chat(chat_args, client_args, watch)
+                if text:
+                    await asyncio.to_thread(self.cache.put, client_args.get("base_url"), chat_args, text)
+            elif watch is not None:
+                watch_text(watch, text)
+            return text
+        return await self._governed_chat(chat_args, client_args, watch)
+
+    async def _governed_chat(self, chat_args, client_args, watch=None):
+        client, semaphore, governor = self._endpoint(client_args)
+        if governor is None:
+            async with semaphore:
+                return (await self._complete(client, chat_args, watch))[0]
+        max_retries = client_args.get("max_retries", 2)
+        estimate = governor.estimate_tokens(chat_args)
+        for attempt in range(max_retries + 1):
+            start = await governor.acquire(estimate)
+            try:
+                async with semaphore:
+                    text, used = await self._complete(client, chat_args, watch)
+            except Exception as e:
+                governor.release(start, estimate, congested=is_congestion(e))
+                if not is_congestion(e) or attempt == max_retries:
+                    raise
+                await asyncio.sleep(governor.backoff(attempt, retry_after(e)))
+                continue
+            except BaseException:
+                # asyncio.CancelledError is not an Exception; the slot must still go back
+                governor.abandon()
+                raise
+            governor.release(start, estimate, used)
+            return text
+
+    async def close(self):
+        for client in self.clients.values():
+            await client.close()
+        self.clients.clear()
+        self.semaphores.clear()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+def run_conversation(conversation, chat):
+    """
+    Drive a conversation generator: it yields chat_args and is sent back the reply text of
+    each, and its return value is the result. `chat(chat_args) -> str` blocks. A
+    conversation that yields (chat_args, watch) instead gets its reply through `watch`,
+    called as chat(chat_args, watch).
+    """
+    try:
+        request = next(conversation)
+        while True:
+            request = conversation.send(chat(*request) if isinstance(request, tuple) else chat(request))
+    except StopIteration as stop:
+        return stop.value
+
+
+async def arun_conversation(conversation, chat):
+    """
+    run_conversation for a coroutine `chat`, so many conversations share one event loop.
+    """
+    try:
+        request = next(conversation)
+        while True:
+            request = conversation.send(await (chat(*request) if isinstance(request, tuple) else chat(request)))
+    except StopIteration as stop:
+        return stop.value
@@ -0,0 +1,189 @@
+from array import array
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+
+DEFAULT_NUM_PERM = 128
+DEFAULT_BANDS = 32
+DEFAULT_THRESHOLD = 0.7
+SHINGLE_WORDS = 3
+# pages of the index file mapped into memory instead of read through the page cache
+MMAP_BYTES = 1 << 34
+MASK_63 = (1 << 63) - 1
+# odd constant spreading densified values, so a borrowed bin differs from its source
+DENSIFY_STEP = 0x9E3779B97F4A7C15
+TOKEN = re.compile(r"\w+")
+
+
+def shingles(text, words=SHINGLE_WORDS):
+    tokens = TOKEN.findall(text.lower())
+    if len(tokens) < words:
+        return {" ".join(tokens)} if tokens else set()
+    return {" ".join(tokens[i:i + words]) for i in range(len(tokens) - words + 1)}
+
+
+def minhash(text, num_perm=DEFAULT_NUM_PERM):
+    """
+    MinHash signature of the word shingles of text, by one permutation hashing: every
+    shingle is hashed once and lands in one of num_perm bins, each keeping its minimum.
+    Empty bins borrow from the next filled bin to the right (rotation densification), so
+    the signature estimates Jaccard similarity like num_perm independent hashes would.
+    None for a text without words.
+    """
+    bins = [None] * num_perm
+    for shingle in shingles(text):
+        h = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+        i, value = h % num_perm, h // num_perm
+        if bins[i] is None or value < bins[i]:
+            bins[i] = value
+    if all(value is None for value in bins):
+        return None
+    signature = array("Q", bytes(8 * num_perm))
+    for i in range(num_perm):
+        j, distance = i, 0
+        while bins[j] is None:
+            j, distance = (j + 1) % num_perm, distance + 1
+        signature[i] = (bins[j] + distance * DENSIFY_STEP) & 0xFFFFFFFFFFFFFFFF
+    return signature
+
+
+def similarity(a, b):
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+
+class NearDupIndex:
+    """
+    Incremental MinHash/LSH index of texts in one SQLite file (WAL mode and memory-mapped
+    reads, so the worker processes of a run and later runs share it and millions of
+    entries need not fit in the Python heap). A signature is cut into `bands` bands; texts
+    sharing any band are candidates, and a candidate is a near-duplicate if the estimated
+    Jaccard similarity of the two signatures reaches `threshold`. Entries are grouped by
+    namespace, and only texts of the same namespace are compared.
+        index = NearDupIndex("questions.sqlite")
+        match = index.add_if_new(text, name, namespace="python")
+        # None: text was new and is now indexed; else {"name", "similarity"} of the closest entry
+    """
+
+    def __init__(self, path, num_perm=DEFAULT_NUM_PERM, bands=DEFAULT_BANDS, threshold=DEFAULT_THRESHOLD):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.path = path
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(f"PRAGMA mmap_size={MMAP_BYTES}")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS entries (id INTEGER PRIMARY KEY, name TEXT, signature BLOB NOT NULL)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS bands (key INTEGER NOT NULL, id INTEGER NOT NULL, PRIMARY KEY (key, id)) WITHOUT ROWID")
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            self.connection.executemany("INSERT OR IGNORE INTO meta VALUES (?, ?)", [("num_perm", num_perm), ("bands", bands)])
+            stored = dict(self.connection.execute("SELECT name, value FROM meta").fetchall())
+        finally:
+            self.connection.execute("COMMIT")
+        if (stored["num_perm"], stored["bands"]) != (num_perm, bands):
+            raise ValueError(f"{path} was built with num_perm={stored['num_perm']} and bands={stored['bands']}")
+
+    def band_keys(self, signature, namespace=""):
+        # one 63-bit key per band (sqlite integers are signed), salted with band and namespace
+        keys = []
+        for band in range(self.bands):
+            data = f"{namespace}\0{band}\0".encode("utf-8") + signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            keys.append(int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little") & MASK_63)
+        return keys
+
+    def _closest(self, signature, keys):
+        placeholders = ",".join("?" * len(keys))
+        candidates = self.connection.execute(f"SELECT DISTINCT id FROM bands WHERE key IN ({placeholders})", keys).fetchall()
+        best = None
+        for (entry_id,) in candidates:
+            name, blob = self.connection.execute("SELECT name, signature FROM entries WHERE id = ?", (entry_id,)).fetchone()
+            score = similarity(signature, array("Q", blob))
+            if score >= self.threshold and (best is None or score > best["similarity"]):
+                best = {"name": name, "similarity": score}
+        return best
+
+    def query(self, text, namespace=""):
+        """
+        {"name", "similarity"} of the closest indexed near-duplicate of text, or None.
+        """
+        signature = minhash(text, self.num_perm)
+        if signature is None:
+            return None
+        return self._closest(signature, self.band_keys(signature, namespace))
+
+    def add_if_new(self, text, name=None, namespace=""):
+        """
+        Index text unless it is a near-duplicate of an indexed one, in one write transaction
+        so two processes cannot both add the same text; returns the match like query().
+        """
+        signature = minhash(text, self.num_perm)
+        if signature is None:
+            return None
+        keys = self.band_keys(signature, namespace)
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            match = self._closest(signature, keys)
+            if match is None:
+                entry_id = self.connection.execute("INSERT INTO entries (name, signature) VALUES (?, ?)", (name, signature.tobytes())).lastrowid
+                self.connection.executemany("INSERT OR IGNORE INTO bands VALUES (?, ?)", [(key, entry_id) for key in keys])
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        return match
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Split question records into unique ones and near-duplicates of earlier ones.")
+    parser.add_argument("--input_path", "-input_path", nargs="+", type=str, required=True, help="JSONL outputs of generate_question_and_name.py.")
+    parser.add_argument("--index_path", "-index_path", type=str, required=True, help="Near-duplicate index to check against and add to; shared with --near_dup_index of the generation script.")
+    parser.add_argument("--output_path", "-output_path", type=str, required=True)
+    parser.add_argument("--threshold", "-threshold", type=float, default=DEFAULT_THRESHOLD)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    index = NearDupIndex(args.index_path, threshold=args.threshold)
+    os.makedirs(args.output_path, exist_ok=True)
+    counts, seconds = {"unique": 0, "duplicate": 0}, 0.0
+    with open(os.path.join(args.output_path, "unique.jsonl"), "w", encoding="utf-8") as unique_f, open(os.path.join(args.output_path, "duplicate.jsonl"), "w", encoding="utf-8") as duplicate_f:
+        for input_path in args.input_path:
+            with open(input_path, "r", encoding="utf-8") as f:
+                for i, line in enumerate(f):
+                    if not line.strip():
+                        continue
+                    obj = json.loads(line)
+                    start = time.perf_counter()
+                    match = index.add_if_new(obj["source_messages"]["question"][-1]["content"], f"{os.path.basename(input_path)}:{i}", obj.get("language", ""))
+                    seconds += time.perf_counter() - start
+                    if match is None:
+                        unique_f.write(line)
+                        counts["unique"] += 1
+                    else:
+                        obj["near_duplicate"] = match
+                        duplicate_f.write(json.dumps(obj, ensure_ascii=False) + "\n")
+                        counts["duplicate"] += 1
+    total = counts["unique"] + counts["duplicate"]
+    print(f"{counts['unique']} unique, {counts['duplicate']} near-duplicates, {len(index)} indexed, {1000 * seconds / max(total, 1):.3f} ms per record")
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import asyncio
+import collections
+import json
+import random
+import threading
+import time
+
+# seconds of the per-minute budget a bucket may spend at once
+BURST_SECONDS = 5
+# completion tokens assumed for a request without max_tokens, until its usage is known
+DEFAULT_COMPLETION_TOKENS = 1024
+INITIAL_CONCURRENCY = 8
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+
+
+class TokenBucket:
+    """
+    `per_minute` units refilled continuously, at most BURST_SECONDS worth banked. reserve()
+    takes the units right away, going into debt if needed, and returns how long the caller
+    has to wait before using them; later callers queue behind that debt, so requests leave
+    in order at the configured rate instead of all retrying at once.
+    """
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = max(self.rate * BURST_SECONDS, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount):
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= amount
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self, amount):
+        """
+        Give back (or, if negative, take) units once the real cost of a request is known.
+        """
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateGovernor:
+    """
+    Pace requests to one model endpoint:
+        requests per minute and tokens per minute through token buckets (None: unlimited);
+        concurrency through AIMD between min_concurrency and max_concurrency, starting at
+        initial_concurrency: +1 per success until the first congestion (slow start, doubling
+        every round trip), +1 per `limit` successes after that, halved on congestion (429, 5xx, timeouts, or a latency above
+        target_latency). Only requests sent after the last decrease can cause another, so
+        one burst of 429s halves it once.
+    Usage around each request:
+        estimate = governor.estimate_tokens(chat_args)
+        start = await governor.acquire(estimate)      # or acquire_blocking()
+        ... request ...
+        governor.release(start, estimate, used_tokens, congested)
+    or governor.abandon() if the request was cancelled before it finished.
+    The adaptive limit is async-only: acquire_blocking() does not wait on it, and a pool
+    worker sends one request at a time, so there the governor only paces the buckets
+    (each worker holding its share of rpm/tpm) and spaces out the retries.
+    throughput() reports the rates of the last `window_seconds`.
+    """
+
+    def __init__(self, rpm=None, tpm=None, max_concurrency=256, min_concurrency=1, target_latency=None, initial_concurrency=INITIAL_CONCURRENCY, window_seconds=60.0):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min(min_concurrency, max_concurrency)
+        self.limit = float(min(max(initial_concurrency, self.min_concurrency), max_concurrency))
+        self.slow_start = True
+        self.target_latency = target_latency
+        self.window_seconds = window_seconds
+        self.in_flight = 0
+        self.last_decrease = float("-inf")
+        self.condition = None
+        self.random = random.Random()
+        self.created = time.monotonic()
+        # (finish time, tokens, latency, congested) of recent requests
+        self.history = collections.deque()
+
+    @staticmethod
+    def estimate_tokens(chat_args):
+        # ~4 characters per token is close enough for budgeting
+        prompt_chars = len(json.dumps(chat_args.get("messages", []), ensure_ascii=False))
+        return prompt_chars // 4 + (chat_args.get("max_tokens") or DEFAULT_COMPLETION_TOKENS)
+
+    def _reserve(self, estimate):
+        delay = 0.0
+        if self.requests is not None:
+            delay = max(delay, self.requests.reserve(1))
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.reserve(estimate))
+        return delay
+
+    async def acquire(self, estimate):
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        delay = self._reserve(estimate)
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            except BaseException:
+                self.abandon()
+                raise
+        return time.monotonic()
+
+    def acquire_blocking(self, estimate):
+        """
+        acquire() for a single-threaded caller: only the buckets apply, not the adaptive limit.
+        """
+        self.in_flight += 1
+        delay = self._reserve(estimate)
+        if delay > 0:
+            time.sleep(delay)
+        return time.monotonic()
+
+    def release(self, start, estimate, used_tokens=None, congested=False):
+        now = time.monotonic()
+        latency = now - start
+        self.in_flight -= 1
+        if self.tokens is not None and used_tokens is not None:
+            self.tokens.refund(estimate - used_tokens)
+        if congested or (self.target_latency is not None and latency > self.target_latency):
+            if start >= self.last_decrease:
+                self.limit = max(float(self.min_concurrency), self.limit / 2)
+                self.last_decrease = now
+                self.slow_start = False
+        else:
+            self.limit = min(float(self.max_concurrency), self.limit + (1 if self.slow_start else 1 / self.limit))
+        self.history.append((now, used_tokens if used_tokens is not None else estimate, latency, congested))
+        while self.history and self.history[0][0] < now - self.window_seconds:
+            self.history.popleft()
+        if self.condition is not None:
+            asyncio.ensure_future(self._notify())
+
+    def abandon(self):
+        """
+        Give back the slot of a request that was cancelled: it says nothing about congestion,
+        so neither the limit nor the history changes.
+        """
+        self.in_flight -= 1
+        if self.condition is not None:
+            asyncio.ensure_future(self._notify())
+
+    async def _notify(self):
+        async with self.condition:
+            self.condition.notify_all()
+
+    def backoff(self, attempt, retry_after=None):
+        """
+        Seconds to wait before retrying a congested request: the server's Retry-After if it
+        sent one, exponential with full jitter otherwise.
+        """
+        if retry_after is not None:
+            return retry_after
+        return self.random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+    def throughput(self):
+        now = time.monotonic()
+        recent = [entry for entry in self.history if entry[0] >= now - self.window_seconds]
+        minutes = max(min(self.window_seconds, now - self.created), 1.0) / 60
+        latencies = sorted(entry[2] for entry in recent)
+        return {
+            "requests_per_minute": len(recent) / minutes,
+            "tokens_per_minute": sum(entry[1] for entry in recent) / minutes,
+            "congestion_rate": sum(1 for entry in recent if entry[3]) / len(recent) if recent else 0.0,
+            "p50_latency": latencies[len(latencies) // 2] if latencies else None,
+            "concurrency_limit": int(self.limit),
+            "in_flight": self.in_flight,
+        }
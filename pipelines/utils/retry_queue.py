@@ -0,0 +1,184 @@
+import asyncio
+from concurrent.futures import FIRST_COMPLETED, wait
+import heapq
+import itertools
+import json
+import os
+import random
+import time
+
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_RETRY_BASE_DELAY = 5.0
+DEFAULT_RETRY_MAX_DELAY = 300.0
+
+
+class RetryQueue:
+    """
+    Tasks waiting to run, as a heap ordered by the time they may run: new tasks right away,
+    failed ones after an exponential backoff with full jitter. A task that failed
+    max_attempts times goes to the dead-letter file (one JSON line with the task, its
+    attempts and its errors) instead of back into the heap.
+        queue = RetryQueue(dead_letter_path="dead.jsonl")
+        queue.extend(tasks)
+        entry = queue.pop_ready()          # None if nothing is due, see next_delay()
+        ... run entry["task"] ...          # a dict task also gets its attempt as task["attempt"]
+        queue.succeed(entry)  or  queue.fail(entry, e)
+    stats() reports successful samples per hour next to the attempts that took.
+    """
+
+    def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS, base_delay=DEFAULT_RETRY_BASE_DELAY, max_delay=DEFAULT_RETRY_MAX_DELAY, dead_letter_path=None, seed=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.dead_letter_path = dead_letter_path
+        self.random = random.Random(seed)
+        self.heap = []
+        self.counter = itertools.count()
+        self.created = time.monotonic()
+        self.counts = {"tasks": 0, "attempts": 0, "retries": 0, "succeeded": 0, "dead": 0}
+
+    def __len__(self):
+        return len(self.heap)
+
+    def _push(self, ready_at, entry):
+        # the counter keeps equal times in insertion order and never compares tasks
+        heapq.heappush(self.heap, (ready_at, next(self.counter), entry))
+
+    def add(self, task):
+        self.counts["tasks"] += 1
+        self._push(time.monotonic(), {"task": task, "attempt": 0, "errors": []})
+
+    def extend(self, tasks):
+        for task in tasks:
+            self.add(task)
+
+    def pop_ready(self):
+        if not self.heap or self.heap[0][0] > time.monotonic():
+            return None
+        entry = heapq.heappop(self.heap)[2]
+        entry["attempt"] += 1
+        if isinstance(entry["task"], dict):
+            # lets the worker vary what it retries, e.g. a sampling seed
+            entry["task"]["attempt"] = entry["attempt"]
+        self.counts["attempts"] += 1
+        return entry
+
+    def next_delay(self):
+        """
+        Seconds until the next task is due; None if the queue is empty.
+        """
+        if not self.heap:
+            return None
+        return max(self.heap[0][0] - time.monotonic(), 0.0)
+
+    def backoff(self, attempt):
+        return self.random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def succeed(self, entry):
+        self.counts["succeeded"] += 1
+
+    def fail(self, entry, e):
+        """
+        Schedule the entry's next attempt; returns False if it was dead-lettered instead.
+        """
+        entry["errors"].append(str(e))
+        if entry["attempt"] < self.max_attempts:
+            self.counts["retries"] += 1
+            self._push(time.monotonic() + self.backoff(entry["attempt"]), entry)
+            return True
+        self.counts["dead"] += 1
+        if self.dead_letter_path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.dead_letter_path)), exist_ok=True)
+            with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"task": entry["task"], "attempts": entry["attempt"], "errors": entry["errors"]}, ensure_ascii=False, default=str) + "\n")
+        return False
+
+    def stats(self):
+        hours = max(time.monotonic() - self.created, 1e-9) / 3600
+        return dict(
+            self.counts,
+            seconds=hours * 3600,
+            succeeded_per_hour=self.counts["succeeded"] / hours,
+            attempts_per_success=self.counts["attempts"] / self.counts["succeeded"] if self.counts["succeeded"] else None,
+        )
+
+
+def run_pool(executor, worker, queue, handle, window):
+    """
+    Run every task of queue as worker(task) on a concurrent.futures executor, with at most
+    `window` submitted at once; failures are resubmitted to the same executor once their
+    backoff expires. handle(i, total, obj, e) is called once per task, with its result or,
+    for a dead-lettered task, its last error.
+    """
+    running = {}
+    total, finished = queue.counts["tasks"], 0
+    while queue or running:
+        while len(running) < window:
+            entry = queue.pop_ready()
+            if entry is None:
+                break
+            running[executor.submit(worker, entry["task"])] = entry
+        if not running:
+            time.sleep(queue.next_delay())
+            continue
+        # wake up for the next due retry as well as for finished tasks
+        done, _ = wait(running, timeout=queue.next_delay(), return_when=FIRST_COMPLETED)
+        for future in done:
+            entry = running.pop(future)
+            e = future.exception()
+            if e is None:
+                queue.succeed(entry)
+                finished += 1
+                handle(finished, total, future.result(), None)
+            elif not queue.fail(entry, e):
+                finished += 1
+                handle(finished, total, None, e)
+
+
+async def run_async(worker, queue, handle, window, feed=None):
+    """
+    run_pool for a coroutine worker(task) on the running event loop. handle may also be a
+    coroutine function, which then holds up this stage while it waits (e.g. on a full
+    queue of the next one).
+    With `feed` (an asyncio.Queue ending with None), tasks arriving on it are added to queue
+    while it runs, taking a new one only while fewer than `window` wait, and the run lasts
+    until the feed has ended; handle then gets the number of tasks added so far as total.
+    """
+    running = {}
+    finished = 0
+    getter = None
+    while queue or running or feed is not None:
+        while len(running) < window:
+            entry = queue.pop_ready()
+            if entry is None:
+                break
+            running[asyncio.ensure_future(worker(entry["task"]))] = entry
+        if feed is not None and getter is None and len(queue) < window:
+            getter = asyncio.ensure_future(feed.get())
+        waiting = set(running) | ({getter} if getter is not None else set())
+        if not waiting:
+            await asyncio.sleep(queue.next_delay())
+            continue
+        done, _ = await asyncio.wait(waiting, timeout=queue.next_delay(), return_when=asyncio.FIRST_COMPLETED)
+        if getter in done:
+            task, getter = getter.result(), None
+            if task is None:
+                feed = None
+            else:
+                queue.add(task)
+        for future in done:
+            if future not in running:
+                continue
+            entry = running.pop(future)
+            e = future.exception()
+            if e is None:
+                queue.succeed(entry)
+                finished += 1
+                result = handle(finished, queue.counts["tasks"], future.result(), None)
+            elif not queue.fail(entry, e):
+                finished += 1
+                result = handle(finished, queue.counts["tasks"], None, e)
+            else:
+                continue
+            if asyncio.iscoroutine(result):
+                await result
@@ -76,8 +76,12 @@ if(${MSVC})
         COMPILE_FLAGS "/WX /w44244 /w44267")
 endif()
 
-# Run the tests on every build
-add_custom_target(test_${exercise} ALL DEPENDS ${exercise} COMMAND ${exercise})
+# Run the tests on every build, writing a JUnit report if the verification stage asks for one
+if(DEFINED ENV{CATCH_JUNIT_REPORT})
+    add_custom_target(test_${exercise} ALL DEPENDS ${exercise} COMMAND ${exercise} --reporter junit --out $ENV{CATCH_JUNIT_REPORT})
+else()
+    add_custom_target(test_${exercise} ALL DEPENDS ${exercise} COMMAND ${exercise})
+endif()
         """,
         "tests-main.cpp": """
 #define CATCH_CONFIG_MAIN
@@ -445,7 +449,7 @@ npm install -g jest
 
 sed -i 's/\\bxtest(/test(/g' *.spec.js
 npm i 
-npm run test
+npm run test -- "$@"
 """,
     }
 }
\ No newline at end of file
@@ -0,0 +1,118 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+# a minimal OpenAI-compatible endpoint for exercising the generation scripts and
+# pipelines/utils/llm_client.py offline:
+#   POST /v1/chat/completions   canned reply after --delay seconds, streamed as SSE if asked
+#   GET  /stats                 connections opened, requests served, peak in-flight requests
+# With --capacity, requests beyond that many in flight get a 429 like a loaded provider.
+# HTTP/1.1 keep-alive is honoured, so /stats also shows whether clients reuse connections.
+
+
+class StubServer:
+    def __init__(self, reply, delay=0.0, error_rate=0.0, seed=None, capacity=None):
+        self.reply = reply
+        self.capacity = capacity
+        self.delay = delay
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.stats = {"connections": 0, "requests": 0, "errors": 0, "rate_limited": 0, "in_flight": 0, "peak_in_flight": 0}
+
+    async def handle_connection(self, reader, writer):
+        self.stats["connections"] += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                status, content_type, payload = await self.route(method, path, body)
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(payload)}\r\n"
+                    f"Connection: keep-alive\r\n\r\n".encode("latin-1") + payload
+                )
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method, path, body):
+        if method == "GET" and path.startswith("/stats"):
+            return "200 OK", "application/json", json.dumps(self.stats).encode()
+        if method == "POST" and path.rstrip("/").endswith("/chat/completions"):
+            return await self.chat(json.loads(body or b"{}"))
+        return "404 Not Found", "application/json", b'{"error": {"message": "not found"}}'
+
+    async def chat(self, request):
+        self.stats["requests"] += 1
+        if self.capacity is not None and self.stats["in_flight"] >= self.capacity:
+            self.stats["rate_limited"] += 1
+            return "429 Too Many Requests", "application/json", b'{"error": {"message": "stub rate limit", "type": "rate_limit_error"}}'
+        self.stats["in_flight"] += 1
+        self.stats["peak_in_flight"] = max(self.stats["peak_in_flight"], self.stats["in_flight"])
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.stats["in_flight"] -= 1
+        if self.random.random() < self.error_rate:
+            self.stats["errors"] += 1
+            return "500 Internal Server Error", "application/json", b'{"error": {"message": "stub error", "type": "server_error"}}'
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        model = request.get("model", "stub")
+        usage = {"prompt_tokens": sum(len(str(m.get("content", ""))) // 4 for m in request.get("messages", [])), "completion_tokens": len(self.reply) // 4}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        if request.get("stream"):
+            events = []
+            for i in range(0, len(self.reply), 16):
+                chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                         "choices": [{"index": 0, "delta": {"content": self.reply[i:i + 16]}, "finish_reason": None}]}
+                events.append(f"data: {json.dumps(chunk)}\n\n")
+            final = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            events.append(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n")
+            return "200 OK", "text/event-stream", "".join(events).encode()
+        response = {
+            "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": self.reply}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+        return "200 OK", "application/json", json.dumps(response).encode()
+
+
+async def serve(args):
+    server = StubServer(args.reply, args.delay, args.error_rate, args.seed, args.capacity)
+    async with await asyncio.start_server(server.handle_connection, args.host, args.port, backlog=4096) as s:
+        print(f"Stub OpenAI server on http://{args.host}:{args.port}/v1", flush=True)
+        await s.serve_forever()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible chat completions stub.")
+    parser.add_argument("--host", "-host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", "-port", type=int, default=8000)
+    parser.add_argument("--delay", "-delay", type=float, default=0.5, help="Seconds every completion takes.")
+    parser.add_argument("--error_rate", "-error_rate", type=float, default=0.0, help="Fraction of completions answered with HTTP 500.")
+    parser.add_argument("--capacity", "-capacity", type=int, default=None, help="Completions served at once; more get HTTP 429. Unlimited if not set.")
+    parser.add_argument("--reply", "-reply", type=str, default="```\nhello_world\n```")
+    parser.add_argument("--seed", "-seed", type=int, default=None)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(serve(parse_args()))
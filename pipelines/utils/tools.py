@@ -1,6 +1,238 @@
 import re
 
+FENCE = "```"
+
+
+def is_filename_line(line, require_dot=True):
+    """
+    Whether a line can name the file of the fence below it: like the legacy pattern, a line
+    with a dot that is neither its first nor its last character, or with require_dot=False
+    any non-blank line.
+    """
+    if require_dot:
+        return line.find(".", 1, len(line) - 1) != -1
+    return bool(line.strip())
+
+
+def fence_of(line):
+    """
+    (length of the backtick run, info string) of a fence line, or None for any other line.
+    """
+    if not line.startswith(FENCE):
+        return None
+    run = len(line) - len(line.lstrip("`"))
+    return run, line[run:].strip()
+
+
+class FileBlockParser:
+    """
+    Single-pass extractor of the file blocks of a model response:
+        path/to/file.ext
+        ```language
+        content
+        ```
+    Lines are read once and a block is emitted when its closing fence arrives, so the work is
+    linear in the response and the response may come in any number of chunks:
+        parser = FileBlockParser()
+        for chunk in chunks:
+            for filename, content in parser.feed(chunk):
+                ...
+        blocks = parser.close()      # blocks completed by the last line
+        parser.partial               # (filename, content) of a block cut off by the end, or None
+    Fences follow Markdown: a fence with an info string inside a block opens a nested fence,
+    and a bare fence at least as long as the innermost open one closes it, so a README with
+    its own code fences stays one file. Fences outside file blocks are tracked too, so the
+    closing fence of an example whose last line has a dot does not open a file; a filename
+    line followed by a fence with an info string still starts a file there.
+    """
+
+    def __init__(self, require_dot=True):
+        self.require_dot = require_dot
+        self.pending = []
+        self.previous = None
+        self.filename = None
+        self.lines = []
+        # backtick runs of the open fences, outermost first; the file's own fence is stack[0]
+        self.stack = []
+        # lines read so far inside fences that belong to no file
+        self.unnamed_lines = 0
+        self.partial = None
+
+    def _line(self, line):
+        fence = fence_of(line)
+        if self.filename is not None:
+            if fence is not None:
+                run, info = fence
+                if info:
+                    self.stack.append(run)
+                elif run >= self.stack[-1]:
+                    self.stack.pop()
+                    if not self.stack:
+                        block = (self.filename, "\n".join(self.lines))
+                        self.filename, self.lines = None, []
+                        return block
+            self.lines.append(line)
+            return None
+        previous, self.previous = self.previous, line
+        if fence is None:
+            if self.stack:
+                self.unnamed_lines += 1
+            return None
+        # a fence line names nothing
+        self.previous = None
+        run, info = fence
+        if previous is not None and is_filename_line(previous, self.require_dot) and (info or not self.stack):
+            self.filename, self.stack = previous.strip(), [run]
+        elif info or not self.stack:
+            if not self.stack:
+                self.unnamed_lines = 0
+            self.stack.append(run)
+        elif run >= self.stack[-1]:
+            self.stack.pop()
+        return None
+
+    def feed(self, text):
+        """
+        Parse the next chunk of the response; returns the (filename, content) blocks it completed.
+        """
+        if "\n" not in text:
+            if text:
+                self.pending.append(text)
+            return []
+        lines = text.split("\n")
+        if self.pending:
+            self.pending.append(lines[0])
+            lines[0] = "".join(self.pending)
+        self.pending = [lines.pop()]
+        blocks = []
+        for line in lines:
+            block = self._line(line)
+            if block is not None:
+                blocks.append(block)
+        return blocks
+
+    def close(self):
+        """
+        End of the response: parses its last line and returns the blocks that completed; a
+        block left open is kept in self.partial.
+        """
+        block = self._line("".join(self.pending))
+        self.pending = []
+        if self.filename is not None:
+            self.partial = (self.filename, "\n".join(self.lines))
+        return [block] if block is not None else []
+
+
+DEFAULT_MAX_UNNAMED_LINES = 40
+DEFAULT_MAX_DOT_RUN = 64
+# "// ... rest of code ...", "# ...", "... existing code": content left out despite the prompt
+ELISION = re.compile(r"\s*(?:(?:#|//|/\*|<!--|--|;)\s*(?:\.\.\.|\u2026)|(?:\.\.\.|\u2026)\s+(?:rest|remaining|existing|more|other|omitted|previous|same|unchanged)\b)", re.IGNORECASE)
+# markup, spaces or prose punctuation: the line above the fence is not a bare path/to/filename
+BAD_FILENAME = re.compile(r"[\s`*#:<>|\"']")
+
+
+class MalformedOutput(Exception):
+    pass
+
+
+class FileBlockStream:
+    """
+    Watches a reply while it streams in (the `watch` of llm_client.chat_completion): each file
+    block is added to self.files (as parse_stacked_content returns them) and passed to
+    on_block(filename, content) as soon as its closing fence arrives, and MalformedOutput is
+    raised as soon as the reply breaks the file format, which stops the generation there:
+    - a filename line with markup or prose instead of a bare path,
+    - a file that leaves content out with an ellipsis comment ("// ... rest of code"),
+    - a run of more than max_dot_run dots,
+    - a code block without a filename line that grows past max_unnamed_lines lines,
+    - no file at all by the end of the reply.
+    Each check can be switched off with None or False. reset() starts over for a
+    new attempt; blocks of an attempt that failed may already have been passed to on_block.
+    """
+
+    def __init__(self, on_block=None, max_unnamed_lines=DEFAULT_MAX_UNNAMED_LINES, max_dot_run=DEFAULT_MAX_DOT_RUN, check_filenames=True, check_elisions=True, require_files=True):
+        self.on_block = on_block
+        self.max_unnamed_lines = max_unnamed_lines
+        self.max_dot_run = max_dot_run
+        self.dot_run_pattern = re.compile(r"\.{%d,}" % (max_dot_run + 1)) if max_dot_run else None
+        self.check_filenames = check_filenames
+        self.check_elisions = check_elisions
+        self.require_files = require_files
+        self.reset()
+
+    def reset(self):
+        self.parser = FileBlockParser()
+        self.files = []
+        # dots at the end of the text so far, lines of the open file already checked
+        self.dot_run = 0
+        self.checked_lines = 0
+
+    def _check_dots(self, delta):
+        leading = len(delta) - len(delta.lstrip("."))
+        if leading == len(delta):
+            self.dot_run += leading
+        else:
+            if self.dot_run + leading > self.max_dot_run or self.dot_run_pattern.search(delta):
+                raise MalformedOutput(f"Runaway ellipsis of more than {self.max_dot_run} dots")
+            self.dot_run = len(delta) - len(delta.rstrip("."))
+        if self.dot_run > self.max_dot_run:
+            raise MalformedOutput(f"Runaway ellipsis of more than {self.max_dot_run} dots")
+
+    def _check_lines(self, filename, lines):
+        if self.check_filenames and BAD_FILENAME.search(filename):
+            raise MalformedOutput(f"Not a bare path/to/filename line: {filename[:200]!r}")
+        if self.check_elisions:
+            for line in lines:
+                if ELISION.match(line):
+                    raise MalformedOutput(f"Content of {filename} left out: {line.strip()[:200]!r}")
+
+    def _update(self, blocks):
+        for filename, content in blocks:
+            self._check_lines(filename, content.split("\n")[self.checked_lines:])
+            self.checked_lines = 0
+            self.files.append({filename: content})
+            if self.on_block is not None:
+                self.on_block(filename, content)
+        parser = self.parser
+        if parser.filename is not None:
+            self._check_lines(parser.filename, parser.lines[self.checked_lines:])
+            self.checked_lines = len(parser.lines)
+        elif self.max_unnamed_lines and parser.unnamed_lines > self.max_unnamed_lines and parser.stack:
+            raise MalformedOutput(f"Code block of more than {self.max_unnamed_lines} lines without a filename line")
+
+    def feed(self, delta):
+        if self.max_dot_run:
+            self._check_dots(delta)
+        self._update(self.parser.feed(delta))
+
+    def close(self):
+        self._update(self.parser.close())
+        if self.require_files and not self.files:
+            raise MalformedOutput("No path/to/filename file block in the reply")
+
+
 def parse_file_content(text):
+    """
+    {filename: content} of the fenced files in text; here any non-blank line can name a file.
+    """
+    parser = FileBlockParser(require_dot=False)
+    return dict(parser.feed(text) + parser.close())
+
+
+def parse_stacked_content(text, partial=False):
+    """
+    [{filename: content}, ...] of the file blocks of a model response, in order. With
+    partial=True a last block cut off before its closing fence is included as well.
+    """
+    parser = FileBlockParser()
+    blocks = parser.feed(text) + parser.close()
+    if partial and parser.partial is not None:
+        blocks.append(parser.partial)
+    return [{filename: content} for filename, content in blocks]
+
+
+# the regex parsers the functions above replace, kept for bench_file_blocks.py
+def legacy_parse_file_content(text):
     if text == "":
         return {}
     # Pattern to match the format:
@@ -19,7 +251,7 @@ def parse_file_content(text):
         result[filename] = content        
     return result
 
-def parse_stacked_content(text):
+def legacy_parse_stacked_content(text):
     # more precise pattern matching
     pattern = r'(?:^|\n)([^\n]+\.[^\n]+)\n```.*\n((?:(?!```)[\s\S])*)\n```'
     